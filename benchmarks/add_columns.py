@@ -0,0 +1,73 @@
+"""
+Compares the vectorized extend_bulletin with the former
+row-by-row implementation on synthetic bulletins.
+
+Run from the project root: python -m benchmarks.add_columns
+"""
+import datetime
+import random
+import string
+import time
+
+import pandas as pd
+
+from src.parser.spimex_trading_results import extend_bulletin
+
+SIZES = (1_000, 10_000, 100_000)
+PATH = 'src/parser/tables/oil_xls_20250430162000.xls'
+
+
+def make_bulletin(rows: int, seed: int = 0) -> pd.DataFrame:
+    rnd = random.Random(seed)
+    letters = string.ascii_uppercase
+    product_ids = [
+        f'{rnd.choice(letters)}{rnd.randint(100, 999)}'
+        f'{"".join(rnd.choices(letters, k=3))}{rnd.randint(0, 999):03d}{rnd.choice("AFJK")}'
+        for _ in range(rows)
+    ]
+    return pd.DataFrame({
+        'exchange_product_id': product_ids,
+        'exchange_product_name': ['Бензин (АИ-92-К5) по ГОСТ'] * rows,
+        'delivery_basis_name': ['Ангарск-группа станций'] * rows,
+        'volume': ['600'] * rows,
+        'total': ['24775140'] * rows,
+        'count': ['10'] * rows,
+    })
+
+
+def legacy_add_columns(dataframes: dict[str, pd.DataFrame]) -> None:
+    for path, df in dataframes.items():
+        date = '{0}.{1}.{2}'.format(path[-12:-10], path[-14:-12], path[-18:-14])
+        df['date'] = datetime.datetime.strptime(date, '%d.%m.%Y').date()
+        df['created_on'] = datetime.date.today()
+        for index, row in df.iterrows():
+            df.loc[index, 'oil_id'] = row['exchange_product_id'][:4]
+            df.loc[index, 'delivery_basis_id'] = row['exchange_product_id'][4:7]
+            df.loc[index, 'delivery_type_id'] = row['exchange_product_id'][-1]
+
+
+def vectorized_add_columns(dataframes: dict[str, pd.DataFrame]) -> None:
+    for path, df in dataframes.items():
+        extend_bulletin(df, path)
+
+
+def measure(func, df: pd.DataFrame) -> tuple[float, pd.DataFrame]:
+    dataframes = {PATH: df.copy()}
+    started = time.perf_counter()
+    func(dataframes)
+    return time.perf_counter() - started, dataframes[PATH]
+
+
+def main() -> None:
+    for rows in SIZES:
+        df = make_bulletin(rows)
+        legacy_time, legacy_df = measure(legacy_add_columns, df)
+        vectorized_time, vectorized_df = measure(vectorized_add_columns, df)
+        pd.testing.assert_frame_equal(legacy_df, vectorized_df)
+        print(f'{rows:>7} rows: loop {legacy_time:8.3f}s, '
+              f'vectorized {vectorized_time:8.4f}s, '
+              f'x{legacy_time / vectorized_time:,.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+"""
+Compares getting parsed bulletins by decoding the .xls files
+(parse_bulletin) with reading them from the Parquet archive
+(load_bulletin over an up-to-date archive), which is what full
+reloads and python -m src.parser --from-archive do.
+Runs on the files in src/parser/tables/, or on synthetic bulletins
+generated in a temporary directory when there are none.
+
+Run from the project root: python -m benchmarks.archive_rebuild
+"""
+import os
+import tempfile
+import time
+
+from benchmarks.read_bulletins import write_synthetic_bulletins
+from src.parser.spimex_trading_results import TABLES_DIR, list_tables, load_bulletin, parse_bulletin
+
+
+def measure(name: str, read, paths: list[str]) -> float:
+    started = time.perf_counter()
+    rows = sum(len(read(path)) for path in paths)
+    elapsed = time.perf_counter() - started
+    print(f'{name}: {len(paths)} tables ({rows} rows) in {elapsed:.3f}s, {len(paths) / elapsed:.1f} tables/s')
+    return elapsed
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        paths = list_tables() if os.listdir(TABLES_DIR) else write_synthetic_bulletins(directory)
+        archive_dir = os.path.join(directory, 'archive')
+        for path in paths:
+            load_bulletin(path, archive_dir)
+
+        parsed = measure('xls decoding', parse_bulletin, paths)
+        archived = measure('parquet archive', lambda path: load_bulletin(path, archive_dir), paths)
+        print(f'archive is {parsed / archived:.1f}x faster')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Compares cache values of /dynamics responses at 1k, 10k and 50k rows: size,
+ratio to the baseline and encode/decode time of
+- baseline: fastapi_cache's JsonCoder encoding the response payload dict,
+  which is json.dumps text with non-ASCII characters escaped, the value
+  the cache stored before the endpoints answered with ORJSONResponse;
+- JsonCoder encoding the ORJSONResponse, which stores its orjson body as is;
+- CompressedCoder encoding the ORJSONResponse (orjson + zstd).
+The orjson body is rendered when the response is built, so encode times
+of the last two leave it out, as the endpoint renders it for the reply anyway.
+Rows are read from the bulletins in src/parser/tables/ when there are
+any, otherwise they are generated with bulletin-like codes, names and amounts.
+
+Run from the project root: python -m benchmarks.cache_coder
+"""
+import datetime
+import random
+import statistics
+import time
+
+from fastapi.responses import ORJSONResponse
+from fastapi_cache.coder import JsonCoder
+
+from src.cache import CompressedCoder
+from src.parser.spimex_trading_results import list_tables, parse_bulletin
+
+SIZES = (1_000, 10_000, 50_000)
+REPEATS = 5
+
+PRODUCTS = ('Бензин (АИ-92-К5) по ГОСТ', 'Бензин (АИ-95-К5) по ГОСТ', 'ДТ ЕВРО сорт C (ДТ-Л-К5)',
+            'ДТ ЕВРО класс 2 (ДТ-З-К5)', 'Мазут топочный М-100', 'Топливо для реактивных двигателей ТС-1',
+            'Сжиженный газ (пропан-бутан)', 'Битум нефтяной дорожный БНД 70/100')
+BASES = ('Ангарск-группа станций', 'СН КНПЗ', 'Пермь', 'ст. Новоярославская', 'Омск-группа станций',
+         'Кириши', 'Уфа-группа станций', 'Рязань НПЗ', 'ст. Комбинатская', 'Туапсе-экспорт')
+
+
+def bulletin_rows(amount: int) -> list[dict]:
+    rows = []
+    for file_path in list_tables():
+        rows += parse_bulletin(file_path).to_dict('records')
+        if len(rows) >= amount:
+            break
+    generator = random.Random(0)
+    date = datetime.date(2025, 1, 9)
+    while len(rows) < amount:
+        for number in range(500):
+            oil_id, basis_id, type_id = f'A{number % 97:03d}', f'{"ABCDEFGHIJ"[number % 10]}{number % 7:02d}', 'FAJK'[number % 4]
+            volume = generator.choice((60, 120, 600, 1200, 3000)) * generator.randint(1, 20)
+            rows.append({'exchange_product_id': f'{oil_id}{basis_id}{number % 1000:03d}{type_id}',
+                         'exchange_product_name': f'{PRODUCTS[number % len(PRODUCTS)]}, {BASES[number % len(BASES)]}',
+                         'oil_id': oil_id, 'delivery_basis_id': basis_id,
+                         'delivery_basis_name': BASES[number % len(BASES)], 'delivery_type_id': type_id,
+                         'volume': volume, 'total': volume * generator.randint(45_000, 75_000),
+                         'count': generator.randint(1, 40), 'date': date,
+                         'created_on': datetime.date(2025, 5, 1), 'updated_on': None})
+        date += datetime.timedelta(days=1)
+    return [{'id': number, **row} for number, row in enumerate(rows[:amount], start=1)]
+
+
+def timed(func, *args) -> tuple[float, object]:
+    durations, result = [], None
+    for _ in range(REPEATS):
+        started = time.perf_counter()
+        result = func(*args)
+        durations.append(time.perf_counter() - started)
+    return statistics.median(durations), result
+
+
+def main() -> None:
+    for size in SIZES:
+        payload = {'success': True, 'dynamics': bulletin_rows(size)}
+        response = ORJSONResponse(payload)
+        baseline_size = len(JsonCoder.encode(payload))
+        for name, coder, value in (('baseline, JsonCoder of json.dumps', JsonCoder, payload),
+                                   ('JsonCoder of orjson body', JsonCoder, response),
+                                   ('CompressedCoder', CompressedCoder, response)):
+            encode_time, encoded = timed(coder.encode, value)
+            decode_time, _ = timed(coder.decode, encoded)
+            print(f'{size} rows, {name}: {len(encoded) / 1024:.0f} KiB (x{baseline_size / len(encoded):.1f}), '
+                  f'encode {encode_time * 1000:.1f}ms, decode {decode_time * 1000:.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Compares GET /dynamics served by Postgres with the columnar snapshot
+engine (DYNAMICS_ENGINE=snapshot) at 1k, 10k and 50k returned rows,
+and for a year-long period filtered by oil_id and delivery_basis_id.
+Requests carry Cache-Control: no-cache, so every one of them reaches the engine.
+
+Seeds the test database, run from the project root with MODE=TEST:
+python -m benchmarks.dynamics_snapshot
+"""
+import asyncio
+import datetime
+import statistics
+import tempfile
+import time
+
+from fastapi import FastAPI
+from fastapi_cache import FastAPICache
+from fastapi_cache.backends.inmemory import InMemoryBackend
+from httpx import ASGITransport, AsyncClient
+
+from benchmarks.read_endpoints import PRODUCTS, START_DATE, seed
+from src.api import main_router
+from src.config import settings
+from src.database import engine
+from src.snapshot import refresh_snapshot
+
+# name: (query params, amount of requests)
+QUERIES = {
+    f'{rows // PRODUCTS} days': ({'start_date': START_DATE.isoformat(),
+                      'end_date': (START_DATE + datetime.timedelta(days=rows // PRODUCTS - 1)).isoformat()}, requests)
+    for rows, requests in ((1_000, 50), (10_000, 10), (50_000, 3))
+}
+QUERIES['year by oil_id and delivery_basis_id'] = ({'start_date': START_DATE.isoformat(),
+                                                'end_date': (START_DATE + datetime.timedelta(days=365)).isoformat(),
+                                                'oil_id': 'A7', 'delivery_basis_id': 'B7'}, 50)
+
+
+async def measure(client: AsyncClient, params: dict, requests: int) -> tuple[float, float, int]:
+    latencies = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        response = await client.get('/dynamics', params=params, headers={'Cache-Control': 'no-cache'})
+        latencies.append(time.perf_counter() - started)
+    p99 = statistics.quantiles(latencies, n=100)[98] if len(latencies) > 1 else latencies[0]
+    return requests / sum(latencies), p99, len(response.json()['dynamics'])
+
+
+async def main() -> None:
+    await seed()
+    FastAPICache.init(InMemoryBackend(), prefix='benchmark-cache')
+    app = FastAPI()
+    app.include_router(main_router)
+
+    with tempfile.TemporaryDirectory() as directory:
+        settings.SNAPSHOT_DIR = directory
+        await refresh_snapshot()
+
+        async with AsyncClient(transport=ASGITransport(app=app), base_url='http://benchmark') as client:
+            for name, (params, requests) in QUERIES.items():
+                for dynamics_engine in ('postgres', 'snapshot'):
+                    settings.DYNAMICS_ENGINE = dynamics_engine
+                    rate, p99, rows = await measure(client, params, requests)
+                    print(f'{name} ({rows} rows), {dynamics_engine}: {rate:.1f} req/s, p99 {p99 * 1000:.1f}ms')
+    await engine.dispose()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,40 @@
+"""
+Measures how parsing bulletins (parse_bulletin) in a process pool, as
+URLManager.run_pipeline does, scales with the number of workers on
+synthetic bulletins.
+
+Run from the project root: python -m benchmarks.parse_tables
+"""
+import asyncio
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks.read_bulletins import write_synthetic_bulletins
+from src.parser.spimex_trading_results import parse_bulletin
+
+WORKERS = (1, 2, 4, 8)
+
+
+async def measure(workers: int, file_paths: list[str]) -> float:
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        await asyncio.gather(*(loop.run_in_executor(executor, parse_bulletin, file_path)
+                               for file_path in file_paths))
+    return time.perf_counter() - started
+
+
+async def main() -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        file_paths = write_synthetic_bulletins(directory)
+        files = len(file_paths)
+        baseline = None
+        for workers in WORKERS:
+            elapsed = await measure(workers, file_paths)
+            baseline = baseline or elapsed
+            print(f'{workers} workers: {elapsed:.3f}s for {files} files, speedup x{baseline / elapsed:.2f}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,87 @@
+"""
+Load test of the connection pool: GET /dynamics for a week of one oil id
+at 1 to 128 concurrent clients, comparing the previous engine (SQLAlchemy
+pool defaults, a ping on every checkout), the engine of the settings
+(build_engine) and the same without reused prepared statements.
+Prints p50 and p99 latency of requests and of pool checkouts per level.
+Requests carry Cache-Control: no-cache, so every one of them reaches the database.
+
+Seeds the test database, run from the project root with MODE=TEST:
+python -m benchmarks.pool_load
+"""
+import asyncio
+import datetime
+import statistics
+import time
+
+from fastapi import FastAPI
+from fastapi_cache import FastAPICache
+from fastapi_cache.backends.inmemory import InMemoryBackend
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from benchmarks.read_endpoints import START_DATE, seed
+from src.api import main_router
+from src.config import settings
+from src.database import build_engine, engine, get_session
+
+CONCURRENCY = (1, 8, 32, 64, 128)
+REQUESTS_PER_CLIENT = 20
+ENGINES = {'previous (5+10, ping always)': {'DB_POOL_SIZE': 5, 'DB_MAX_OVERFLOW': 10,
+                                           'DB_POOL_PRE_PING': 'always', 'DB_STATEMENT_CACHE_SIZE': 100},
+           'settings': {},
+           'settings, no prepared statements': {'DB_PREPARED_STATEMENTS': False}}
+PARAMS = {'start_date': START_DATE.isoformat(),
+          'end_date': (START_DATE + datetime.timedelta(days=6)).isoformat(),
+          'oil_id': 'A7'}
+
+
+def percentile(values: list[float], n: int) -> float:
+    return statistics.quantiles(values, n=100)[n - 1] if len(values) > 1 else values[0]
+
+
+async def measure(client: AsyncClient, clients: int) -> list[float]:
+    async def run_client() -> list[float]:
+        latencies = []
+        for _ in range(REQUESTS_PER_CLIENT):
+            started = time.perf_counter()
+            response = await client.get('/dynamics', params=PARAMS, headers={'Cache-Control': 'no-cache'})
+            latencies.append(time.perf_counter() - started)
+            assert response.status_code == 200
+        return latencies
+
+    return [latency for latencies in await asyncio.gather(*(run_client() for _ in range(clients)))
+            for latency in latencies]
+
+
+async def main() -> None:
+    await seed()
+    await engine.dispose()
+    FastAPICache.init(InMemoryBackend(), prefix='benchmark-cache')
+
+    for name, values in ENGINES.items():
+        load_engine = build_engine(settings.model_copy(update=values))
+        sessions = async_sessionmaker(load_engine, class_=AsyncSession, expire_on_commit=False)
+
+        async def get_load_session():
+            async with sessions() as session:
+                yield session
+
+        app = FastAPI()
+        app.include_router(main_router)
+        app.dependency_overrides[get_session] = get_load_session
+        async with AsyncClient(transport=ASGITransport(app=app), base_url='http://benchmark') as client:
+            await measure(client, 1)  # opens a connection and prepares the statement
+            for clients in CONCURRENCY:
+                pool = load_engine.pool
+                pool.waits.clear()
+                latencies = await measure(client, clients)
+                waits = list(pool.waits)
+                print(f'{name}, {clients} clients: p50 {percentile(latencies, 50) * 1000:.1f}ms, '
+                      f'p99 {percentile(latencies, 99) * 1000:.1f}ms, '
+                      f'checkout p99 {percentile(waits, 99) * 1000:.1f}ms, timeouts {pool.timeouts}')
+        await load_engine.dispose()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
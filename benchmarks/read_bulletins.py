@@ -0,0 +1,86 @@
+"""
+Compares the single-pass read_bulletin with the former two-pass
+pd.read_excel parsing of the former URLManager.convert_to_df on the files
+in src/parser/tables/. When the directory is empty, synthetic bulletins
+of a realistic size are generated in a temporary directory instead.
+
+Run from the project root: python -m benchmarks.read_bulletins
+"""
+import datetime
+import os
+import re
+import tempfile
+import time
+
+import pandas as pd
+import xlwt
+
+from src.parser.spimex_trading_results import TABLES_DIR, SEARCH_TONN, INSTRUMENT_CODE_PATTERN, read_bulletin
+
+SYNTHETIC_FILES = 20
+SYNTHETIC_ROWS = 500
+
+
+def legacy_read_bulletin(file_path: str) -> pd.DataFrame:
+    df = pd.read_excel(file_path, usecols='B:F,O', engine='xlrd')
+    tonn_index = df.loc[df.isin([SEARCH_TONN]).any(axis=1)].index.tolist()
+    new_df = pd.read_excel(file_path, header=tonn_index[0] + 2, usecols='B:F,O', skiprows=[tonn_index[0] + 3])
+    first_column_list = new_df['Код\nИнструмента'].tolist()
+    footer_index = 0
+    for code in first_column_list:
+        if not isinstance(code, str) or not re.match(INSTRUMENT_CODE_PATTERN, code):
+            footer_index = first_column_list.index(code)
+            break
+    return new_df[:footer_index - 1]
+
+
+def write_synthetic_bulletins(directory: str) -> list[str]:
+    paths = []
+    for number in range(SYNTHETIC_FILES):
+        workbook = xlwt.Workbook()
+        sheet = workbook.add_sheet('TRADE_SUMMARY')
+        sheet.write(6, 1, SEARCH_TONN)
+        for column in (1, 2, 3, 4, 5, 14):
+            sheet.write(7, column, 'Код\nИнструмента' if column == 1 else f'column {column}')
+        for column in range(6, 14):
+            sheet.write(8, column, 'Руб.')
+        for row in range(9, 9 + SYNTHETIC_ROWS):
+            for column, value in zip((1, 2, 3, 4, 5, 14),
+                                     (f'A592ANK{row:03d}F', 'Бензин (АИ-92-К5) по ГОСТ',
+                                      'Ангарск-группа станций', '600', '24775140', '10')):
+                sheet.write(row, column, value)
+            for column in range(6, 14):
+                sheet.write(row, column, '1')
+        sheet.write(9 + SYNTHETIC_ROWS, 1, 'Итого:')
+        date = datetime.date(2025, 1, 1) + datetime.timedelta(days=number)
+        path = os.path.join(directory, f'oil_xls_{date:%Y%m%d}162000.xls')
+        workbook.save(path)
+        paths.append(path)
+    return paths
+
+
+def measure(func, paths: list[str]) -> tuple[float, int]:
+    started = time.perf_counter()
+    rows = sum(len(func(path)) for path in paths)
+    return time.perf_counter() - started, rows
+
+
+def run(paths: list[str]) -> None:
+    legacy_time, legacy_rows = measure(legacy_read_bulletin, paths)
+    single_time, single_rows = measure(read_bulletin, paths)
+    print(f'{len(paths)} files: two-pass {legacy_time:.3f}s ({legacy_rows} rows), '
+          f'single-pass {single_time:.3f}s ({single_rows} rows), x{legacy_time / single_time:.1f}')
+
+
+def main() -> None:
+    paths = [f'{TABLES_DIR}{name}' for name in sorted(os.listdir(TABLES_DIR)) if name.endswith('.xls')]
+    if paths:
+        run(paths)
+        return
+    print(f'{TABLES_DIR} is empty, using synthetic bulletins')
+    with tempfile.TemporaryDirectory() as directory:
+        run(write_synthetic_bulletins(directory))
+
+
+if __name__ == '__main__':
+    main()
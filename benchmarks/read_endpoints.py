@@ -0,0 +1,102 @@
+"""
+Compares GET /dynamics on column selects with orjson responses against
+the previous path (ORM instances through jsonable_encoder) at 1k, 10k
+and 50k returned rows. Requests carry Cache-Control: no-cache, so every
+one of them reaches the database.
+
+Seeds the test database, run from the project root with MODE=TEST:
+python -m benchmarks.read_endpoints
+"""
+import asyncio
+import datetime
+import statistics
+import time
+
+from fastapi import APIRouter, FastAPI
+from fastapi_cache import FastAPICache
+from fastapi_cache.backends.inmemory import InMemoryBackend
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy import select, text
+
+from src.api import main_router
+from src.api.dependencies import SessionDep
+from src.config import settings
+from src.database import BaseModel, Session, engine
+from src.models.spimex_trading_results import SpimexTradingResult
+
+PRODUCTS = 200
+DAYS = 250
+START_DATE = datetime.date(2024, 1, 1)
+# returned rows: amount of requests
+SIZES = {1_000: 50, 10_000: 10, 50_000: 3}
+
+legacy_router = APIRouter()
+
+
+@legacy_router.get('/legacy/dynamics')
+async def legacy_dynamics(session: SessionDep, start_date: datetime.date, end_date: datetime.date):
+    stmt = await session.execute(select(SpimexTradingResult)
+                                 .where(SpimexTradingResult.date.between(start_date, end_date)))
+    return {'success': True, 'dynamics': stmt.scalars().all()}
+
+
+async def seed() -> None:
+    assert settings.MODE == 'TEST'
+    async with engine.begin() as conn:
+        await conn.run_sync(BaseModel.metadata.drop_all)
+        await conn.run_sync(BaseModel.metadata.create_all)
+    async with Session() as session:
+        await session.execute(text(f"""
+            INSERT INTO spimex_instruments (id, exchange_product_id, exchange_product_name)
+            SELECT p + 1, 'P' || p, 'product ' || p FROM generate_series(0, {PRODUCTS - 1}) AS p
+        """))
+        await session.execute(text("""
+            INSERT INTO spimex_delivery_bases (id, delivery_basis_name)
+            SELECT b + 1, 'basis ' || b FROM generate_series(0, 29) AS b
+        """))
+        await session.execute(text(f"""
+            INSERT INTO spimex_trading_results
+                (exchange_product_id, instrument_key, oil_id, delivery_basis_id,
+                 delivery_basis_key, delivery_type_id, volume, total, count, date, created_on)
+            SELECT 'P' || p, p + 1, 'A' || (p % 40), 'B' || (p % 30),
+                   p % 30 + 1, chr(65 + p % 5), 60, 4500000, 1,
+                   DATE '{START_DATE}' + d, CURRENT_DATE
+            FROM generate_series(0, {DAYS - 1}) AS d, generate_series(0, {PRODUCTS - 1}) AS p
+        """))
+        await session.execute(text('ANALYZE'))
+        await session.commit()
+
+
+async def measure(client: AsyncClient, path: str, rows: int, requests: int) -> tuple[float, float]:
+    end_date = START_DATE + datetime.timedelta(days=rows // PRODUCTS - 1)
+    params = {'start_date': START_DATE.isoformat(), 'end_date': end_date.isoformat()}
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(requests):
+        request_started = time.perf_counter()
+        response = await client.get(path, params=params, headers={'Cache-Control': 'no-cache'})
+        latencies.append(time.perf_counter() - request_started)
+        assert len(response.json()['dynamics']) == rows
+    elapsed = time.perf_counter() - started
+    p99 = statistics.quantiles(latencies, n=100)[98] if len(latencies) > 1 else latencies[0]
+    return requests / elapsed, p99
+
+
+async def main() -> None:
+    await seed()
+    FastAPICache.init(InMemoryBackend(), prefix='benchmark-cache')
+    app = FastAPI()
+    app.include_router(main_router)
+    app.include_router(legacy_router)
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url='http://benchmark') as client:
+        for rows, requests in SIZES.items():
+            for name, path in (('orm + jsonable_encoder', '/legacy/dynamics'),
+                               ('columns + orjson', '/dynamics')):
+                rate, p99 = await measure(client, path, rows, requests)
+                print(f'{rows} rows, {name}: {rate:.1f} req/s, p99 {p99 * 1000:.1f}ms')
+    await engine.dispose()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
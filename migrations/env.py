@@ -0,0 +1,58 @@
+import asyncio
+from logging.config import fileConfig
+
+from alembic import context
+from sqlalchemy.engine import Connection
+
+from src.config import settings
+from src.database import BaseModel, engine, include_name
+from src.models import (spimex_daily_aggregates, spimex_delivery_bases, spimex_ingest_manifest,  # noqa: F401
+                        spimex_ingest_runs, spimex_instruments, spimex_pending_downloads,
+                        spimex_trading_results)  # registers the tables
+
+config = context.config
+
+if config.config_file_name is not None and config.attributes.get('connection') is None:
+    fileConfig(config.config_file_name)
+
+target_metadata = BaseModel.metadata
+
+
+def run_migrations_offline() -> None:
+    context.configure(url=settings.DB_URL,
+                      target_metadata=target_metadata,
+                      include_name=include_name,
+                      literal_binds=True,
+                      dialect_opts={'paramstyle': 'named'})
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def do_run_migrations(connection: Connection) -> None:
+    context.configure(connection=connection, target_metadata=target_metadata, include_name=include_name)
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+async def run_async_migrations() -> None:
+    async with engine.connect() as connection:
+        await connection.run_sync(do_run_migrations)
+    await engine.dispose()
+
+
+def run_migrations_online() -> None:
+    """
+    Runs migrations on the connection passed by create_db through
+    config.attributes, or opens its own one when called from the alembic CLI
+    """
+    connection = config.attributes.get('connection')
+    if connection is None:
+        asyncio.run(run_async_migrations())
+    else:
+        do_run_migrations(connection)
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
@@ -0,0 +1,57 @@
+"""initial schema
+
+Creates the tables as they were created by BaseModel.metadata.create_all
+before migrations were introduced. Databases that already have them are
+left untouched, so this revision just adopts them.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table('spimex_trading_results'):
+        op.create_table('spimex_trading_results',
+                        sa.Column('id', sa.Integer(), nullable=False),
+                        sa.Column('exchange_product_id', sa.String(), nullable=False),
+                        sa.Column('exchange_product_name', sa.String(length=255), nullable=False),
+                        sa.Column('oil_id', sa.String(length=10), nullable=False),
+                        sa.Column('delivery_basis_id', sa.String(length=10), nullable=False),
+                        sa.Column('delivery_basis_name', sa.String(length=64), nullable=False),
+                        sa.Column('delivery_type_id', sa.String(length=10), nullable=False),
+                        sa.Column('volume', sa.String(length=255), nullable=False),
+                        sa.Column('total', sa.String(length=255), nullable=False),
+                        sa.Column('count', sa.String(length=255), nullable=False),
+                        sa.Column('date', sa.Date(), nullable=False),
+                        sa.Column('created_on', sa.Date(), nullable=False),
+                        sa.Column('updated_on', sa.Date(), nullable=True),
+                        sa.PrimaryKeyConstraint('id'))
+    if not inspector.has_table('spimex_ingest_manifest'):
+        op.create_table('spimex_ingest_manifest',
+                        sa.Column('file_name', sa.String(length=64), nullable=False),
+                        sa.Column('date', sa.Date(), nullable=False),
+                        sa.Column('content_hash', sa.String(length=64), nullable=False),
+                        sa.Column('rows', sa.Integer(), nullable=False),
+                        sa.Column('loaded_on', sa.DateTime(timezone=True), nullable=False),
+                        sa.PrimaryKeyConstraint('file_name'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('spimex_ingest_manifest')
+    op.drop_table('spimex_trading_results')
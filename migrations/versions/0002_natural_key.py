@@ -0,0 +1,43 @@
+"""natural key for trading results
+
+Ids used to be assigned by the parser as a running counter over the
+tables directory, so the same trade could be stored several times under
+different ids. Keeps the oldest copy of every (date, exchange_product_id),
+makes that pair unique and hands id generation back to the sequence.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute('DELETE FROM spimex_trading_results duplicate '
+               'USING spimex_trading_results original '
+               'WHERE duplicate.date = original.date '
+               'AND duplicate.exchange_product_id = original.exchange_product_id '
+               'AND duplicate.id > original.id')
+    op.create_unique_constraint('uq_spimex_trading_results_date_exchange_product_id',
+                                'spimex_trading_results',
+                                ['date', 'exchange_product_id'])
+    op.execute("SELECT setval(pg_get_serial_sequence('spimex_trading_results', 'id'), "
+               "COALESCE(MAX(id), 0) + 1, false) FROM spimex_trading_results")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint('uq_spimex_trading_results_date_exchange_product_id',
+                       'spimex_trading_results',
+                       type_='unique')
@@ -0,0 +1,44 @@
+"""numeric volume, total and count
+
+Converts the text columns in place. Values are stripped of digit group
+separators and go through numeric, so '600' and '600.0' both become 600.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+COLUMNS = {'volume': sa.BigInteger(), 'total': sa.BigInteger(), 'count': sa.Integer()}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for column, type_ in COLUMNS.items():
+        op.alter_column('spimex_trading_results', column,
+                        type_=type_,
+                        existing_type=sa.String(length=255),
+                        existing_nullable=False,
+                        postgresql_using=f"round(regexp_replace({column}, '\\s', '', 'g')::numeric)"
+                                         f"::{type_.compile(dialect=op.get_bind().dialect)}")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for column, type_ in COLUMNS.items():
+        op.alter_column('spimex_trading_results', column,
+                        type_=sa.String(length=255),
+                        existing_type=type_,
+                        existing_nullable=False,
+                        postgresql_using=f'{column}::varchar')
@@ -0,0 +1,37 @@
+"""indexes for the read endpoints
+
+Date ranges, max(date) and GROUP BY date ORDER BY date DESC are served by
+the (date, exchange_product_id) unique index. The selective oil_id and
+delivery_basis_id filters get (column, date) indexes, so a long period
+for one product or basis is read as one index range. delivery_type_id has
+only a handful of values and is left to a filter over the date index.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0004'
+down_revision: Union[str, None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_spimex_trading_results_oil_id_date',
+                    'spimex_trading_results', ['oil_id', 'date'])
+    op.create_index('ix_spimex_trading_results_delivery_basis_id_date',
+                    'spimex_trading_results', ['delivery_basis_id', 'date'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_spimex_trading_results_delivery_basis_id_date', 'spimex_trading_results')
+    op.drop_index('ix_spimex_trading_results_oil_id_date', 'spimex_trading_results')
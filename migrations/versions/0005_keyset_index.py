@@ -0,0 +1,31 @@
+"""(date, id) index for keyset pagination
+
+/dynamics pages are ordered by (date, id) and continue after the
+cursor with a row comparison, which this index answers without a sort.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0005'
+down_revision: Union[str, None] = '0004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_spimex_trading_results_date_id',
+                    'spimex_trading_results', ['date', 'id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_spimex_trading_results_date_id', 'spimex_trading_results')
@@ -0,0 +1,42 @@
+"""daily aggregates
+
+Per date, oil_id and delivery_basis_id amounts of trades, volume and total,
+backfilled from the results already stored. The parser keeps them current.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0006'
+down_revision: Union[str, None] = '0005'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('spimex_daily_aggregates',
+                    sa.Column('date', sa.Date(), nullable=False),
+                    sa.Column('oil_id', sa.String(length=10), nullable=False),
+                    sa.Column('delivery_basis_id', sa.String(length=10), nullable=False),
+                    sa.Column('rows', sa.Integer(), nullable=False),
+                    sa.Column('volume', sa.BigInteger(), nullable=False),
+                    sa.Column('total', sa.BigInteger(), nullable=False),
+                    sa.PrimaryKeyConstraint('date', 'oil_id', 'delivery_basis_id'))
+    op.execute('INSERT INTO spimex_daily_aggregates (date, oil_id, delivery_basis_id, rows, volume, total) '
+               'SELECT date, oil_id, delivery_basis_id, count(*), sum(volume), sum(total) '
+               'FROM spimex_trading_results '
+               'GROUP BY date, oil_id, delivery_basis_id')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('spimex_daily_aggregates')
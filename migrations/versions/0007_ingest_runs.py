@@ -0,0 +1,41 @@
+"""ingest runs
+
+One row per ingestion run with its status and progress,
+updated while it runs and read by /ingest_status.
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0007'
+down_revision: Union[str, None] = '0006'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('spimex_ingest_runs',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('trigger', sa.String(length=16), nullable=False),
+                    sa.Column('status', sa.String(length=16), nullable=False),
+                    sa.Column('started_on', sa.DateTime(timezone=True), nullable=False),
+                    sa.Column('finished_on', sa.DateTime(timezone=True), nullable=True),
+                    sa.Column('files_downloaded', sa.Integer(), nullable=False),
+                    sa.Column('tables', sa.Integer(), nullable=False),
+                    sa.Column('rows_affected', sa.Integer(), nullable=False),
+                    sa.Column('error', sa.Text(), nullable=True),
+                    sa.PrimaryKeyConstraint('id'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('spimex_ingest_runs')
@@ -0,0 +1,76 @@
+"""dimension tables
+
+Instrument and delivery basis names move out of the results table into
+spimex_instruments and spimex_delivery_bases, results refer to them by
+integer keys. Existing names are copied into the dimension tables first.
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18 17:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0008'
+down_revision: Union[str, None] = '0007'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('spimex_instruments',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('exchange_product_id', sa.String(), nullable=False),
+                    sa.Column('exchange_product_name', sa.String(length=255), nullable=False),
+                    sa.PrimaryKeyConstraint('id'),
+                    sa.UniqueConstraint('exchange_product_id', 'exchange_product_name',
+                                        name='uq_spimex_instruments_exchange_product_id_name'))
+    op.create_table('spimex_delivery_bases',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('delivery_basis_name', sa.String(length=64), nullable=False),
+                    sa.PrimaryKeyConstraint('id'),
+                    sa.UniqueConstraint('delivery_basis_name'))
+    op.execute('INSERT INTO spimex_instruments (exchange_product_id, exchange_product_name) '
+               'SELECT DISTINCT exchange_product_id, exchange_product_name FROM spimex_trading_results '
+               'ORDER BY exchange_product_id, exchange_product_name')
+    op.execute('INSERT INTO spimex_delivery_bases (delivery_basis_name) '
+               'SELECT DISTINCT delivery_basis_name FROM spimex_trading_results '
+               'ORDER BY delivery_basis_name')
+
+    op.add_column('spimex_trading_results', sa.Column('instrument_key', sa.Integer(), nullable=True))
+    op.add_column('spimex_trading_results', sa.Column('delivery_basis_key', sa.Integer(), nullable=True))
+    op.execute('UPDATE spimex_trading_results AS results '
+               'SET instrument_key = instruments.id, delivery_basis_key = bases.id '
+               'FROM spimex_instruments AS instruments, spimex_delivery_bases AS bases '
+               'WHERE instruments.exchange_product_id = results.exchange_product_id '
+               'AND instruments.exchange_product_name = results.exchange_product_name '
+               'AND bases.delivery_basis_name = results.delivery_basis_name')
+    op.alter_column('spimex_trading_results', 'instrument_key', nullable=False)
+    op.alter_column('spimex_trading_results', 'delivery_basis_key', nullable=False)
+    op.create_foreign_key(None, 'spimex_trading_results', 'spimex_instruments', ['instrument_key'], ['id'])
+    op.create_foreign_key(None, 'spimex_trading_results', 'spimex_delivery_bases', ['delivery_basis_key'], ['id'])
+    op.drop_column('spimex_trading_results', 'exchange_product_name')
+    op.drop_column('spimex_trading_results', 'delivery_basis_name')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.add_column('spimex_trading_results', sa.Column('exchange_product_name', sa.String(length=255), nullable=True))
+    op.add_column('spimex_trading_results', sa.Column('delivery_basis_name', sa.String(length=64), nullable=True))
+    op.execute('UPDATE spimex_trading_results AS results '
+               'SET exchange_product_name = instruments.exchange_product_name, '
+               'delivery_basis_name = bases.delivery_basis_name '
+               'FROM spimex_instruments AS instruments, spimex_delivery_bases AS bases '
+               'WHERE instruments.id = results.instrument_key AND bases.id = results.delivery_basis_key')
+    op.alter_column('spimex_trading_results', 'exchange_product_name', nullable=False)
+    op.alter_column('spimex_trading_results', 'delivery_basis_name', nullable=False)
+    op.drop_column('spimex_trading_results', 'instrument_key')
+    op.drop_column('spimex_trading_results', 'delivery_basis_key')
+    op.drop_table('spimex_delivery_bases')
+    op.drop_table('spimex_instruments')
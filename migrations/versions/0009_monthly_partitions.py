@@ -0,0 +1,85 @@
+"""monthly partitions
+
+spimex_trading_results becomes a table partitioned by range of date, one
+partition per month plus a default one. Rows are copied into a new
+partitioned table which then replaces the old one; the primary key
+becomes (id, date), as unique keys have to include the partition key.
+Constraints and indexes are created after the copy.
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+import datetime
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0009'
+down_revision: Union[str, None] = '0008'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+COLUMNS = ('id, exchange_product_id, instrument_key, oil_id, delivery_basis_id, delivery_basis_key, '
+           'delivery_type_id, volume, total, count, date, created_on, updated_on')
+
+
+def results_table(name: str, **kwargs) -> None:
+    op.create_table(name,
+                    sa.Column('id', sa.Integer(), nullable=False,
+                              server_default=sa.text("nextval('spimex_trading_results_id_seq'::regclass)")),
+                    sa.Column('exchange_product_id', sa.String(), nullable=False),
+                    sa.Column('instrument_key', sa.Integer(), nullable=False),
+                    sa.Column('oil_id', sa.String(length=10), nullable=False),
+                    sa.Column('delivery_basis_id', sa.String(length=10), nullable=False),
+                    sa.Column('delivery_basis_key', sa.Integer(), nullable=False),
+                    sa.Column('delivery_type_id', sa.String(length=10), nullable=False),
+                    sa.Column('volume', sa.BigInteger(), nullable=False),
+                    sa.Column('total', sa.BigInteger(), nullable=False),
+                    sa.Column('count', sa.Integer(), nullable=False),
+                    sa.Column('date', sa.Date(), nullable=False),
+                    sa.Column('created_on', sa.Date(), nullable=False),
+                    sa.Column('updated_on', sa.Date(), nullable=True),
+                    **kwargs)
+
+
+def replace_results_table(primary_key: list[str], **kwargs) -> None:
+    op.execute('ALTER SEQUENCE spimex_trading_results_id_seq OWNED BY NONE')
+    op.rename_table('spimex_trading_results', 'spimex_trading_results_old')
+    results_table('spimex_trading_results', **kwargs)
+    if kwargs:
+        op.execute('CREATE TABLE spimex_trading_results_default PARTITION OF spimex_trading_results DEFAULT')
+        months = op.get_bind().execute(sa.text("SELECT DISTINCT date_trunc('month', date)::date "
+                                               "FROM spimex_trading_results_old")).scalars().all()
+        for month in months:
+            next_month = (month + datetime.timedelta(days=32)).replace(day=1)
+            op.execute(f'CREATE TABLE spimex_trading_results_y{month:%Y}m{month:%m} '
+                       f'PARTITION OF spimex_trading_results '
+                       f"FOR VALUES FROM ('{month}') TO ('{next_month}')")
+    op.execute(f'INSERT INTO spimex_trading_results ({COLUMNS}) SELECT {COLUMNS} FROM spimex_trading_results_old')
+    op.drop_table('spimex_trading_results_old')
+    op.execute('ALTER SEQUENCE spimex_trading_results_id_seq OWNED BY spimex_trading_results.id')
+
+    op.create_primary_key('spimex_trading_results_pkey', 'spimex_trading_results', primary_key)
+    op.create_unique_constraint('uq_spimex_trading_results_date_exchange_product_id', 'spimex_trading_results',
+                                ['date', 'exchange_product_id'])
+    op.create_index('ix_spimex_trading_results_date_id', 'spimex_trading_results', ['date', 'id'])
+    op.create_index('ix_spimex_trading_results_oil_id_date', 'spimex_trading_results', ['oil_id', 'date'])
+    op.create_index('ix_spimex_trading_results_delivery_basis_id_date', 'spimex_trading_results',
+                    ['delivery_basis_id', 'date'])
+    op.create_foreign_key(None, 'spimex_trading_results', 'spimex_instruments', ['instrument_key'], ['id'])
+    op.create_foreign_key(None, 'spimex_trading_results', 'spimex_delivery_bases', ['delivery_basis_key'], ['id'])
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    replace_results_table(['id', 'date'], postgresql_partition_by='RANGE (date)')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    replace_results_table(['id'])
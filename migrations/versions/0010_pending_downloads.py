@@ -0,0 +1,37 @@
+"""pending downloads
+
+Tables found by a crawl that have not been downloaded, requested
+again by the next ingestion until they are.
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-18 20:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0010'
+down_revision: Union[str, None] = '0009'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('spimex_pending_downloads',
+                    sa.Column('url', sa.String(length=255), nullable=False),
+                    sa.Column('date', sa.Date(), nullable=False),
+                    sa.Column('attempts', sa.Integer(), nullable=False),
+                    sa.Column('error', sa.Text(), nullable=True),
+                    sa.Column('failed_on', sa.DateTime(timezone=True), nullable=False),
+                    sa.PrimaryKeyConstraint('url'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('spimex_pending_downloads')
@@ -0,0 +1,30 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import ORJSONResponse
+
+from src.api import service
+from src.api.dependencies import SessionDep
+
+router = APIRouter(default_response_class=ORJSONResponse)
+
+
+@router.get('/ingest_status',
+            tags=['Загрузка результатов торгов'],
+            summary='Получить состояние последних загрузок'
+            )
+async def get_ingest_status(session: SessionDep, amount: int = 1) -> ORJSONResponse:
+    """
+    Endpoint that provides GET-query to get the last ingestion runs:
+    their status, progress and error if any. Not cached, a running
+    ingestion updates its progress while it goes
+
+    :param session: database AsyncSession
+    :param amount: amount of runs that will be shown
+
+    :return: a JSON response containing a bool value
+    of success and runs, newest first
+    """
+    try:
+        runs = await service.get_ingest_runs(session, amount)
+        return ORJSONResponse({'success': True, 'runs': [dict(run) for run in runs]})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f'{e}')
@@ -1,36 +1,75 @@
 import datetime
-from typing import Optional
+from typing import AsyncIterator, Optional
 
-from sqlalchemy import select, desc, and_, func, Sequence, RowMapping, Row
+from sqlalchemy import select, desc, and_, func, tuple_, Select, Sequence, RowMapping, Row
 
+from src.cache import invalidate_cache
+from src.config import settings
+from src.database import Session
+from src.models.spimex_daily_aggregates import SpimexDailyAggregate
+from src.models.spimex_ingest_runs import SpimexIngestRun
+from src.models.spimex_results import RESULT_COLUMNS, select_results
 from src.models.spimex_trading_results import SpimexTradingResult
 from src.parser.spimex_trading_results import URLManager
+from src.snapshot import current_snapshot, refresh_snapshot
 from src.api.dependencies import SessionDep
 
+RESULT_FIELDS = tuple(RESULT_COLUMNS)
+KEY_FIELDS = ('id', 'date')
 
-async def parse_spimex(parser: URLManager()) -> None:
+
+async def parse_spimex(parser: URLManager(), incremental: bool = True) -> None:
     """
     Parsing spimex.com to get a trading results data for
     a period from 2023-01-09 until last result
     Checks if database date is relevant: if the last date in db
-    is equal to last date on spimex.com, only prints a message
+    is equal to last date on spimex.com, only prints a message.
+    Cached responses are invalidated once ingestion has changed rows
 
     :param parser: URLManager class object that provides parsing methods
+    :param incremental: ingest only new and changed tables, every downloaded one otherwise
 
     :return: None
     move data directly to the database
     """
     relevant = await parser.get_data_from_query()
-    if not relevant:
-        await parser.download_tables()
-        parser.convert_to_df()
-        parser.validate_tables()
-        parser.add_columns()
-        await parser.load_to_db()
+    if not relevant or not incremental:
+        rows_affected = await parser.run_pipeline(incremental)
+        if rows_affected:
+            await publish_changes()
     else:
         print('Database has relevant data')
 
 
+async def rebuild_spimex(parser: URLManager) -> None:
+    """
+    Loads trading results from the local Parquet archive of parsed
+    bulletins, without requests to spimex.com or .xls decoding.
+    Cached responses are invalidated once it has changed rows
+
+    :param parser: URLManager class object that provides parsing methods
+
+    :return: None
+    move data directly to the database
+    """
+    rows_affected = await parser.rebuild_from_archive()
+    if rows_affected:
+        await publish_changes()
+
+
+async def publish_changes() -> None:
+    """
+    Makes rows changed by ingestion visible to readers: the /dynamics
+    snapshot is rebuilt when it serves reads, then cached responses are dropped.
+    Runs within run_ingest, so only the holder of the ingest lock writes snapshots
+
+    :return: None
+    """
+    if settings.DYNAMICS_ENGINE == 'snapshot':
+        await refresh_snapshot()
+    await invalidate_cache()
+
+
 # список дат последних торговых дней (фильтрация по кол-ву последних торговых дней).
 async def get_last_trading_dates(session: SessionDep, amount_of_days: int) -> Sequence[Row | RowMapping]:
     """
@@ -60,9 +99,16 @@ async def get_dynamics(session: SessionDep,
                        oil_id: Optional[str | None] = None,
                        delivery_type_id: Optional[str | None] = None,
                        delivery_basis_id: Optional[str | None] = None,
-                       ) -> Sequence[Row | RowMapping]:
+                       limit: Optional[int] = None,
+                       cursor: Optional[str] = None,
+                       fields: Optional[list[str]] = None
+                       ) -> Sequence[RowMapping]:
     """
-    Receiving trading result for a specified period from database
+    Receiving trading result for a specified period from database.
+    Results are ordered by (date, id), so a page of them ends with the row
+    whose cursor continues the listing. With settings.DYNAMICS_ENGINE set to
+    snapshot they are read from the columnar snapshot (src/snapshot.py)
+    once it has been built, the session is not used then
 
     :param session: database AsyncSession
     :param start_date: datetime object, provides the upper border of a period
@@ -70,11 +116,88 @@ async def get_dynamics(session: SessionDep,
     :param oil_id: value from database, using to filter the result, not required
     :param delivery_type_id: value from database, using to filter the result, not required
     :param delivery_basis_id: value from database, using to filter the result, not required
+    :param limit: maximum amount of results, all of them if not specified
+    :param cursor: cursor of the last result of a previous page, not required
+    :param fields: names of the columns to return, all of them if not specified
 
-    :return: database response - Sequence[Row | RowMapping]
+    :return: database response - Sequence[RowMapping]
     """
-    if start_date > end_date:
-        raise ValueError('Start date must be less or equal to the end date.')
+    if settings.DYNAMICS_ENGINE == 'snapshot' and (snapshot := current_snapshot()) is not None:
+        check_period(start_date, end_date)
+        return snapshot.query(start_date, end_date,
+                              {'oil_id': oil_id,
+                               'delivery_type_id': delivery_type_id,
+                               'delivery_basis_id': delivery_basis_id},
+                              [column.key for column in result_columns(fields)],
+                              after=decode_cursor(cursor) if cursor is not None else None,
+                              limit=limit)
+
+    query = dynamics_query(start_date, end_date, oil_id, delivery_type_id, delivery_basis_id, fields)
+    if cursor is not None:
+        query = query.where(tuple_(SpimexTradingResult.date, SpimexTradingResult.id) > decode_cursor(cursor))
+    if limit is not None:
+        query = query.limit(limit)
+
+    stmt = await session.execute(query)
+    results = stmt.mappings().all()
+    return results
+
+
+def stream_dynamics(start_date: datetime.date,
+                    end_date: datetime.date,
+                    oil_id: Optional[str | None] = None,
+                    delivery_type_id: Optional[str | None] = None,
+                    delivery_basis_id: Optional[str | None] = None,
+                    fields: Optional[list[str]] = None,
+                    chunk_size: int = 1000
+                    ) -> AsyncIterator[Sequence[RowMapping]]:
+    """
+    Streaming trading results for a specified period from database
+    through a server-side cursor, chunk by chunk.
+    Parameters are validated on call, the query runs on iteration
+    in its own session, as the response outlives the request dependencies
+
+    :param start_date: datetime object, provides the upper border of a period
+    :param end_date: datetime object, provides the lower border of a period
+    :param oil_id: value from database, using to filter the result, not required
+    :param delivery_type_id: value from database, using to filter the result, not required
+    :param delivery_basis_id: value from database, using to filter the result, not required
+    :param fields: names of the columns to return, all of them if not specified
+    :param chunk_size: amount of rows fetched from database at once
+
+    :return: async iterator over lists of result mappings
+    """
+    query = dynamics_query(start_date, end_date, oil_id, delivery_type_id, delivery_basis_id, fields)
+
+    async def chunks() -> AsyncIterator[Sequence[RowMapping]]:
+        async with Session() as session:
+            result = await session.stream(query.execution_options(yield_per=chunk_size))
+            async for partition in result.mappings().partitions():
+                yield partition
+
+    return chunks()
+
+
+def dynamics_query(start_date: datetime.date,
+                   end_date: datetime.date,
+                   oil_id: Optional[str | None] = None,
+                   delivery_type_id: Optional[str | None] = None,
+                   delivery_basis_id: Optional[str | None] = None,
+                   fields: Optional[list[str]] = None
+                   ) -> Select:
+    """
+    Building a query of trading results for a specified period, ordered by (date, id)
+
+    :param start_date: datetime object, provides the upper border of a period
+    :param end_date: datetime object, provides the lower border of a period
+    :param oil_id: value from database, using to filter the result, not required
+    :param delivery_type_id: value from database, using to filter the result, not required
+    :param delivery_basis_id: value from database, using to filter the result, not required
+    :param fields: names of the columns to return, all of them if not specified
+
+    :return: select statement
+    """
+    check_period(start_date, end_date)
 
     conditions = [SpimexTradingResult.date.between(start_date, end_date)]
 
@@ -86,17 +209,77 @@ async def get_dynamics(session: SessionDep,
 
     conditions += [column == value for column, value in filters.items() if value is not None]
 
-    stmt = await session.execute(select(SpimexTradingResult).where(and_(*conditions)))
-    results = stmt.scalars().all()
-    return results
+    return (select_results(result_columns(fields))
+            .where(and_(*conditions))
+            .order_by(SpimexTradingResult.date, SpimexTradingResult.id))
+
+
+def check_period(start_date: datetime.date, end_date: datetime.date) -> None:
+    """
+    Validating a requested period, raises ValueError if it ends before it starts
+
+    :param start_date: datetime object, provides the upper border of a period
+    :param end_date: datetime object, provides the lower border of a period
+
+    :return: None
+    """
+    if start_date > end_date:
+        raise ValueError('Start date must be less or equal to the end date.')
+
+
+def result_columns(fields: Optional[list[str]] = None) -> list:
+    """
+    Resolving a projection of trading results into columns (RESULT_COLUMNS).
+    id and date identify a result, so they are always returned.
+    Names of instruments and delivery bases come from the dimension tables,
+    which are joined only when these names are requested
+
+    :param fields: names of the columns to return, all of them if not specified
+
+    :return: list of columns in the RESULT_FIELDS order
+    """
+    if not fields:
+        return list(RESULT_COLUMNS.values())
+    unknown = set(fields) - set(RESULT_FIELDS)
+    if unknown:
+        raise ValueError(f'Unknown fields: {", ".join(sorted(unknown))}.')
+    wanted = set(fields) | set(KEY_FIELDS)
+    return [column for name, column in RESULT_COLUMNS.items() if name in wanted]
+
+
+def encode_cursor(result: RowMapping) -> str:
+    """
+    Making a pagination cursor pointing at a trading result
+
+    :param result: last trading result of a page
+
+    :return: cursor string like 2025-04-30.1234
+    """
+    return f'{result["date"].isoformat()}.{result["id"]}'
+
+
+def decode_cursor(cursor: str) -> tuple[datetime.date, int]:
+    """
+    Parsing a pagination cursor made by encode_cursor
+
+    :param cursor: cursor string
+
+    :return: (date, id) of the trading result the cursor points at
+    """
+    try:
+        date, id_ = cursor.split('.')
+        return datetime.date.fromisoformat(date), int(id_)
+    except ValueError:
+        raise ValueError(f'Invalid cursor: {cursor}.')
 
 
 # список последних торгов (фильтрация по oil_id, delivery_type_id, delivery_basis_id)
 async def get_trading_results(session: SessionDep,
                               oil_id: Optional[str | None] = None,
                               delivery_type_id: Optional[str | None] = None,
-                              delivery_basis_id: Optional[str | None] = None
-                              ) -> Sequence[Row | RowMapping]:
+                              delivery_basis_id: Optional[str | None] = None,
+                              fields: Optional[list[str]] = None
+                              ) -> Sequence[RowMapping]:
     """
     Receiving last trading results from database
 
@@ -104,8 +287,9 @@ async def get_trading_results(session: SessionDep,
     :param oil_id: value from database, using to filter the result, not required
     :param delivery_type_id: value from database, using to filter the result, not required
     :param delivery_basis_id: value from database, using to filter the result, not required
+    :param fields: names of the columns to return, all of them if not specified
 
-    :return: database response - Sequence[Row | RowMapping]
+    :return: database response - Sequence[RowMapping]
     """
     newest_date_subquery = select(func.max(SpimexTradingResult.date)).scalar_subquery()
     conditions = [SpimexTradingResult.date == newest_date_subquery]
@@ -118,6 +302,63 @@ async def get_trading_results(session: SessionDep,
 
     conditions += [column == value for column, value in filters.items() if value is not None]
 
-    stmt = await session.execute(select(SpimexTradingResult).where(and_(*conditions)))
-    results = stmt.scalars().all()
+    stmt = await session.execute(select_results(result_columns(fields)).where(and_(*conditions)))
+    results = stmt.mappings().all()
+    return results
+
+
+# сводка торгов по дням (фильтрация по oil_id, delivery_basis_id, start_date, end_date)
+async def get_aggregates(session: SessionDep,
+                         start_date: datetime.date,
+                         end_date: datetime.date,
+                         oil_id: Optional[str | None] = None,
+                         delivery_basis_id: Optional[str | None] = None
+                         ) -> Sequence[RowMapping]:
+    """
+    Receiving daily aggregates for a specified period from database:
+    amount of trades, summed volume and total per date, oil_id and delivery_basis_id
+
+    :param session: database AsyncSession
+    :param start_date: datetime object, provides the upper border of a period
+    :param end_date: datetime object, provides the lower border of a period
+    :param oil_id: value from database, using to filter the result, not required
+    :param delivery_basis_id: value from database, using to filter the result, not required
+
+    :return: database response - Sequence[RowMapping]
+    """
+    check_period(start_date, end_date)
+
+    conditions = [SpimexDailyAggregate.date.between(start_date, end_date)]
+
+    filters = {
+        SpimexDailyAggregate.oil_id: oil_id,
+        SpimexDailyAggregate.delivery_basis_id: delivery_basis_id
+    }
+
+    conditions += [column == value for column, value in filters.items() if value is not None]
+
+    stmt = await session.execute(select(*SpimexDailyAggregate.__table__.columns)
+                                 .where(and_(*conditions))
+                                 .order_by(SpimexDailyAggregate.date,
+                                           SpimexDailyAggregate.oil_id,
+                                           SpimexDailyAggregate.delivery_basis_id))
+    results = stmt.mappings().all()
     return results
+
+
+async def get_ingest_runs(session: SessionDep, amount: int) -> Sequence[RowMapping]:
+    """
+    Receiving a specified amount of last ingestion runs from database
+
+    :param session: database AsyncSession
+    :param amount: integer value of amount of runs need to get
+
+    :return: database response - Sequence[RowMapping], newest run first
+    """
+    if amount <= 0:
+        raise ValueError("Amount of runs must be positive.")
+
+    stmt = await session.execute(select(*SpimexIngestRun.__table__.columns)
+                                 .order_by(desc(SpimexIngestRun.id))
+                                 .limit(amount))
+    return stmt.mappings().all()
@@ -1,18 +1,25 @@
+import csv
 import datetime
-from typing import Optional
-from urllib.parse import urlparse
+import hashlib
+import io
+import json
+from typing import Any, AsyncIterator, Literal, Optional
 
 from starlette.requests import Request
-from starlette.responses import Response
+from starlette.responses import Response, StreamingResponse
 
-from fastapi import APIRouter, HTTPException
-
-from fastapi_cache.decorator import cache
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import ORJSONResponse
+from fastapi_cache import FastAPICache
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.api import service
+from src.cache import cached, data_version
 from src.api.dependencies import SessionDep
+from src.database import engine
 
-router = APIRouter()
+# cache hits return the decoded payload, it is serialized with orjson as well
+router = APIRouter(default_response_class=ORJSONResponse)
 
 
 def cache_key_builder(
@@ -25,7 +32,12 @@ def cache_key_builder(
 ) -> str:
     """
     Creates a key for a cache note in Redis, making it unique.
-    Solves an adding a note in Redis when it already exists problem.
+    Equivalent calls share a key: the session and None values are dropped,
+    dates are written in ISO format, fields are deduplicated and sorted
+    (see canonical_fields) and params are sorted by name before
+    hashing them with the data version (see src.cache.data_version) into
+    a fixed-length digest after a readable prefix,
+    like api:cache:trading_results:get_dynamics:<32 hex digits>
 
     :param func: function to wrap
     :param namespace: a name for a note in Redis
@@ -36,23 +48,48 @@ def cache_key_builder(
 
     :return: string cache key used for name a note in Redis
     """
-    try:
-        del kwargs['kwargs']['session']
-    except KeyError:  # pragma: no cover
-        pass
-    if request:
-        parsed = urlparse(str(request.url))
-        cache_key = f"{namespace}:{func.__module__}:{func.__name__}:{parsed.path}:{args}:{kwargs}"
-    else:
-        cache_key = f"{namespace}:{func.__module__}:{func.__name__}:{args}:{kwargs}"  # pragma: no cover
-    return cache_key
+    params = {name: canonical_fields(value) if name == 'fields' else canonical_param(value)
+              for name, value in kwargs.get('kwargs', {}).items()
+              if value is not None and not isinstance(value, AsyncSession)}
+    params = {name: value for name, value in params.items() if value is not None}
+    payload = json.dumps([data_version(), canonical_param(kwargs.get('args', ())), params],
+                         sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    digest = hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+    return f"{namespace}:{func.__name__}:{digest}"
+
+
+def canonical_param(value: Any) -> Any:
+    """
+    Normalizes a param value for a cache key
+
+    :param value: param value
+
+    :return: dates and datetimes in ISO format, sequences as lists, other values as is
+    """
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, (list, tuple)):
+        return [canonical_param(item) for item in value]
+    return value
+
+
+def canonical_fields(fields: str) -> Optional[list[str]]:
+    """
+    Normalizes a fields param for a cache key: columns are returned
+    in the same order whatever order they are requested in
+
+    :param fields: comma separated names of columns
+
+    :return: sorted unique names or None if there are none, like an omitted param
+    """
+    return sorted(set(split_fields(fields) or [])) or None
 
 
 # список дат последних торговых дней (фильтрация по кол-ву последних торговых дней).
 @router.get('/last_dates',
             tags=['Операции с результатами торгов'],
             summary='Получить список дат последних торговый дней')
-@cache(key_builder=cache_key_builder)
+@cached(key_builder=cache_key_builder)
 async def get_last_trading_dates(session: SessionDep, amount: int) -> dict[str, bool] | HTTPException:
     """
     Endpoint that provides GET-query to get a list of last trading days dates
@@ -65,7 +102,7 @@ async def get_last_trading_dates(session: SessionDep, amount: int) -> dict[str,
     """
     try:
         last_dates = await service.get_last_trading_dates(session, amount)
-        return {'success': True, 'last_trading_dates': last_dates}
+        return ORJSONResponse({'success': True, 'last_trading_dates': list(last_dates)})
     except ValueError as e:
         raise HTTPException(status_code=400, detail=f'{e}')
 
@@ -76,18 +113,24 @@ async def get_last_trading_dates(session: SessionDep, amount: int) -> dict[str,
             tags=['Операции с результатами торгов'],
             summary='Получить список торгов за заданный период'
             )
-@cache(key_builder=cache_key_builder)
+@cached(key_builder=cache_key_builder)
 async def get_dynamics(session: SessionDep,
                        start_date: datetime.date, end_date: datetime.date,
                        oil_id: Optional[str | None] = None,
                        delivery_type_id: Optional[str | None] = None,
-                       delivery_basis_id: Optional[str | None] = None
+                       delivery_basis_id: Optional[str | None] = None,
+                       limit: Optional[int] = Query(None, gt=0, le=10_000),
+                       cursor: Optional[str] = None,
+                       fields: Optional[str] = None
                        ) -> dict[str, bool] | HTTPException:
     """
     Endpoint that provides GET-query to get a list of trades in some period,
     filtering by oil_id, delivery_type_id, delivery_basis_id optionally.
     Start_date and end_date params are required, because it's impossible to return
-    a list of trades for a specified period without specifying this period
+    a list of trades for a specified period without specifying this period.
+    With a limit the list is paginated: next_cursor is passed as cursor
+    to get the next page and is null on the last one.
+    Fields narrows the trades to the listed columns
 
     :param session: database AsyncSession
     :param start_date: starting date of a period, must be less than end_date, required
@@ -95,32 +138,108 @@ async def get_dynamics(session: SessionDep,
     :param oil_id: value from database, using to filter the result, not required
     :param delivery_type_id: value from database, using to filter the result, not required
     :param delivery_basis_id: value from database, using to filter the result, not required
+    :param limit: amount of trades on a page, not required
+    :param cursor: next_cursor of a previous page, not required
+    :param fields: comma separated names of columns to return, not required
 
-    :return: a dictionary that will be serialized into a JSON,
-    containing a bool value of success and trades data for
-    a specified period in string format
+    :return: a JSON response containing a bool value of success
+    and trades data for a specified period
     """
     try:
         dynamics = await service.get_dynamics(session,
                                               start_date, end_date,
-                                              oil_id, delivery_type_id, delivery_basis_id
+                                              oil_id, delivery_type_id, delivery_basis_id,
+                                              limit=limit, cursor=cursor, fields=split_fields(fields)
                                               )
-        return {'success': True, 'dynamics': dynamics}
+        content = {'success': True, 'dynamics': [dict(row) for row in dynamics]}
+        if limit is not None:
+            content['next_cursor'] = service.encode_cursor(dynamics[-1]) if len(dynamics) == limit else None
+        return ORJSONResponse(content)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=f'{e}')
 
 
+@router.get('/dynamics/export',
+            tags=['Операции с результатами торгов'],
+            summary='Выгрузить список торгов за заданный период'
+            )
+async def export_dynamics(start_date: datetime.date, end_date: datetime.date,
+                          oil_id: Optional[str | None] = None,
+                          delivery_type_id: Optional[str | None] = None,
+                          delivery_basis_id: Optional[str | None] = None,
+                          format: Literal['ndjson', 'csv'] = 'ndjson',
+                          fields: Optional[str] = None
+                          ) -> StreamingResponse:
+    """
+    Endpoint that provides GET-query to export trades in some period
+    as a stream of NDJSON lines or CSV rows, filtering the same way as /dynamics.
+    Rows are read from database and sent in chunks, so any period
+    is exported in bounded memory. Not cached
+
+    :param start_date: starting date of a period, must be less than end_date, required
+    :param end_date: ending date of a period, required
+    :param oil_id: value from database, using to filter the result, not required
+    :param delivery_type_id: value from database, using to filter the result, not required
+    :param delivery_basis_id: value from database, using to filter the result, not required
+    :param format: ndjson or csv, ndjson by default
+    :param fields: comma separated names of columns to return, not required
+
+    :return: streaming response with the trades
+    """
+    try:
+        chunks = service.stream_dynamics(start_date, end_date,
+                                         oil_id, delivery_type_id, delivery_basis_id,
+                                         fields=split_fields(fields))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f'{e}')
+    if format == 'csv':
+        return StreamingResponse(csv_lines(chunks), media_type='text/csv')
+    return StreamingResponse(ndjson_lines(chunks), media_type='application/x-ndjson')
+
+
+async def ndjson_lines(chunks: AsyncIterator) -> AsyncIterator[str]:
+    """
+    Serializing chunks of rows into NDJSON, one JSON object per line
+
+    :param chunks: async iterator over lists of row mappings
+
+    :return: async iterator over text chunks
+    """
+    async for rows in chunks:
+        yield ''.join(json.dumps(dict(row), default=str, ensure_ascii=False) + '\n' for row in rows)
+
+
+async def csv_lines(chunks: AsyncIterator) -> AsyncIterator[str]:
+    """
+    Serializing chunks of rows into CSV, with a header before the first row
+
+    :param chunks: async iterator over lists of row mappings
+
+    :return: async iterator over text chunks
+    """
+    header = True
+    async for rows in chunks:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if header:
+            writer.writerow(rows[0].keys())
+            header = False
+        writer.writerows(row.values() for row in rows)
+        yield buffer.getvalue()
+
+
 # список последних торгов (фильтрация по oil_id, delivery_type_id, delivery_basis_id)
 @router.get('/last_results',
             tags=['Операции с результатами торгов'],
             summary='Получить список последних торгов'
             )
-@cache(key_builder=cache_key_builder)
+@cached(key_builder=cache_key_builder)
 async def get_trading_results(session: SessionDep,
                               oil_id: Optional[str | None] = None,
                               delivery_type_id: Optional[str | None] = None,
-                              delivery_basis_id: Optional[str | None] = None
-                              ) -> dict[str, bool]:
+                              delivery_basis_id: Optional[str | None] = None,
+                              fields: Optional[str] = None
+                              ) -> dict[str, bool] | HTTPException:
     """
     Endpoint that provides GET-query to get a list of last trades (nearest to today),
     filtering by oil_id, delivery_type_id, delivery_basis_id optionally
@@ -131,12 +250,92 @@ async def get_trading_results(session: SessionDep,
     :param oil_id: value from database, using to filter the result, not required
     :param delivery_type_id: value from database, using to filter the result, not required
     :param delivery_basis_id: value from database, using to filter the result, not required
+    :param fields: comma separated names of columns to return, not required
 
-    :return: a dictionary that will be serialized into a JSON,
-    containing a bool value of success and last trades data in string format
+    :return: a JSON response containing a bool value of success and last trades data
+    """
+    try:
+        results = await service.get_trading_results(session,
+                                                    oil_id,
+                                                    delivery_type_id,
+                                                    delivery_basis_id,
+                                                    fields=split_fields(fields))
+        return ORJSONResponse({'success': True, 'last_trading_results': [dict(row) for row in results]})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f'{e}')
+
+
+# сводка торгов по дням (фильтрация по oil_id, delivery_basis_id, start_date, end_date)
+@router.get('/aggregates',
+            tags=['Операции с результатами торгов'],
+            summary='Получить сводку торгов по дням'
+            )
+@cached(key_builder=cache_key_builder)
+async def get_aggregates(session: SessionDep,
+                         start_date: datetime.date, end_date: datetime.date,
+                         oil_id: Optional[str | None] = None,
+                         delivery_basis_id: Optional[str | None] = None
+                         ) -> dict[str, bool] | HTTPException:
+    """
+    Endpoint that provides GET-query to get daily aggregates in some period:
+    amount of trades, summed volume and total per date, oil_id and delivery_basis_id,
+    filtering by oil_id, delivery_basis_id optionally.
+    Aggregates are precomputed while loading, the results table is not read
+
+    :param session: database AsyncSession
+    :param start_date: starting date of a period, must be less than end_date, required
+    :param end_date: ending date of a period, required
+    :param oil_id: value from database, using to filter the result, not required
+    :param delivery_basis_id: value from database, using to filter the result, not required
+
+    :return: a JSON response containing a bool value of success and aggregates
+    """
+    try:
+        aggregates = await service.get_aggregates(session, start_date, end_date, oil_id, delivery_basis_id)
+        return ORJSONResponse({'success': True, 'aggregates': [dict(row) for row in aggregates]})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f'{e}')
+
+
+@router.get('/cache_stats',
+            tags=['Кэш'],
+            summary='Получить счетчики попаданий в кэш'
+            )
+async def get_cache_stats() -> ORJSONResponse:
+    """
+    Endpoint that provides GET-query to get hit and miss counters
+    of every cache tier of this worker
+
+    :return: a JSON response containing a bool value of success
+    and the counters, null if the cache backend does not count them
+    """
+    return ORJSONResponse({'success': True, 'stats': getattr(FastAPICache.get_backend(), 'stats', None)})
+
+
+@router.get('/pool_stats',
+            tags=['База данных'],
+            summary='Получить состояние пула соединений'
+            )
+async def get_pool_stats() -> ORJSONResponse:
+    """
+    Endpoint that provides GET-query to get the state of the database
+    connection pool of this worker: its size, connections in use, checkouts,
+    checkouts timed out and percentiles of the time a checkout takes
+
+    :return: a JSON response containing a bool value of success
+    and the counters, null if the pool does not count them
+    """
+    return ORJSONResponse({'success': True, 'stats': getattr(engine.pool, 'stats', None)})
+
+
+def split_fields(fields: Optional[str]) -> Optional[list[str]]:
+    """
+    Parsing a fields query param like oil_id,volume,total
+
+    :param fields: comma separated names of columns
+
+    :return: list of names or None if not specified
     """
-    results = await service.get_trading_results(session,
-                                                oil_id,
-                                                delivery_type_id,
-                                                delivery_basis_id)
-    return {'success': True, 'last_trading_results': results}
+    if not fields:
+        return None
+    return [field.strip() for field in fields.split(',') if field.strip()]
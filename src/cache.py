@@ -0,0 +1,484 @@
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager, suppress
+from functools import wraps
+from inspect import Parameter, Signature, isawaitable, signature
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
+
+import orjson
+import zstandard
+from fastapi.encoders import jsonable_encoder
+from fastapi_cache import FastAPICache
+from fastapi_cache.backends.redis import RedisBackend
+from fastapi_cache.coder import Coder
+from fastapi_cache.types import Backend, KeyBuilder
+from redis import asyncio as aioredis
+from redis.exceptions import LockError
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.status import HTTP_304_NOT_MODIFIED
+
+from src.config import settings
+from src.database import Session
+
+# namespace of the endpoints that read trading results
+CACHE_NAMESPACE = 'trading_results'
+# Redis pub/sub channel telling every worker which entries to drop from memory
+INVALIDATION_CHANNEL = 'api:cache:invalidations'
+# Redis counter of changes to the trading results, part of their cache keys
+DATA_VERSION_KEY = 'api:cache:data_version'
+# first byte of values encoded by CompressedCoder
+PLAIN_MARKER = b'\x00'
+ZSTD_MARKER = b'\x01'
+
+REQUEST_PARAM = Parameter('_cache_request', Parameter.KEYWORD_ONLY, annotation=Request)
+RESPONSE_PARAM = Parameter('_cache_response', Parameter.KEYWORD_ONLY, annotation=Response)
+
+# computations in flight by cache key, awaited by concurrent identical requests
+_in_flight: dict[str, asyncio.Future] = {}
+# background revalidations, referenced until they are done
+_revalidations: set[asyncio.Task] = set()
+# data version this process builds cache keys with, see data_version
+_data_version = 0
+
+
+async def init_cache() -> 'TwoTierBackend':
+    """
+    Initializes FastAPICache with the two-tier backend over Redis and
+    starts listening to invalidations. Used by the app and by ingestion
+    run outside of it, which invalidates cached responses as well
+
+    :return: started TwoTierBackend, stop it on shutdown
+    """
+    redis = aioredis.from_url(f"redis://{settings.REDIS_HOST}")
+    backend = TwoTierBackend(RedisBackend(redis))
+    FastAPICache.init(backend, prefix="api:cache", coder=CompressedCoder)
+    await backend.load_data_version()
+    await backend.start()
+    return backend
+
+
+def data_version() -> int:
+    """
+    Version of the trading results data known to this process.
+    Cache keys of the trading results endpoints include it
+
+    :return: number of changes to the data, 0 before the first one
+    """
+    return _data_version
+
+
+async def invalidate_cache() -> None:
+    """
+    Makes cached responses of the trading results endpoints unreachable
+    by bumping the data version in their keys, every worker learns the new
+    version from the invalidation channel. Called after ingestion has changed
+    rows, so cached responses never outlive the data they were built from.
+    Nothing is deleted from Redis: a response computed from the old data and
+    stored after the bump lands under the old version, where nobody reads it,
+    and locks of computations in flight stay in place. Entries of old versions
+    expire in settings.CACHE_EXPIRE seconds
+
+    :return: None
+    """
+    backend = FastAPICache.get_backend()
+    redis = getattr(backend, 'redis', None)
+    version = _data_version + 1 if redis is None else await redis.incr(DATA_VERSION_KEY)
+    _set_data_version(backend, version)
+    if redis is not None:
+        await redis.publish(INVALIDATION_CHANNEL, json.dumps({'version': version}))
+    print(f'Cache has been invalidated, data version {version}')
+
+
+def _set_data_version(backend: Backend, version: int) -> None:
+    """
+    Switches this process to a data version, dropping the entries
+    of the previous one from memory, if the backend keeps them there
+
+    :param backend: FastAPICache backend
+    :param version: data version
+
+    :return: None
+    """
+    global _data_version
+    _data_version = version
+    if isinstance(backend, TwoTierBackend):
+        backend._clear_local(f'{FastAPICache.get_prefix()}:{CACHE_NAMESPACE}', None)
+
+
+class CompressedCoder(Coder):
+    """
+    FastAPICache coder storing responses as orjson, compressed with zstd
+    when they are longer than settings.CACHE_COMPRESS_THRESHOLD bytes.
+    Values start with a marker byte telling which of them it is;
+    JSON text stored by the default JsonCoder is decoded as well
+    """
+    _compressor = zstandard.ZstdCompressor(level=settings.CACHE_COMPRESS_LEVEL)
+    _decompressor = zstandard.ZstdDecompressor()
+
+    @classmethod
+    def encode(cls, value: Any) -> bytes:
+        body = value.body if isinstance(value, JSONResponse) else orjson.dumps(value, default=jsonable_encoder)
+        if len(body) <= settings.CACHE_COMPRESS_THRESHOLD:
+            return PLAIN_MARKER + body
+        return ZSTD_MARKER + cls._compressor.compress(body)
+
+    @classmethod
+    def decode(cls, value: bytes) -> Any:
+        marker, body = value[:1], value[1:]
+        if marker == ZSTD_MARKER:
+            return orjson.loads(cls._decompressor.decompress(body))
+        if marker == PLAIN_MARKER:
+            return orjson.loads(body)
+        return orjson.loads(value)
+
+
+class TwoTierBackend(Backend):
+    """
+    FastAPICache backend keeping recently used entries in process memory (L1)
+    in front of a shared backend such as RedisBackend (L2).
+    L1 is an LRU bounded by the total size of the values, its entries live
+    settings.CACHE_L1_TTL seconds at most and never past their L2 expiry.
+    Clearing is published to the Redis invalidation channel, so every
+    worker listening to it (see start) drops the entries from its L1 too,
+    data versions published by invalidate_cache are applied the same way
+    """
+    def __init__(self, backend: Backend, max_bytes: Optional[int] = None, ttl: Optional[float] = None,
+                 channel: str = INVALIDATION_CHANNEL):
+        self.backend = backend
+        self.max_bytes = max_bytes or settings.CACHE_L1_MAX_BYTES
+        self.ttl = ttl or settings.CACHE_L1_TTL
+        self.channel = channel
+        # key: (value, L1 deadline, L2 deadline or None), least recently used first
+        self.entries: OrderedDict[str, tuple[bytes, float, Optional[float]]] = OrderedDict()
+        self.size = 0
+        self.stats = {'l1': {'hits': 0, 'misses': 0}, 'l2': {'hits': 0, 'misses': 0}}
+        self._listener: Optional[asyncio.Task] = None
+
+    @property
+    def redis(self):
+        return getattr(self.backend, 'redis', None)
+
+    async def get_with_ttl(self, key: str) -> tuple[int, Optional[bytes]]:
+        entry = self._get_local(key)
+        if entry is not None:
+            self.stats['l1']['hits'] += 1
+            value, _, expires = entry
+            return (-1 if expires is None else max(int(expires - time.monotonic()), 0)), value
+        self.stats['l1']['misses'] += 1
+
+        ttl, value = await self.backend.get_with_ttl(key)
+        if value is None:
+            self.stats['l2']['misses'] += 1
+            return ttl, None
+        self.stats['l2']['hits'] += 1
+        self._put_local(key, value, ttl)
+        return ttl, value
+
+    async def get(self, key: str) -> Optional[bytes]:
+        ttl, value = await self.get_with_ttl(key)
+        return value
+
+    async def set(self, key: str, value: bytes, expire: Optional[int] = None) -> None:
+        await self.backend.set(key, value, expire)
+        self._put_local(key, value, expire)
+
+    async def clear(self, namespace: Optional[str] = None, key: Optional[str] = None) -> int:
+        cleared = await self.backend.clear(namespace, key)
+        self._clear_local(namespace, key)
+        if self.redis is not None:
+            await self.redis.publish(self.channel, json.dumps({'namespace': namespace, 'key': key}))
+        return cleared
+
+    async def load_data_version(self) -> None:
+        """
+        Switches the process to the data version stored in Redis, if L2 is Redis
+
+        :return: None
+        """
+        if self.redis is None:
+            return
+        try:
+            _set_data_version(self, int(await self.redis.get(DATA_VERSION_KEY) or 0))
+        except Exception as e:
+            print(f'Cache data version is unavailable: {e}')
+
+    async def start(self) -> None:
+        """
+        Starts listening to the invalidation channel, if L2 is Redis
+
+        :return: None
+        """
+        if self.redis is not None and self._listener is None:
+            self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._listener
+            self._listener = None
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                async with self.redis.pubsub() as pubsub:
+                    await pubsub.subscribe(self.channel)
+                    await self.load_data_version()  # versions may have been missed while disconnected
+                    async for message in pubsub.listen():
+                        if message['type'] != 'message':
+                            continue
+                        invalidation = json.loads(message['data'])
+                        if 'version' in invalidation:
+                            _set_data_version(self, invalidation['version'])
+                        else:
+                            self._clear_local(invalidation['namespace'], invalidation['key'])
+            except Exception as e:
+                print(f'Cache invalidation channel is unavailable: {e}')
+                self.entries.clear()  # invalidations may be missed while disconnected
+                self.size = 0
+                await asyncio.sleep(1)
+
+    def _get_local(self, key: str) -> Optional[tuple[bytes, float, Optional[float]]]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= time.monotonic():
+            self._pop_local(key)
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def _put_local(self, key: str, value: bytes, ttl: Optional[int]) -> None:
+        self._pop_local(key)
+        if len(value) > self.max_bytes:
+            return
+        now = time.monotonic()
+        expires = now + ttl if ttl and ttl > 0 else None
+        deadline = now + self.ttl if expires is None else min(now + self.ttl, expires)
+        self.entries[key] = (value, deadline, expires)
+        self.size += len(value)
+        while self.size > self.max_bytes:
+            _, (evicted, *_) = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+
+    def _pop_local(self, key: str) -> None:
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[0])
+
+    def _clear_local(self, namespace: Optional[str], key: Optional[str]) -> None:
+        if namespace:
+            for cached_key in [cached_key for cached_key in self.entries if cached_key.startswith(f'{namespace}:')]:
+                self._pop_local(cached_key)
+        elif key:
+            self._pop_local(key)
+
+
+def cached(namespace: str = CACHE_NAMESPACE,
+           key_builder: Optional[KeyBuilder] = None,
+           expire: Optional[int] = None,
+           stale: Optional[int] = None) -> Callable:
+    """
+    Caches endpoint responses in the FastAPICache backend like fastapi_cache's
+    @cache and protects the database from concurrent misses: identical requests
+    missing the cache at once share one computation (single-flight), and with
+    a Redis backend the computation is guarded by a Redis lock, so other
+    workers wait for it and read its result from the cache.
+    With stale set, an entry is kept that many seconds past expire and
+    served while a single background computation refreshes it
+
+    :param namespace: namespace of the cache keys
+    :param key_builder: key builder, FastAPICache's one if not specified
+    :param expire: seconds a response is fresh, settings.CACHE_EXPIRE if not specified
+    :param stale: seconds a response is served after expire, settings.CACHE_STALE if not specified
+
+    :return: endpoint decorator
+    """
+    def wrapper(func: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+        endpoint_signature = signature(func)
+
+        @wraps(func)
+        async def inner(*args, **kwargs) -> Any:
+            request: Optional[Request] = kwargs.pop(REQUEST_PARAM.name, None)
+            response: Optional[Response] = kwargs.pop(RESPONSE_PARAM.name, None)
+            if (not FastAPICache.get_enable() or request is None or request.method != 'GET'
+                    or request.headers.get('Cache-Control') == 'no-store'):
+                return await func(*args, **kwargs)
+
+            backend, coder = FastAPICache.get_backend(), FastAPICache.get_coder()
+            fresh = expire or settings.CACHE_EXPIRE
+            grace = (stale or settings.CACHE_STALE) if fresh else 0
+            key = (key_builder or FastAPICache.get_key_builder())(
+                func, f'{FastAPICache.get_prefix()}:{namespace}',
+                request=request, response=response, args=args, kwargs=kwargs.copy()
+            )
+            if isawaitable(key):
+                key = await key
+
+            if request.headers.get('Cache-Control') != 'no-cache':
+                ttl, value = await _get_with_ttl(backend, key)
+                if value is not None:
+                    if grace and ttl <= grace:
+                        _revalidate(key, lambda: _store(backend, key, _with_own_session(func, args, kwargs),
+                                                        fresh + grace))
+                    etag = f'W/"{hashlib.sha1(value).hexdigest()}"'
+                    if response is not None:
+                        response.headers.update({'ETag': etag, FastAPICache.get_cache_status_header(): 'HIT'})
+                        if request.headers.get('If-None-Match') == etag:
+                            response.status_code = HTTP_304_NOT_MODIFIED
+                            return response
+                    return coder.decode(value)
+
+            computed = []
+
+            async def compute() -> Any:
+                result = await func(*args, **kwargs)
+                computed.append(result)
+                return result
+
+            async def load() -> bytes:
+                async with _distributed_lock(backend, key) as waited:
+                    if waited and (value := await backend.get(key)) is not None:
+                        return value
+                    return await _store(backend, key, compute, fresh + grace if fresh else None)
+
+            value = await _single_flight(key, load)
+            if not computed:
+                return coder.decode(value)
+            result = computed[0]
+            target = result if isinstance(result, Response) else response
+            if target is not None:
+                target.headers[FastAPICache.get_cache_status_header()] = 'MISS'
+            return result
+
+        # returns cached payloads or responses, so no response model is derived from the annotation
+        inner.__signature__ = endpoint_signature.replace(
+            parameters=[*endpoint_signature.parameters.values(), REQUEST_PARAM, RESPONSE_PARAM],
+            return_annotation=Signature.empty
+        )
+        return inner
+    return wrapper
+
+
+async def _single_flight(key: str, load: Callable[[], Awaitable[bytes]]) -> bytes:
+    """
+    Runs load once per key at a time: callers arriving while it runs
+    await the same result or exception instead of running their own
+
+    :param key: cache key
+    :param load: coroutine function computing and storing the encoded response
+
+    :return: encoded response
+    """
+    future = _in_flight.get(key)
+    if future is not None:
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if future.cancelled() and not asyncio.current_task().cancelling():
+                return await _single_flight(key, load)  # the leading request went away
+            raise
+
+    future = asyncio.get_running_loop().create_future()
+    _in_flight[key] = future
+    try:
+        value = await load()
+        future.set_result(value)
+        return value
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        future.exception()  # retrieved, even if nobody else awaits it
+        raise
+    finally:
+        del _in_flight[key]
+
+
+@asynccontextmanager
+async def _distributed_lock(backend: Backend, key: str) -> AsyncIterator[bool]:
+    """
+    Holds a Redis lock on the key when the backend is Redis,
+    so only one worker computes a response at a time
+
+    :param backend: FastAPICache backend
+    :param key: cache key
+
+    :return: True if the lock is held, then the cache is worth rechecking,
+    as another worker may have filled it while this one waited
+    """
+    redis = getattr(backend, 'redis', None)
+    if redis is None:
+        yield False
+        return
+    lock = redis.lock(f'{key}:lock', timeout=settings.CACHE_LOCK_TIMEOUT,
+                      blocking_timeout=settings.CACHE_LOCK_TIMEOUT)
+    try:
+        acquired = await lock.acquire()
+    except Exception as e:
+        print(f'Cache lock is unavailable: {e}')
+        acquired = False
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            try:
+                await lock.release()
+            except LockError:  # expired while computing
+                pass
+
+
+async def _store(backend: Backend, key: str, compute: Callable[[], Awaitable[Any]],
+                 expire: Optional[int]) -> bytes:
+    value = FastAPICache.get_coder().encode(await compute())
+    try:
+        await backend.set(key, value, expire)
+    except Exception as e:
+        print(f'Cache entry has not been stored: {e}')
+    return value
+
+
+async def _get_with_ttl(backend: Backend, key: str) -> tuple[int, Optional[bytes]]:
+    try:
+        return await backend.get_with_ttl(key)
+    except Exception as e:
+        print(f'Cache entry has not been read: {e}')
+        return 0, None
+
+
+def _with_own_session(func: Callable[..., Awaitable[Any]], args: tuple, kwargs: dict) -> Callable[[], Awaitable[Any]]:
+    """
+    Binds an endpoint call to a session of its own: revalidation runs
+    after the response is sent, when the request session is closed
+
+    :param func: endpoint function
+    :param args: positional arguments of the call
+    :param kwargs: keyword arguments of the call
+
+    :return: coroutine function calling the endpoint
+    """
+    async def call() -> Any:
+        async with Session() as session:
+            return await func(*args, **{name: session if isinstance(value, AsyncSession) else value
+                                        for name, value in kwargs.items()})
+    return call
+
+
+def _revalidate(key: str, load: Callable[[], Awaitable[bytes]]) -> None:
+    if key in _in_flight:
+        return
+    task = asyncio.create_task(_single_flight(key, load))
+    _revalidations.add(task)
+    task.add_done_callback(_forget_revalidation)
+
+
+def _forget_revalidation(task: asyncio.Task) -> None:
+    _revalidations.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        print(f'Cache entry has not been revalidated: {task.exception()}')
@@ -1,3 +1,5 @@
+from typing import Literal
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -10,8 +12,44 @@ class Settings(BaseSettings):
     DB_PASS: str
     DB_NAME: str
 
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: float = 30
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: Literal['always', 'idle', 'never'] = 'idle'
+    DB_POOL_PRE_PING_IDLE: float = 60
+    DB_STATEMENT_CACHE_SIZE: int = 256
+    DB_PREPARED_STATEMENTS: bool = True
+
     REDIS_HOST: str
 
+    LOAD_BATCH_SIZE: int = 10_000
+    PARSE_WORKERS: int | None = None
+    PIPELINE_QUEUE_SIZE: int = 4
+
+    CRAWL_WINDOW: int = 4
+
+    DOWNLOAD_CONCURRENCY: int = 8
+    DOWNLOAD_RETRIES: int = 3
+    DOWNLOAD_BACKOFF: float = 0.5
+    DOWNLOAD_TIMEOUT: float = 60
+    DOWNLOAD_KEEPALIVE: float = 30
+    DOWNLOAD_CHUNK_SIZE: int = 64 * 1024
+
+    INGEST_CRON: str = '*/30 * * * *'
+    INGEST_PROGRESS_INTERVAL: float = 5
+
+    DYNAMICS_ENGINE: Literal['postgres', 'snapshot'] = 'postgres'
+    SNAPSHOT_DIR: str = 'src/parser/snapshot/'
+
+    CACHE_EXPIRE: int | None = 86400
+    CACHE_STALE: int = 0
+    CACHE_LOCK_TIMEOUT: float = 30
+    CACHE_L1_MAX_BYTES: int = 32 * 1024 * 1024
+    CACHE_L1_TTL: float = 30
+    CACHE_COMPRESS_THRESHOLD: int = 4 * 1024
+    CACHE_COMPRESS_LEVEL: int = 3
+
     model_config = SettingsConfigDict(env_file="envs/.env")
 
     @property
@@ -1,31 +1,170 @@
+import re
+import time
+from collections import deque
 from typing import Any, AsyncGenerator
+from uuid import uuid4
 
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession, AsyncAttrs
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import Connection, event, exc
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncEngine, AsyncSession, AsyncAttrs
 from sqlalchemy.orm import DeclarativeBase
-from src.config import settings
+from sqlalchemy.pool import AsyncAdaptedQueuePool, ConnectionPoolEntry, PoolProxiedConnection
+from src.config import Settings, settings
 
 DATABASE_URL = settings.DB_URL
+# latest checkout waits kept for the percentiles of MeteredPool.stats
+WAIT_SAMPLES = 1000
+# partitions are created at runtime and are not part of the models
+PARTITION_PATTERN = re.compile(r'.+_(y\d{4}m\d{2}|default)')
 
 
 class BaseModel(AsyncAttrs, DeclarativeBase):
     __abstract__ = True
 
 
-engine = create_async_engine(DATABASE_URL, pool_pre_ping=True)
+class MeteredPool(AsyncAdaptedQueuePool):
+    """
+    Queue pool counting checkouts of connections and how long they take:
+    waiting for a free connection, opening a new one and pinging it.
+    Counters belong to this worker and start over when the pool is recreated
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.waits = deque(maxlen=WAIT_SAMPLES)
+        self.max_wait = 0.0
+
+    def connect(self) -> PoolProxiedConnection:
+        started = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            self.timeouts += 1
+            raise
+        wait = time.perf_counter() - started
+        self.checkouts += 1
+        self.waits.append(wait)
+        self.max_wait = max(self.max_wait, wait)
+        return connection
+
+    @property
+    def stats(self) -> dict:
+        waits = sorted(self.waits)
+        return {'size': self.size(),
+                'checked_out': self.checkedout(),
+                'overflow': max(self.overflow(), 0),
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'wait_ms': {'p50': _percentile(waits, 0.5) * 1000,
+                            'p99': _percentile(waits, 0.99) * 1000,
+                            'max': self.max_wait * 1000}}
+
+
+def _percentile(values: list[float], fraction: float) -> float:
+    return values[min(int(len(values) * fraction), len(values) - 1)] if values else 0.0
+
+
+def build_engine(config: Settings = settings) -> AsyncEngine:
+    """
+    Creates an engine with the pool and statement caching of the settings.
+    DB_POOL_PRE_PING picks how connections are checked before use: always
+    pings on every checkout, idle only connections unused for longer than
+    DB_POOL_PRE_PING_IDLE seconds, never leaves broken ones to fail their
+    first query. DB_STATEMENT_CACHE_SIZE statements are kept prepared per
+    connection; with DB_PREPARED_STATEMENTS off nothing is reused and names
+    are unique, as poolers in transaction mode (PgBouncer) require.
+    Behind such a pooler the ingest lock (src.ingest.ingest_lock) keeps a transaction
+    open for the whole ingestion, so the pooler's and Postgres' idle in transaction
+    timeouts have to be longer than an ingestion
+
+    :param config: settings to take DB_* values from
+
+    :return: AsyncEngine with a MeteredPool
+    """
+    if config.DB_PREPARED_STATEMENTS:
+        connect_args = {'prepared_statement_cache_size': config.DB_STATEMENT_CACHE_SIZE}
+    else:
+        connect_args = {'prepared_statement_cache_size': 0,
+                        'statement_cache_size': 0,
+                        'prepared_statement_name_func': lambda: f'__asyncpg_{uuid4()}__'}
+    new_engine = create_async_engine(config.DB_URL,
+                                     poolclass=MeteredPool,
+                                     pool_size=config.DB_POOL_SIZE,
+                                     max_overflow=config.DB_MAX_OVERFLOW,
+                                     pool_timeout=config.DB_POOL_TIMEOUT,
+                                     pool_recycle=config.DB_POOL_RECYCLE,
+                                     pool_pre_ping=config.DB_POOL_PRE_PING == 'always',
+                                     connect_args=connect_args)
+    if config.DB_POOL_PRE_PING == 'idle':
+        _ping_idle_connections(new_engine, config.DB_POOL_PRE_PING_IDLE)
+    return new_engine
+
+
+def _ping_idle_connections(new_engine: AsyncEngine, idle: float) -> None:
+    dialect = new_engine.dialect
+
+    @event.listens_for(new_engine.sync_engine, 'checkin')
+    def remember_checkin(dbapi_connection, connection_record: ConnectionPoolEntry) -> None:
+        connection_record.info['checked_in'] = time.monotonic()
+
+    @event.listens_for(new_engine.sync_engine, 'checkout')
+    def ping(dbapi_connection, connection_record: ConnectionPoolEntry, connection_proxy) -> None:
+        checked_in = connection_record.info.get('checked_in')
+        if checked_in is None or time.monotonic() - checked_in <= idle:
+            return
+        try:
+            dialect.do_ping(dbapi_connection)
+        except Exception as e:
+            # the pool replaces the connection and checks out another one
+            raise exc.DisconnectionError() from e
+
+
+engine = build_engine()
 Session = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
 
 async def create_db() -> None:  # pragma: no cover
     """
-    Creates tables in database.
-    Does nothing if tables are already exist
+    Creates tables in database and brings existing ones
+    up to date by applying alembic migrations (migrations/).
+    Does nothing if the schema is already at the latest revision
 
     :return: None
-    Just creates table if it doesn't exist and returns nothing
+    Just migrates the database and returns nothing
     """
     async with engine.begin() as conn:
-        print('Creating databases')
-        await conn.run_sync(BaseModel.metadata.create_all)
+        print('Migrating database')
+        await conn.run_sync(run_migrations)
+
+
+def run_migrations(connection: Connection, revision: str = 'head') -> None:
+    """
+    Upgrades the database on the given connection to the revision
+
+    :param connection: synchronous connection, as passed by AsyncConnection.run_sync
+    :param revision: alembic revision to upgrade to
+
+    :return: None
+    """
+    config = Config('alembic.ini')
+    config.attributes['connection'] = connection
+    command.upgrade(config, revision)
+
+
+def include_name(name: str | None, type_: str, parent_names: dict) -> bool:
+    """
+    Filter of alembic autogenerate leaving partitions of partitioned tables out,
+    only their parent tables are described by the models
+
+    :param name: name of the schema object
+    :param type_: kind of the object, table, index, column...
+    :param parent_names: names of the schema and table the object belongs to
+
+    :return: False for partitions, True otherwise
+    """
+    return type_ != 'table' or not PARTITION_PATTERN.fullmatch(name)
 
 
 async def get_session() -> AsyncGenerator[AsyncSession, Any]:
@@ -0,0 +1,126 @@
+import asyncio
+import datetime
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from sqlalchemy import text, update
+
+from src.api.service import parse_spimex, rebuild_spimex
+from src.config import settings
+from src.database import Session, engine
+from src.models.spimex_ingest_runs import SpimexIngestRun
+from src.parser.spimex_trading_results import URLManager
+from src.snapshot import current_snapshot, refresh_snapshot
+
+# key of the Postgres advisory lock held while ingesting
+INGEST_LOCK_KEY = 0x5350494D4558  # 'SPIMEX'
+
+
+async def run_ingest(trigger: str = 'scheduler', incremental: bool = True, from_archive: bool = False) -> bool:
+    """
+    Runs one ingestion of SPIMEX trading results (see parse_spimex) unless
+    another one is running: a Postgres advisory lock (see ingest_lock) is held
+    for the whole run, so API workers, schedulers and the CLI never ingest
+    at the same time. The run and its progress are recorded in spimex_ingest_runs,
+    a run that has loaded everything but some tables it failed to download is partial.
+    A missing /dynamics snapshot is built first (see build_snapshot)
+
+    :param trigger: what has started the run, scheduler or cli
+    :param incremental: ingest only new and changed tables, every downloaded one otherwise
+    :param from_archive: load the local Parquet archive instead (see rebuild_spimex)
+
+    :return: True if the run took place, False if another one holds the lock
+    """
+    async with ingest_lock() as locked:
+        if not locked:
+            print('Ingestion is already running')
+            return False
+        await _build_missing_snapshot()
+        await _record_run(trigger, incremental, from_archive)
+    return True
+
+
+async def build_snapshot() -> bool:
+    """
+    Builds the /dynamics snapshot if it serves reads and there is none yet.
+    Snapshots are written only under the ingest lock, here and by ingestion
+    changing rows (see publish_changes), so a single process writes versions
+    at a time and none prunes the CURRENT another one has just written.
+    Other processes only reopen CURRENT (see current_snapshot)
+
+    :return: True if the lock was held, False if an ingestion holds it and builds the snapshot itself
+    """
+    async with ingest_lock() as locked:
+        if not locked:
+            print('Ingestion is running, it builds the snapshot')
+            return False
+        await _build_missing_snapshot()
+    return True
+
+
+@asynccontextmanager
+async def ingest_lock() -> AsyncIterator[bool]:
+    """
+    Holds the Postgres advisory lock of ingestion, if no other session holds it.
+    It is a transaction-level lock in a transaction kept open while the lock is held
+    and released by its end: a pooler in transaction mode (PgBouncer) keeps
+    a transaction on one server connection, while session-level lock and unlock
+    could land on different ones and leak the lock
+
+    :return: True if the lock is held
+    """
+    async with engine.connect() as connection:
+        async with connection.begin():
+            yield await connection.scalar(text('SELECT pg_try_advisory_xact_lock(:key)'), {'key': INGEST_LOCK_KEY})
+
+
+async def _build_missing_snapshot() -> None:
+    if settings.DYNAMICS_ENGINE == 'snapshot' and current_snapshot() is None:
+        await refresh_snapshot()
+
+
+async def _record_run(trigger: str, incremental: bool, from_archive: bool) -> None:
+    parser = URLManager()
+    async with Session() as session:
+        run = SpimexIngestRun(trigger=trigger, status='running',
+                              started_on=datetime.datetime.now(datetime.timezone.utc))
+        session.add(run)
+        await session.commit()
+        run_id = run.id
+
+    progress = asyncio.create_task(_report_progress(run_id, parser))
+    status, error = 'failed', None
+    try:
+        if from_archive:
+            await rebuild_spimex(parser)
+        else:
+            await parse_spimex(parser, incremental)
+        status = 'succeeded'
+        if parser.download_errors:
+            errors = '; '.join(parser.download_errors.values())
+            status, error = 'partial', f'{len(parser.download_errors)} tables have not been downloaded: {errors}'
+    except Exception as e:
+        error = repr(e)
+        raise
+    finally:
+        progress.cancel()
+        await _update_run(run_id, parser, status=status, error=error,
+                          finished_on=datetime.datetime.now(datetime.timezone.utc))
+        print(f'Ingestion {run_id} has {status}')
+
+
+async def _report_progress(run_id: int, parser: URLManager) -> None:
+    while True:
+        await asyncio.sleep(settings.INGEST_PROGRESS_INTERVAL)
+        await _update_run(run_id, parser)
+
+
+async def _update_run(run_id: int, parser: URLManager, **values) -> None:
+    async with Session() as session:
+        await session.execute(update(SpimexIngestRun)
+                              .where(SpimexIngestRun.id == run_id)
+                              .values(files_downloaded=parser.download_stats['files'],
+                                      tables=parser.pipeline_stats['tables'],
+                                      rows_affected=parser.pipeline_stats['rows_affected'],
+                                      **values))
+        await session.commit()
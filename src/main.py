@@ -1,46 +1,48 @@
+import datetime
 from contextlib import asynccontextmanager
 from typing import AsyncGenerator, Any
 
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.cron import CronTrigger
 from fastapi import FastAPI
 
-from fastapi_cache import FastAPICache
-from fastapi_cache.backends.redis import RedisBackend
-
-from redis import asyncio as aioredis
-
-from src.api.service import parse_spimex
+from src.cache import init_cache
 from src.config import settings
 from src.database import create_db
 from src.api import main_router
-from src.parser.spimex_trading_results import URLManager
-
-
-async def clear_cache():
-    await FastAPICache.clear()
+from src.ingest import build_snapshot, run_ingest
+from src.snapshot import current_snapshot
 
 scheduler = AsyncIOScheduler()
-scheduler.add_job(clear_cache, 'cron', hour=14, minute=11)
 
 
 @asynccontextmanager
 async def lifespan(_: FastAPI) -> AsyncGenerator[Any, Any | None]:
     """
     Function provides Postgres and Redis pulling before
-    app is started
+    app is started. Ingestion does not hold up the startup:
+    it is scheduled by settings.INGEST_CRON (first run right away)
+    and takes place in the background, at most once at a time.
+    So is the first build of the /dynamics snapshot, if it serves reads:
+    one worker builds it, the others open it once it is there
 
     :param _: does nothing, using just to put it
     into lifespan param of app initialization
 
     :return: AsyncGenerator[Any | None]
     """
-    redis = aioredis.from_url(f"redis://{settings.REDIS_HOST}")
-    FastAPICache.init(RedisBackend(redis), prefix="api:cache")
-    scheduler.start()
-    await clear_cache()  # debug-thing, scheduler works only if app is always working
+    backend = await init_cache()
     await create_db()
-    await parse_spimex(URLManager())
+    if settings.INGEST_CRON:
+        scheduler.add_job(run_ingest, CronTrigger.from_crontab(settings.INGEST_CRON), id='ingest',
+                          next_run_time=datetime.datetime.now(datetime.timezone.utc),
+                          max_instances=1, coalesce=True)
+    if settings.DYNAMICS_ENGINE == 'snapshot' and current_snapshot() is None:
+        scheduler.add_job(build_snapshot, next_run_time=datetime.datetime.now(datetime.timezone.utc))
+    scheduler.start()
     yield
+    scheduler.shutdown(wait=False)
+    await backend.stop()
 
 
 app = FastAPI(lifespan=lifespan)
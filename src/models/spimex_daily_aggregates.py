@@ -0,0 +1,17 @@
+import datetime
+
+from sqlalchemy import BigInteger, String
+from sqlalchemy.orm import Mapped, mapped_column
+
+from src.database import BaseModel
+
+
+class SpimexDailyAggregate(BaseModel):
+	__tablename__ = 'spimex_daily_aggregates'
+
+	date: Mapped[datetime.date] = mapped_column(primary_key=True)
+	oil_id: Mapped[str] = mapped_column(String(10), primary_key=True)
+	delivery_basis_id: Mapped[str] = mapped_column(String(10), primary_key=True)
+	rows: Mapped[int] = mapped_column()
+	volume: Mapped[int] = mapped_column(BigInteger)
+	total: Mapped[int] = mapped_column(BigInteger)
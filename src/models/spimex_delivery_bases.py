@@ -0,0 +1,11 @@
+from sqlalchemy import String
+from sqlalchemy.orm import Mapped, mapped_column
+
+from src.database import BaseModel
+
+
+class SpimexDeliveryBasis(BaseModel):
+	__tablename__ = 'spimex_delivery_bases'
+
+	id: Mapped[int] = mapped_column(primary_key=True)
+	delivery_basis_name: Mapped[str] = mapped_column(String(64), unique=True)
@@ -0,0 +1,16 @@
+import datetime
+
+from sqlalchemy import String, DateTime
+from sqlalchemy.orm import Mapped, mapped_column
+
+from src.database import BaseModel
+
+
+class SpimexIngestManifest(BaseModel):
+	__tablename__ = 'spimex_ingest_manifest'
+
+	file_name: Mapped[str] = mapped_column(String(64), primary_key=True)
+	date: Mapped[datetime.date] = mapped_column()
+	content_hash: Mapped[str] = mapped_column(String(64))
+	rows: Mapped[int] = mapped_column()
+	loaded_on: Mapped[datetime.datetime] = mapped_column(DateTime(timezone=True))
@@ -0,0 +1,20 @@
+import datetime
+
+from sqlalchemy import String, DateTime, Text
+from sqlalchemy.orm import Mapped, mapped_column
+
+from src.database import BaseModel
+
+
+class SpimexIngestRun(BaseModel):
+	__tablename__ = 'spimex_ingest_runs'
+
+	id: Mapped[int] = mapped_column(primary_key=True)
+	trigger: Mapped[str] = mapped_column(String(16))
+	status: Mapped[str] = mapped_column(String(16))
+	started_on: Mapped[datetime.datetime] = mapped_column(DateTime(timezone=True))
+	finished_on: Mapped[datetime.datetime | None] = mapped_column(DateTime(timezone=True))
+	files_downloaded: Mapped[int] = mapped_column(default=0)
+	tables: Mapped[int] = mapped_column(default=0)
+	rows_affected: Mapped[int] = mapped_column(default=0)
+	error: Mapped[str | None] = mapped_column(Text)
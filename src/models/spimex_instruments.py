@@ -0,0 +1,17 @@
+from sqlalchemy import String, UniqueConstraint
+from sqlalchemy.orm import Mapped, mapped_column
+
+from src.database import BaseModel
+
+
+class SpimexInstrument(BaseModel):
+	__tablename__ = 'spimex_instruments'
+	__table_args__ = (
+		# an instrument renamed in a later bulletin gets a new key, old results keep their name
+		UniqueConstraint('exchange_product_id', 'exchange_product_name',
+		                 name='uq_spimex_instruments_exchange_product_id_name'),
+	)
+
+	id: Mapped[int] = mapped_column(primary_key=True)
+	exchange_product_id: Mapped[str] = mapped_column()
+	exchange_product_name: Mapped[str] = mapped_column(String(255))
@@ -0,0 +1,16 @@
+import datetime
+
+from sqlalchemy import String, DateTime, Text
+from sqlalchemy.orm import Mapped, mapped_column
+
+from src.database import BaseModel
+
+
+class SpimexPendingDownload(BaseModel):
+	__tablename__ = 'spimex_pending_downloads'
+
+	url: Mapped[str] = mapped_column(String(255), primary_key=True)
+	date: Mapped[datetime.date] = mapped_column()
+	attempts: Mapped[int] = mapped_column(default=1)
+	error: Mapped[str | None] = mapped_column(Text)
+	failed_on: Mapped[datetime.datetime] = mapped_column(DateTime(timezone=True))
@@ -0,0 +1,45 @@
+from sqlalchemy import Select, select
+
+from src.models.spimex_delivery_bases import SpimexDeliveryBasis
+from src.models.spimex_instruments import SpimexInstrument
+from src.models.spimex_trading_results import SpimexTradingResult
+
+# columns of a trading result as the endpoints return it: the fact table
+# with instrument and delivery basis names expanded from the dimension tables
+RESULT_COLUMNS = {
+    'id': SpimexTradingResult.id,
+    'exchange_product_id': SpimexTradingResult.exchange_product_id,
+    'exchange_product_name': SpimexInstrument.exchange_product_name,
+    'oil_id': SpimexTradingResult.oil_id,
+    'delivery_basis_id': SpimexTradingResult.delivery_basis_id,
+    'delivery_basis_name': SpimexDeliveryBasis.delivery_basis_name,
+    'delivery_type_id': SpimexTradingResult.delivery_type_id,
+    'volume': SpimexTradingResult.volume,
+    'total': SpimexTradingResult.total,
+    'count': SpimexTradingResult.count,
+    'date': SpimexTradingResult.date,
+    'created_on': SpimexTradingResult.created_on,
+    'updated_on': SpimexTradingResult.updated_on,
+}
+# dimension tables and how trading results refer to them
+DIMENSION_JOINS = {
+    SpimexInstrument.__table__: SpimexTradingResult.instrument_key == SpimexInstrument.id,
+    SpimexDeliveryBasis.__table__: SpimexTradingResult.delivery_basis_key == SpimexDeliveryBasis.id,
+}
+
+
+def select_results(columns: list) -> Select:
+    """
+    Selects columns of trading results, joining a dimension table
+    only when one of its columns is selected
+
+    :param columns: values of RESULT_COLUMNS
+
+    :return: select statement from spimex_trading_results
+    """
+    query = select(*columns).select_from(SpimexTradingResult)
+    tables = {column.table for column in columns}
+    for table, condition in DIMENSION_JOINS.items():
+        if table in tables:
+            query = query.join(table, condition)
+    return query
@@ -1,24 +1,58 @@
 import datetime
 
-from sqlalchemy import String
+from sqlalchemy import DDL, BigInteger, ForeignKey, Index, String, UniqueConstraint, event
 from sqlalchemy.orm import Mapped, mapped_column
 
 from src.database import BaseModel
+from src.models import spimex_delivery_bases, spimex_instruments  # noqa: F401, tables of the foreign keys
 
 
 class SpimexTradingResult(BaseModel):
 	__tablename__ = 'spimex_trading_results'
+	__table_args__ = (
+		# also the btree behind date ranges, max(date) and GROUP BY date
+		UniqueConstraint('date', 'exchange_product_id', name='uq_spimex_trading_results_date_exchange_product_id'),
+		Index('ix_spimex_trading_results_date_id', 'date', 'id'),
+		Index('ix_spimex_trading_results_oil_id_date', 'oil_id', 'date'),
+		Index('ix_spimex_trading_results_delivery_basis_id_date', 'delivery_basis_id', 'date'),
+		# monthly partitions (see partition_name), created by the parser before loading their dates
+		{'postgresql_partition_by': 'RANGE (date)'},
+	)
 
-	id: Mapped[int] = mapped_column(primary_key=True)
+	# unique keys of a partitioned table must include the partition key
+	id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
 	exchange_product_id: Mapped[str] = mapped_column()
-	exchange_product_name: Mapped[str] = mapped_column(String(255))
+	# names are kept once in the dimension tables, see src/models/spimex_results.py
+	instrument_key: Mapped[int] = mapped_column(ForeignKey('spimex_instruments.id'))
 	oil_id: Mapped[str] = mapped_column(String(10))
 	delivery_basis_id: Mapped[str] = mapped_column(String(10))
-	delivery_basis_name: Mapped[str] = mapped_column(String(64))
+	delivery_basis_key: Mapped[int] = mapped_column(ForeignKey('spimex_delivery_bases.id'))
 	delivery_type_id: Mapped[str] = mapped_column(String(10))
-	volume: Mapped[str] = mapped_column(String(255))
-	total: Mapped[str] = mapped_column(String(255))
-	count: Mapped[str] = mapped_column(String(255))
-	date: Mapped[datetime.date] = mapped_column()
+	volume: Mapped[int] = mapped_column(BigInteger)
+	total: Mapped[int] = mapped_column(BigInteger)
+	count: Mapped[int] = mapped_column()
+	date: Mapped[datetime.date] = mapped_column(primary_key=True)
 	created_on: Mapped[datetime.date] = mapped_column()
 	updated_on: Mapped[datetime.date] = mapped_column(nullable=True)
+
+
+# rows of months without a partition of their own
+DEFAULT_PARTITION = f'{SpimexTradingResult.__tablename__}_default'
+
+event.listen(SpimexTradingResult.__table__, 'after_create',
+             DDL(f'CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {SpimexTradingResult.__tablename__} DEFAULT'))
+
+
+def next_month(month: datetime.date) -> datetime.date:
+	return (month + datetime.timedelta(days=32)).replace(day=1)
+
+
+def partition_name(month: datetime.date) -> str:
+	"""
+	Name of the partition holding trading results of a month
+
+	:param month: first day of the month
+
+	:return: table name like spimex_trading_results_y2025m04
+	"""
+	return f'{SpimexTradingResult.__tablename__}_y{month:%Y}m{month:%m}'
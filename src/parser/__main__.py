@@ -0,0 +1,30 @@
+"""
+Runs one ingestion of SPIMEX trading results outside of the app,
+e.g. from cron or a container job:
+python -m src.parser [--full | --from-archive]
+"""
+import argparse
+import asyncio
+
+from src.cache import init_cache
+from src.database import engine
+from src.ingest import run_ingest
+
+
+async def main(incremental: bool, from_archive: bool) -> None:
+    backend = await init_cache()
+    try:
+        await run_ingest('cli', incremental, from_archive)
+    finally:
+        await backend.stop()
+        await engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Ingest SPIMEX trading results')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--full', action='store_true', help='reload every downloaded table, not only changed ones')
+    mode.add_argument('--from-archive', action='store_true',
+                      help='load the Parquet archive of parsed tables, without spimex.com and .xls decoding')
+    args = parser.parse_args()
+    asyncio.run(main(incremental=not args.full, from_archive=args.from_archive))
@@ -1,23 +1,269 @@
 import asyncio
 import datetime
+import glob
+import hashlib
 import re
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import AsyncIterator, Iterable, Iterator
 
 import xlrd
 
 import aiofiles
 import aiohttp
 from dns.dnssec import validate
-from sqlalchemy import select
+from sqlalchemy import delete, select, text, tuple_, TextClause
+from sqlalchemy.dialects.postgresql import Insert, insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.sql.expression import func
 
 import pandas as pd
 
+from src.config import settings
 from src.database import Session
-from src.models.spimex_trading_results import SpimexTradingResult
+from src.models.spimex_daily_aggregates import SpimexDailyAggregate
+from src.models.spimex_delivery_bases import SpimexDeliveryBasis
+from src.models.spimex_ingest_manifest import SpimexIngestManifest
+from src.models.spimex_instruments import SpimexInstrument
+from src.models.spimex_pending_downloads import SpimexPendingDownload
+from src.models.spimex_trading_results import DEFAULT_PARTITION, SpimexTradingResult, next_month, partition_name
 
-if not os.path.isdir('src/parser/tables/'):
-    os.makedirs('src/parser/tables/', exist_ok=True)  # pragma: no cover
+TABLES_DIR = 'src/parser/tables/'
+# parsed bulletins as Parquet, one file per bulletin partitioned by trade date:
+# date=2025-04-30/oil_xls_20250430162000.parquet
+ARCHIVE_DIR = 'src/parser/archive/'
+
+if not os.path.isdir(TABLES_DIR):
+    os.makedirs(TABLES_DIR, exist_ok=True)  # pragma: no cover
+if not os.path.isdir(ARCHIVE_DIR):
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)  # pragma: no cover
+
+LOAD_COLUMNS = ('exchange_product_id',
+                'instrument_key',
+                'oil_id',
+                'delivery_basis_id',
+                'delivery_basis_key',
+                'delivery_type_id',
+                'volume',
+                'total',
+                'count',
+                'date',
+                'created_on',
+                'updated_on')
+# key column of the results table: dimension table and the bulletin columns identifying its rows
+DIMENSIONS = {'instrument_key': (SpimexInstrument, ('exchange_product_id', 'exchange_product_name')),
+              'delivery_basis_key': (SpimexDeliveryBasis, ('delivery_basis_name',))}
+NATURAL_KEY = ('date', 'exchange_product_id')
+UPSERT_COLUMNS = tuple(column for column in LOAD_COLUMNS
+                       if column not in NATURAL_KEY and column not in ('created_on', 'updated_on'))
+
+SEARCH_TONN = 'Единица измерения: Метрическая тонна'
+INSTRUMENT_CODE_PATTERN = re.compile(r'\b(?=[A-Z-])([A-Z0-9-]+[A-Z]+[A-Z0-9-]*)\b')
+BULLETIN_COLUMNS = {1: 'exchange_product_id',  # B:F,O
+                    2: 'exchange_product_name',
+                    3: 'delivery_basis_name',
+                    4: 'volume',
+                    5: 'total',
+                    14: 'count'}
+NUMERIC_COLUMNS = ('volume', 'total', 'count')
+ARCHIVE_COLUMNS = ('exchange_product_id',
+                   'exchange_product_name',
+                   'oil_id',
+                   'delivery_basis_id',
+                   'delivery_basis_name',
+                   'delivery_type_id',
+                   'volume',
+                   'total',
+                   'count',
+                   'date')
+
+
+def list_tables() -> list[str]:
+    """
+    Lists downloaded bulletins, skipping partially downloaded .part files
+
+    :return: paths of the .xls files in TABLES_DIR
+    """
+    return [f'{TABLES_DIR}{table_file}' for table_file in os.listdir(TABLES_DIR) if table_file.endswith('.xls')]
+
+
+def table_date(file_path: str) -> datetime.date:
+    """
+    Takes the trade date from a bulletin file name
+
+    :param file_path: path of the bulletin, like .../oil_xls_20250430162000.xls
+
+    :return: trade date
+    """
+    date = '{0}.{1}.{2}'.format(file_path[-12:-10], file_path[-14:-12], file_path[-18:-14])
+    return datetime.datetime.strptime(date, '%d.%m.%Y').date()
+
+
+def file_hash(file_path: str) -> str:
+    with open(file_path, 'rb') as table_file:
+        return hashlib.file_digest(table_file, 'sha256').hexdigest()
+
+
+def read_bulletin(file_path: str) -> pd.DataFrame:
+    """
+    Reads the metric ton section of a SPIMEX bulletin with a single
+    xlrd decode: the section header is located right in the sheet cells,
+    the sub-header row under it is skipped and the rows are taken until
+    the first cell that is not an instrument code (section footer)
+
+    :param file_path: path to the .xls bulletin
+
+    :return: dataframe with BULLETIN_COLUMNS columns, one row per instrument
+    """
+    book = xlrd.open_workbook(file_path, on_demand=True)
+    try:
+        sheet = book.sheet_by_index(0)
+        tonn_row = next((row for row in range(sheet.nrows)
+                         if any(_cell_value(sheet, row, column) == SEARCH_TONN for column in BULLETIN_COLUMNS)),
+                        None)
+        if tonn_row is None:
+            raise ValueError(f'{file_path}: "{SEARCH_TONN}" section not found')
+        records = []
+        for row in range(tonn_row + 3, sheet.nrows):
+            code = _cell_value(sheet, row, 1)
+            if not isinstance(code, str) or not re.match(INSTRUMENT_CODE_PATTERN, code):
+                break
+            records.append([_cell_value(sheet, row, column) for column in BULLETIN_COLUMNS])
+    finally:
+        book.release_resources()
+    return pd.DataFrame(records, columns=list(BULLETIN_COLUMNS.values()))
+
+
+def validate_bulletin(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Drops instruments that had no trades (count is '-') and converts
+    volume, total and count to integers, whether the cells were numbers
+    or text with digit group separators
+
+    :param df: dataframe returned by read_bulletin
+
+    :return: new dataframe with a fresh RangeIndex
+    """
+    df = df[df['count'] != '-'].reset_index(drop=True)
+    for column in NUMERIC_COLUMNS:
+        df[column] = pd.to_numeric(df[column].astype(str).str.replace(r'\s', '', regex=True)).astype('int64')
+    return df
+
+
+def extend_bulletin(df: pd.DataFrame, file_path: str) -> pd.DataFrame:
+    """
+    Adds the trade date taken from the bulletin file name and the ids
+    derived from the exchange product code, in place
+
+    :param df: validated bulletin dataframe
+    :param file_path: path of the bulletin, like .../oil_xls_20250430162000.xls
+
+    :return: the same dataframe
+    """
+    df['date'] = table_date(file_path)
+    df['created_on'] = datetime.date.today()
+    product_ids = df['exchange_product_id'].astype(str).str
+    df['oil_id'] = product_ids[:4]
+    df['delivery_basis_id'] = product_ids[4:7]
+    df['delivery_type_id'] = product_ids[-1]
+    return df
+
+
+def parse_bulletin(file_path: str) -> pd.DataFrame:
+    """
+    Reads, validates and extends one bulletin. Module-level so it can be
+    sent to a ProcessPoolExecutor worker, the returned dataframe is pickled back
+
+    :param file_path: path to the .xls bulletin
+
+    :return: dataframe ready to be loaded, without ids
+    """
+    return extend_bulletin(validate_bulletin(read_bulletin(file_path)), file_path)
+
+
+def archive_path(file_path: str, archive_dir: str) -> str:
+    """
+    :param file_path: path of the bulletin, like .../oil_xls_20250430162000.xls
+    :param archive_dir: archive root directory
+
+    :return: path of its archived copy, like archive_dir/date=2025-04-30/oil_xls_20250430162000.parquet
+    """
+    name = os.path.basename(file_path).removesuffix('.xls')
+    return os.path.join(archive_dir, f'date={table_date(file_path).isoformat()}', f'{name}.parquet')
+
+
+def list_archive(archive_dir: str) -> list[str]:
+    """
+    Lists archived bulletins, skipping partially written .part files
+
+    :param archive_dir: archive root directory
+
+    :return: paths of the .parquet files, ordered by trade date
+    """
+    return sorted(glob.glob(os.path.join(archive_dir, 'date=*', '*.parquet')))
+
+
+def archive_bulletin(df: pd.DataFrame, file_path: str, archive_dir: str, content_hash: str) -> pd.DataFrame:
+    """
+    Writes the normalized columns of a parsed bulletin to the Parquet archive.
+    The hash of the source .xls is kept in the file metadata (DataFrame.attrs),
+    so a changed bulletin is parsed again instead of being read from the archive.
+    The file is written next to its place and renamed, readers never see a partial one
+
+    :param df: dataframe returned by parse_bulletin
+    :param file_path: path of the source bulletin
+    :param archive_dir: archive root directory
+    :param content_hash: sha256 of the source bulletin
+
+    :return: the archived dataframe, with ARCHIVE_COLUMNS columns
+    """
+    archived = df[list(ARCHIVE_COLUMNS)]
+    archived.attrs['content_hash'] = content_hash
+    path = archive_path(file_path, archive_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    archived.to_parquet(f'{path}.part', index=False)
+    os.replace(f'{path}.part', path)
+    return archived
+
+
+def read_archived_bulletin(path: str) -> pd.DataFrame:
+    """
+    :param path: path of an archived bulletin
+
+    :return: dataframe ready to be loaded, content_hash of its source in attrs
+    """
+    return pd.read_parquet(path)
+
+
+def load_bulletin(file_path: str, archive_dir: str) -> pd.DataFrame:
+    """
+    Takes a bulletin from the Parquet archive when the archived copy was made
+    from the same .xls content, otherwise parses it with parse_bulletin and
+    archives the result. Module-level so it can be sent to a ProcessPoolExecutor worker
+
+    :param file_path: path to the .xls bulletin
+    :param archive_dir: archive root directory
+
+    :return: dataframe ready to be loaded, content_hash of the bulletin in attrs
+    """
+    content_hash = file_hash(file_path)
+    path = archive_path(file_path, archive_dir)
+    if os.path.exists(path):
+        df = read_archived_bulletin(path)
+        if df.attrs.get('content_hash') == content_hash:
+            return df
+    return archive_bulletin(parse_bulletin(file_path), file_path, archive_dir, content_hash)
+
+
+def _cell_value(sheet: xlrd.sheet.Sheet, row: int, column: int) -> str | int | float:
+    if column >= sheet.ncols:
+        return ''
+    cell = sheet.cell(row, column)
+    if cell.ctype == xlrd.XL_CELL_NUMBER and cell.value.is_integer():
+        return int(cell.value)
+    return cell.value
 
 
 class URLManager:
@@ -27,168 +273,481 @@ class URLManager:
         self.page_number = 0
         self.href_pattern = re.compile(r'/upload/reports/oil_xls/oil_xls_202[3-9]\d*')
         self.tables_hrefs = []
-        self.existing_files = os.listdir('src/parser/tables/')
-        self.dataframes = {}
-        self.instances = []
+        self.existing_files = os.listdir(TABLES_DIR)
+        self.pipeline_stats = {'tables': 0, 'rows_affected': 0, 'rows_copied': 0}
+        self.download_stats = {'files': 0, 'bytes': 0, 'failed': 0}
+        # last download error by href, for the hrefs that failed after all retries
+        self.download_errors: dict[str, str] = {}
+        # dimension keys by key column and identifying values, filled on the first load
+        self.dimension_keys: dict[str, dict[tuple, int]] | None = None
 
-    async def get_data_from_query(self) -> None | bool:
+    async def get_data_from_query(self) -> bool:
         print('Getting data from URL...')
-        async with aiohttp.ClientSession() as session:
-            fetched_hrefs = 0
-            all_downloaded = False
-            relevance = False
-            while not all_downloaded:
-                if relevance:
-                    break
-                self.page_number += 1
-                async with session.get(self.url + f'?page=page-{self.page_number}') as response:
-                    data = await response.text()
-                hrefs = re.findall(self.href_pattern, data)
-
-                if hrefs:
-                    newest_href = hrefs[0]
-
-                    newest_date = '{0}.{1}.{2}'.format(newest_href[-8:-6],
-                                                       newest_href[-10:-8],
-                                                       newest_href[-14:-10])
-                    newest_date = datetime.datetime.strptime(newest_date, '%d.%m.%Y').date()
-
-                    relevance = await self._check_relevance(newest_date)
-
-                    for href in hrefs:
-                        if f'https://spimex.com{href}' not in self.tables_hrefs:
-                            href = f'https://spimex.com{href}'
-                            self.tables_hrefs.append(href)
-                            fetched_hrefs += 1
-                        else:
-                            all_downloaded = True
-                            print(f'{fetched_hrefs} new tables hrefs have been fetched')
-                else:
-                    print(f'{fetched_hrefs} new tables hrefs have been fetched')
-                    break
-        return relevance
-
-    async def download_tables(self) -> None:
-        async with aiohttp.ClientSession() as session:
-            tasks = []
-            downloaded = 0
-            if self.tables_hrefs:
-                print('Downloading tables...')
-                for href in self.tables_hrefs:
-                    file_path = f'src/parser/tables/{href[-22:]}.xls'
-                    if f'{href[-22:]}.xls' not in self.existing_files:
-                        tasks.append(self._download_table_file(session, href, file_path))
-                        downloaded += 1
-            await asyncio.gather(*tasks)
-            print(f'{downloaded} tables have been downloaded' if downloaded else 'All tables are already downloaded')
-
-    async def _download_table_file(self, session, url, file_path) -> None:
+        last_database_date = await self._get_last_database_date()
+        pending_hrefs = [href for href in await self._get_pending_hrefs() if href not in self.tables_hrefs]
+        self.tables_hrefs.extend(pending_hrefs)
+        seen_hrefs = set(self.tables_hrefs)
+        fetched_hrefs = 0
+        crawled = False
+        async with self._client_session() as session:
+            while not crawled:
+                pages = range(self.page_number + 1, self.page_number + settings.CRAWL_WINDOW + 1)
+                self.page_number = pages[-1]
+                for data in await asyncio.gather(*(self._fetch_page(session, page) for page in pages)):
+                    page_hrefs = [f'https://spimex.com{href}' for href in re.findall(self.href_pattern, data)]
+                    new_hrefs = [href for href in page_hrefs if href not in seen_hrefs]
+                    if not new_hrefs:
+                        crawled = True
+                        break
+                    for href in new_hrefs:
+                        if href in seen_hrefs:  # linked twice on the page
+                            continue
+                        if last_database_date and self._href_date(href) <= last_database_date:
+                            crawled = True
+                            break
+                        seen_hrefs.add(href)
+                        self.tables_hrefs.append(href)
+                        fetched_hrefs += 1
+                    if crawled:
+                        break
+        print(f'{fetched_hrefs} new tables hrefs have been fetched, {len(pending_hrefs)} pending ones are retried')
+        return not fetched_hrefs and not pending_hrefs
+
+    async def _fetch_page(self, session, page_number) -> str:
+        async with session.get(self.url + f'?page=page-{page_number}') as response:
+            return await response.text()
+
+    @staticmethod
+    def _href_date(href) -> datetime.date:
+        return datetime.datetime.strptime(href[-14:-6], '%Y%m%d').date()
+
+    def _missing_hrefs(self) -> list[str]:
+        return [href for href in self.tables_hrefs if f'{href[-22:]}.xls' not in self.existing_files]
+
+    @staticmethod
+    def _client_session() -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(limit=settings.DOWNLOAD_CONCURRENCY,
+                                         keepalive_timeout=settings.DOWNLOAD_KEEPALIVE,
+                                         ttl_dns_cache=300)
+        return aiohttp.ClientSession(connector=connector,
+                                     timeout=aiohttp.ClientTimeout(total=settings.DOWNLOAD_TIMEOUT))
+
+    async def _download_missing(self) -> AsyncIterator[str]:
+        """
+        Downloads tables that are not in TABLES_DIR yet through one keep-alive
+        connection pool, at most DOWNLOAD_CONCURRENCY at a time. A table that
+        fails after all retries is reported and skipped, the rest go on;
+        run_pipeline records it to be requested by the next run (see _save_pending_downloads)
+
+        :return: async iterator over paths of the downloaded tables, in completion order
+        """
+        semaphore = asyncio.Semaphore(settings.DOWNLOAD_CONCURRENCY)
+        stats = self.download_stats
+        started = time.perf_counter()
+        async with self._client_session() as session:
+            async def download(href: str) -> tuple[str, int]:
+                try:
+                    return await self._download_table_file(session, semaphore, href, f'{TABLES_DIR}{href[-22:]}.xls')
+                except RuntimeError as e:
+                    self.download_errors[href] = str(e)
+                    raise
+
+            downloads = [download(href) for href in self._missing_hrefs()]
+            for download in asyncio.as_completed(downloads):
+                try:
+                    file_path, size = await download
+                except RuntimeError as e:
+                    stats['failed'] += 1
+                    print(f'Table has not been downloaded: {e}')
+                    continue
+                stats['files'] += 1
+                stats['bytes'] += size
+                yield file_path
+        if downloads:
+            elapsed = time.perf_counter() - started
+            print(f'{stats["files"]} tables ({stats["bytes"]} bytes) downloaded in {elapsed:.2f}s: '
+                  f'{stats["bytes"] / elapsed:.0f} bytes/s, {stats["files"] / elapsed:.2f} files/s, '
+                  f'{stats["failed"]} failed')
+
+    async def _download_table_file(self, session, semaphore, url, file_path) -> tuple[str, int]:
+        for attempt in range(settings.DOWNLOAD_RETRIES + 1):
+            try:
+                async with semaphore:
+                    return file_path, await self._stream_to_file(session, url, file_path)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == settings.DOWNLOAD_RETRIES:
+                    raise RuntimeError(f'{url}: {e!r}') from e
+                await asyncio.sleep(settings.DOWNLOAD_BACKOFF * 2 ** attempt)
+
+    @staticmethod
+    async def _stream_to_file(session, url, file_path) -> int:
         async with session.get(url) as response:
-            if response.status == 200:
-                content = await response.read()
-                async with aiofiles.open(file_path, 'wb') as table_file:
-                    await table_file.write(content)
-            else:
-                raise RuntimeError(f"{await response.text()}")
-
-    async def _check_relevance(self, last_url_date) -> bool:  # pragma: no cover
+            if 400 <= response.status < 500 and response.status != 429:
+                raise RuntimeError(f'{url}: {response.status} {await response.text()}')
+            response.raise_for_status()
+            size = 0
+            async with aiofiles.open(f'{file_path}.part', 'wb') as table_file:
+                async for chunk in response.content.iter_chunked(settings.DOWNLOAD_CHUNK_SIZE):
+                    await table_file.write(chunk)
+                    size += len(chunk)
+        os.replace(f'{file_path}.part', file_path)
+        return size
+
+    async def _get_pending_hrefs(self) -> list[str]:
+        async with Session() as session:
+            stmt = await session.execute(select(SpimexPendingDownload.url).order_by(SpimexPendingDownload.date.desc()))
+            return list(stmt.scalars().all())
+
+    async def _save_pending_downloads(self) -> None:
+        """
+        Records the crawled hrefs whose tables have not been downloaded, failed
+        or not reached before the run stopped, so the next run requests them
+        again: its crawl stops at the last loaded date and would not find them.
+        Hrefs downloaded since are removed
+
+        :return: None
+        """
+        existing_files = set(os.listdir(TABLES_DIR))
+        pending = [href for href in self.tables_hrefs if f'{href[-22:]}.xls' not in existing_files]
+        downloaded = set(self.tables_hrefs) - set(pending)
+        failed_on = datetime.datetime.now(datetime.timezone.utc)
+        async with Session() as session:
+            if downloaded:
+                await session.execute(delete(SpimexPendingDownload)
+                                      .where(SpimexPendingDownload.url.in_(downloaded)))
+            if pending:
+                stmt = insert(SpimexPendingDownload).values([
+                    {'url': href, 'date': self._href_date(href),
+                     'error': self.download_errors.get(href), 'failed_on': failed_on}
+                    for href in pending
+                ])
+                await session.execute(stmt.on_conflict_do_update(
+                    index_elements=[SpimexPendingDownload.url],
+                    set_={'attempts': SpimexPendingDownload.attempts + 1,
+                          'error': stmt.excluded.error,
+                          'failed_on': stmt.excluded.failed_on}))
+            await session.commit()
+        if pending:
+            print(f'{len(pending)} tables have not been downloaded, the next run requests them again')
+
+    async def _get_last_database_date(self) -> datetime.date | None:  # pragma: no cover
         async with Session() as session:
             stmt = await session.execute(func.max(SpimexTradingResult.date))
-            last_database_date = stmt.scalar()
-            return last_url_date == last_database_date
-
-    def convert_to_df(self) -> None:
-        print('Converting tables to dataframes...')
-        converted = 0
-        for table_file in os.listdir('src/parser/tables/'):
-            file_path = f'src/parser/tables/{table_file}'
-            df = pd.read_excel(file_path, usecols='B:F,O', engine='xlrd')
-            self.dataframes[file_path] = df
-            converted += 1
-        print(f'{converted} tables have been converted to dataframes')
-
-    def validate_tables(self) -> None:
-        print('Validating tables...')
-        validated = 0
-        search_tonn = 'Единица измерения: Метрическая тонна'
-        table_borders_pattern = re.compile(r'\b(?=[A-Z-])([A-Z0-9-]+[A-Z]+[A-Z0-9-]*)\b')
-        prev_df_length = 1
-        for file_path, df in self.dataframes.items():
-            tonn_index = df.loc[df.isin([search_tonn]).any(axis=1)].index.tolist()
-            new_df = pd.read_excel(file_path, header=tonn_index[0] + 2, usecols='B:F,O', skiprows=[tonn_index[0] + 3])
-            first_column_list = new_df['Код\nИнструмента'].tolist()
-            footer_index = 0
-            for code in first_column_list:  # pragma: no cover
-                if re.match(table_borders_pattern, code):
-                    continue
-                else:
-                    footer_index = first_column_list.index(code)
-                    break
-            new_df = new_df[:footer_index - 1]
-            new_df.columns = ['exchange_product_id',
-                              'exchange_product_name',
-                              'delivery_basis_name',
-                              'volume',
-                              'total',
-                              'count']
-            new_df = new_df[new_df['count'] != '-']
-            new_df = new_df.reset_index(drop=True)
-            new_df['id'] = pd.RangeIndex(prev_df_length, len(new_df) + prev_df_length)
-            prev_df_length += len(new_df)
-            new_df.set_index(['id'], inplace=True, drop=True)
-            self.dataframes[file_path] = new_df
-            validated += 1
-        print(f'{validated} dataframes have been validated')
-
-    def add_columns(self) -> None:
-        print('Adding columns...')
-        extended_df = 0
-        extended_rows = 0
-        for path, df in self.dataframes.items():
-            date = '{0}.{1}.{2}'.format(path[-12:-10], path[-14:-12], path[-18:-14])
-            date = datetime.datetime.strptime(date, '%d.%m.%Y').date()
-            df['date'] = date
-            df['created_on'] = datetime.date.today()
-            extended_df += 1
-            for index, row in df.iterrows():
-                oil_id = row['exchange_product_id'][:4]
-                delivery_basis_id = row['exchange_product_id'][4:7]
-                delivery_type_id = row['exchange_product_id'][-1]
-
-                df.loc[index, 'oil_id'] = oil_id
-                df.loc[index, 'delivery_basis_id'] = delivery_basis_id
-                df.loc[index, 'delivery_type_id'] = delivery_type_id
-                extended_rows += 1
-        print(f'{extended_df} dataframes ({extended_rows} rows) have been extended')
-
-    async def load_to_db(self) -> None:
-        print('Loading to database...')
-        df_affected = 0
-        rows_affected = 0
-        tasks = []
+            return stmt.scalar()
+
+    async def run_pipeline(self, incremental: bool = True) -> int:
+        print('Running ingest pipeline...')
+        workers = settings.PARSE_WORKERS or os.cpu_count() or 1
+        file_paths = asyncio.Queue(maxsize=settings.PIPELINE_QUEUE_SIZE)
+        dataframes = asyncio.Queue(maxsize=settings.PIPELINE_QUEUE_SIZE)
+        started = time.perf_counter()
 
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                async with asyncio.TaskGroup() as group:
+                    group.create_task(self._produce_files(file_paths, workers, incremental))
+                    parsers = [group.create_task(self._parse_files(file_paths, dataframes, executor))
+                               for _ in range(workers)]
+                    group.create_task(self._write_dataframes(dataframes))
+                    await asyncio.gather(*parsers)
+                    await dataframes.put(None)
+        finally:
+            if self.tables_hrefs:
+                await self._save_pending_downloads()
+
+        elapsed = time.perf_counter() - started
+        stats = self.pipeline_stats
+        print(f'{stats["tables"]} tables ({stats["rows_affected"]} rows) have been ingested, '
+              f'{stats["rows_copied"]} rows copied at {stats["rows_copied"] / elapsed if elapsed else 0:.0f} rows/s')
+        return stats['rows_affected']
+
+    async def rebuild_from_archive(self) -> int:
+        """
+        Loads every bulletin of the Parquet archive into the database without
+        touching spimex.com or decoding a single .xls: the archive is read in a
+        thread and loaded like the pipeline does, in one transaction
+
+        :return: amount of inserted or updated rows
+        """
+        print('Rebuilding from archive...')
+        started = time.perf_counter()
+        paths = list_archive(ARCHIVE_DIR)
+        frames = await asyncio.to_thread(lambda: [read_archived_bulletin(path) for path in paths])
+        dataframes = {f'{TABLES_DIR}{os.path.basename(path).removesuffix(".parquet")}.xls': df
+                      for path, df in zip(paths, frames)}
+        rows_affected, rows_copied = await self.load_frames(dataframes)
+        self.pipeline_stats['tables'] += len(dataframes)
+        self.pipeline_stats['rows_affected'] += rows_affected
+        self.pipeline_stats['rows_copied'] += rows_copied
+        elapsed = time.perf_counter() - started
+        print(f'{len(dataframes)} archived tables ({rows_affected} rows) have been ingested in {elapsed:.2f}s, '
+              f'{rows_copied} rows copied at {rows_copied / elapsed if elapsed else 0:.0f} rows/s')
+        return rows_affected
+
+    async def _produce_files(self, file_paths: asyncio.Queue, consumers: int, incremental: bool) -> None:
+        for file_path in await self._select_tables() if incremental else list_tables():
+            await file_paths.put(file_path)
+        async for file_path in self._download_missing():
+            await file_paths.put(file_path)
+        for _ in range(consumers):
+            await file_paths.put(None)
+
+    @staticmethod
+    async def _parse_files(file_paths: asyncio.Queue, dataframes: asyncio.Queue, executor: ProcessPoolExecutor) -> None:
+        loop = asyncio.get_running_loop()
+        while (file_path := await file_paths.get()) is not None:
+            df = await loop.run_in_executor(executor, load_bulletin, file_path, ARCHIVE_DIR)
+            await dataframes.put((file_path, df))
+
+    async def _write_dataframes(self, dataframes: asyncio.Queue) -> None:
+        while (parsed := await dataframes.get()) is not None:
+            file_path, df = parsed
+            rows_affected, rows_copied = await self.load_frames({file_path: df})
+            self.pipeline_stats['tables'] += 1
+            self.pipeline_stats['rows_affected'] += rows_affected
+            self.pipeline_stats['rows_copied'] += rows_copied
+
+    async def _select_tables(self) -> list[str]:
+        """
+        Picks the downloaded tables that need to be ingested: bulletins without
+        a manifest entry, whatever their date, and loaded ones whose content hash
+        differs from the manifest. Only files modified after their manifest entry
+        are hashed, so unchanged history costs a stat call. Bulletins loaded before
+        the manifest existed are loaded once more on the first run, which records them
+
+        :return: paths of the tables to parse and load
+        """
         async with Session() as session:
-            existing_ids_query = await session.execute(select(SpimexTradingResult.id))
-            existing_ids = set(row for row in existing_ids_query.scalars().all())
-            for file_path, df in self.dataframes.items():
-                df_affected += 1
-                for index, row in df.iterrows():
-                    if index in existing_ids:
-                        df.loc[index, 'updated_on'] = datetime.date.today()
-                    else:
-                        df.loc[index, 'updated_on'] = None
-                        df.loc[index, 'created_on'] = datetime.date.today()
-                        rows_affected += 1
-                        tasks.append(self._convert_decorator(row))
-
-            await asyncio.gather(*tasks)
-            session.add_all(self.instances)
+            stmt = await session.execute(select(SpimexIngestManifest))
+            manifest = {entry.file_name: entry for entry in stmt.scalars().all()}
+
+        selected = []
+        for file_path in list_tables():
+            entry = manifest.get(os.path.basename(file_path))
+            if entry is None:
+                selected.append(file_path)
+                continue
+            modified = datetime.datetime.fromtimestamp(os.stat(file_path).st_mtime, tz=datetime.timezone.utc)
+            if modified > entry.loaded_on and file_hash(file_path) != entry.content_hash:
+                selected.append(file_path)
+        print(f'{len(selected)} tables are new or changed')
+        return selected
+
+    async def load_frames(self, dataframes: dict[str, pd.DataFrame]) -> tuple[int, int]:
+        """
+        Copies dataframes into a temporary staging table in batches and upserts
+        them into the results table with one INSERT ... ON CONFLICT on the
+        (date, exchange_product_id) natural key: new trades are inserted, changed
+        ones are updated and get updated_on, identical ones are left alone.
+        Trades of the loaded dates missing from the dataframes are deleted, so a
+        corrected bulletin replaces its previous version whole (see _results_delete).
+        Instrument and delivery basis names are replaced with dimension keys
+        (see _add_dimension_keys), partitions of new months are created before
+        the upsert (see _create_partitions). Daily aggregates of the loaded dates are
+        recounted and every table is recorded in the ingest manifest within
+        the same transaction
+
+        :param dataframes: extended dataframes by table path
+
+        :return: amount of inserted or updated rows and amount of copied rows
+        """
+        rows_copied = 0
+        table = SpimexTradingResult.__tablename__
+        staging = f'{table}_staging'
+        columns = ', '.join(LOAD_COLUMNS)
+        key = ', '.join(NATURAL_KEY)
+        updates = ', '.join(f'{column} = EXCLUDED.{column}' for column in UPSERT_COLUMNS)
+        current = ', '.join(f'{table}.{column}' for column in UPSERT_COLUMNS)
+        excluded = ', '.join(f'EXCLUDED.{column}' for column in UPSERT_COLUMNS)
+
+        async with Session() as session:
+            await session.execute(text(f'CREATE TEMP TABLE {staging} ON COMMIT DROP '
+                                       f'AS SELECT {columns} FROM {table} WITH NO DATA'))
+            connection = await session.connection()
+            raw_connection = await connection.get_raw_connection()
+            copy_connection = raw_connection.driver_connection
+
+            for df in dataframes.values():
+                df = await self._add_dimension_keys(df)
+                for batch in _batched(self._frame_to_records(df), settings.LOAD_BATCH_SIZE):
+                    await copy_connection.copy_records_to_table(staging, records=batch, columns=LOAD_COLUMNS)
+                    rows_copied += len(batch)
+
+            await self._create_partitions(session, staging)
+            result = await session.execute(text(f'INSERT INTO {table} ({columns}) '
+                                                f'SELECT DISTINCT ON ({key}) {columns} FROM {staging} '
+                                                f'ORDER BY {key} '
+                                                f'ON CONFLICT ({key}) DO UPDATE '
+                                                f'SET {updates}, updated_on = CURRENT_DATE '
+                                                f'WHERE ({current}) IS DISTINCT FROM ({excluded})'))
+            removed = await session.execute(self._results_delete(staging))
+            rows_affected = result.rowcount + removed.rowcount
+            if rows_affected:
+                await session.execute(self._aggregates_upsert(staging))
+                await session.execute(self._aggregates_delete(staging))
+            if dataframes:
+                await session.execute(self._manifest_upsert(dataframes))
+            await session.commit()
+        return rows_affected, rows_copied
+
+    @staticmethod
+    async def _create_partitions(session: AsyncSession, staging: str) -> None:
+        """
+        Creates monthly partitions of the results table for the months of the
+        staging table that have none. A partition is created as a standalone
+        table, rows of its month are moved into it from the default partition,
+        then it is attached, so it works whatever the default partition holds
+
+        :param session: session of the load transaction
+        :param staging: name of the staging table
+
+        :return: None
+        """
+        table = SpimexTradingResult.__tablename__
+        columns = ', '.join(column.name for column in SpimexTradingResult.__table__.columns)
+        months = await session.execute(text(f"SELECT DISTINCT date_trunc('month', date)::date FROM {staging}"))
+        partitions = await session.execute(text('SELECT inhrelid::regclass::text FROM pg_inherits '
+                                                'WHERE inhparent = CAST(:table AS regclass)'), {'table': table})
+        existing = set(partitions.scalars())
+        for month in sorted(months.scalars()):
+            partition = partition_name(month)
+            if partition in existing:
+                continue
+            end = next_month(month)
+            await session.execute(text(f'CREATE TABLE {partition} (LIKE {table} INCLUDING DEFAULTS)'))
+            await session.execute(text(f'WITH moved AS (DELETE FROM {DEFAULT_PARTITION} '
+                                       f"WHERE date >= '{month}' AND date < '{end}' "
+                                       f'RETURNING {columns}) '
+                                       f'INSERT INTO {partition} ({columns}) SELECT {columns} FROM moved'))
+            await session.execute(text(f'ALTER TABLE {table} ATTACH PARTITION {partition} '
+                                       f"FOR VALUES FROM ('{month}') TO ('{end}')"))
+            print(f'Partition {partition} has been created')
+
+    async def _add_dimension_keys(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Looks up the keys of the instruments and delivery bases of a dataframe.
+        Keys are kept in memory: they are read once per URLManager, and later
+        only values missing from memory are written to the dimension tables.
+        Dimension rows are committed right away, they are only ever added,
+        so a key in memory always exists whatever happens to the load
+
+        :param df: extended bulletin dataframe
+
+        :return: new dataframe with instrument_key and delivery_basis_key columns
+        """
+        if self.dimension_keys is None:
+            self.dimension_keys = await self._fetch_dimension_keys()
+        keys = {}
+        for key_column, (model, columns) in DIMENSIONS.items():
+            lookup = self.dimension_keys[key_column]
+            values = list(zip(*(df[column] for column in columns)))
+            missing = set(values) - lookup.keys()
+            if missing:
+                lookup.update(await self._insert_dimension(model, columns, missing))
+            keys[key_column] = [lookup[value] for value in values]
+        return df.assign(**keys)
+
+    @staticmethod
+    async def _fetch_dimension_keys() -> dict[str, dict[tuple, int]]:
+        dimension_keys = {}
+        async with Session() as session:
+            for key_column, (model, columns) in DIMENSIONS.items():
+                result = await session.execute(select(model.id, *(getattr(model, column) for column in columns)))
+                dimension_keys[key_column] = {tuple(row[1:]): row[0] for row in result}
+        return dimension_keys
+
+    @staticmethod
+    async def _insert_dimension(model, columns: tuple[str, ...], values: set[tuple]) -> dict[tuple, int]:
+        identifying = [getattr(model, column) for column in columns]
+        async with Session() as session:
+            await session.execute(insert(model)
+                                  .values([dict(zip(columns, value)) for value in sorted(values)])
+                                  .on_conflict_do_nothing())
+            result = await session.execute(select(model.id, *identifying)
+                                           .where(tuple_(*identifying).in_(list(values))))
+            keys = {tuple(row[1:]): row[0] for row in result}
             await session.commit()
-            print(f'{df_affected} dataframes ({rows_affected} rows) have been inserted')
+        return keys
+
+    @staticmethod
+    def _results_delete(staging: str) -> TextClause:
+        """
+        Deletes trades of the dates present in the staging table that are not
+        staged themselves: removed from a corrected bulletin or renamed in it
+
+        :param staging: name of the staging table
+
+        :return: DELETE statement
+        """
+        table = SpimexTradingResult.__tablename__
+        return text(f'DELETE FROM {table} WHERE date IN (SELECT DISTINCT date FROM {staging}) '
+                    f'AND NOT EXISTS (SELECT 1 FROM {staging} '
+                    f'WHERE {staging}.date = {table}.date '
+                    f'AND {staging}.exchange_product_id = {table}.exchange_product_id)')
+
+    @staticmethod
+    def _aggregates_upsert(staging: str) -> TextClause:
+        """
+        Recounts daily aggregates for every date present in the staging table.
+        Whole dates are recounted from the results table, so updated trades
+        replace their previous amounts instead of being added to them
+
+        :param staging: name of the staging table
+
+        :return: INSERT ... ON CONFLICT statement
+        """
+        table = SpimexTradingResult.__tablename__
+        aggregates = SpimexDailyAggregate.__tablename__
+        return text(f'INSERT INTO {aggregates} (date, oil_id, delivery_basis_id, rows, volume, total) '
+                    f'SELECT date, oil_id, delivery_basis_id, count(*), sum(volume), sum(total) '
+                    f'FROM {table} WHERE date IN (SELECT DISTINCT date FROM {staging}) '
+                    f'GROUP BY date, oil_id, delivery_basis_id '
+                    f'ON CONFLICT (date, oil_id, delivery_basis_id) DO UPDATE '
+                    f'SET rows = EXCLUDED.rows, volume = EXCLUDED.volume, total = EXCLUDED.total '
+                    f'WHERE ({aggregates}.rows, {aggregates}.volume, {aggregates}.total) '
+                    f'IS DISTINCT FROM (EXCLUDED.rows, EXCLUDED.volume, EXCLUDED.total)')
+
+    @staticmethod
+    def _aggregates_delete(staging: str) -> TextClause:
+        """
+        Deletes daily aggregates of the dates present in the staging table
+        that the recount has not produced, as their trades are gone
+
+        :param staging: name of the staging table
+
+        :return: DELETE statement
+        """
+        table = SpimexTradingResult.__tablename__
+        aggregates = SpimexDailyAggregate.__tablename__
+        return text(f'DELETE FROM {aggregates} WHERE date IN (SELECT DISTINCT date FROM {staging}) '
+                    f'AND NOT EXISTS (SELECT 1 FROM {table} '
+                    f'WHERE {table}.date = {aggregates}.date AND {table}.oil_id = {aggregates}.oil_id '
+                    f'AND {table}.delivery_basis_id = {aggregates}.delivery_basis_id)')
+
+    @staticmethod
+    def _manifest_upsert(dataframes: dict[str, pd.DataFrame]) -> Insert:
+        loaded_on = datetime.datetime.now(datetime.timezone.utc)
+        stmt = insert(SpimexIngestManifest).values([
+            {'file_name': os.path.basename(file_path),
+             'date': table_date(file_path),
+             'content_hash': df.attrs.get('content_hash') or file_hash(file_path),
+             'rows': len(df),
+             'loaded_on': loaded_on}
+            for file_path, df in dataframes.items()
+        ])
+        return stmt.on_conflict_do_update(index_elements=[SpimexIngestManifest.file_name],
+                                          set_={'date': stmt.excluded.date,
+                                                'content_hash': stmt.excluded.content_hash,
+                                                'rows': stmt.excluded.rows,
+                                                'loaded_on': stmt.excluded.loaded_on})
+
+    @staticmethod
+    def _frame_to_records(df: pd.DataFrame) -> Iterator[tuple]:
+        df = df.assign(created_on=datetime.date.today(), updated_on=None)
+        return df[list(LOAD_COLUMNS)].itertuples(index=False, name=None)
 
-    async def _convert_decorator(self, row) -> None:
-        await self._convert_row_to_model(row)
 
-    async def _convert_row_to_model(self, row) -> None:
-        row = SpimexTradingResult(**row.to_dict())
-        self.instances.append(row)
+def _batched(records: Iterable[tuple], size: int) -> Iterator[list[tuple]]:
+    iterator = iter(records)
+    while batch := list(islice(iterator, size)):
+        yield batch
@@ -0,0 +1,193 @@
+import asyncio
+import datetime
+import json
+import os
+import shutil
+import time
+from typing import Any, Optional
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import Date, String
+
+from src.config import settings
+from src.database import Session
+from src.models.spimex_results import RESULT_COLUMNS, select_results
+from src.models.spimex_trading_results import SpimexTradingResult
+
+# text columns are stored as int32 codes into a dictionary of their values
+DICTIONARY_COLUMNS = tuple(name for name, column in RESULT_COLUMNS.items() if isinstance(column.type, String))
+# dates are stored as datetime64[D], NaT standing for NULL
+DATE_COLUMNS = tuple(name for name, column in RESULT_COLUMNS.items() if isinstance(column.type, Date))
+# file in the snapshot directory naming the version readers should open
+CURRENT_FILE = 'CURRENT'
+# versions kept on disk, older ones may still be read by other workers
+KEEP_VERSIONS = 2
+
+# snapshot opened by this process, reopened when a newer version is built
+_snapshot: Optional['DynamicsSnapshot'] = None
+
+
+class DynamicsSnapshot:
+    """
+    Read-only columnar copy of trading results (RESULT_COLUMNS) answering /dynamics
+    queries without Postgres. Every column is a .npy file memory-mapped from
+    a version directory, rows are sorted by (date, id) like the query orders
+    them. dates holds every trade date once and offsets the index of its first
+    row, so a period is two binary searches; filters are vectorized comparisons
+    of dictionary codes within that slice of rows
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.columns = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r') for name in RESULT_COLUMNS}
+        with open(os.path.join(path, 'dictionaries.json'), encoding='utf-8') as dictionaries_file:
+            dictionaries = json.load(dictionaries_file)
+        self.dictionaries = {name: np.array(values, dtype=object) for name, values in dictionaries.items()}
+        self.codes = {name: {value: code for code, value in enumerate(values)}
+                      for name, values in dictionaries.items()}
+        self.dates = np.load(os.path.join(path, 'dates.npy'))
+        self.offsets = np.load(os.path.join(path, 'offsets.npy'))
+
+    def __len__(self) -> int:
+        return len(self.columns['id'])
+
+    def query(self,
+              start_date: datetime.date,
+              end_date: datetime.date,
+              filters: dict[str, Optional[str]],
+              fields: list[str],
+              after: Optional[tuple[datetime.date, int]] = None,
+              limit: Optional[int] = None
+              ) -> list[dict[str, Any]]:
+        """
+        Selects trading results of a period, ordered by (date, id)
+
+        :param start_date: first date of the period
+        :param end_date: last date of the period
+        :param filters: values of dictionary columns to match, None matches any
+        :param fields: names of the columns to return
+        :param after: (date, id) of the last result of a previous page, not required
+        :param limit: maximum amount of results, all of them if not specified
+
+        :return: results as dictionaries of the fields
+        """
+        start = self._date_offset(start_date, 'left')
+        end = self._date_offset(end_date, 'right')
+        if after is not None:
+            start = max(start, self._position_after(*after))
+        if start >= end:
+            return []
+
+        mask = None
+        for name, value in filters.items():
+            if value is None:
+                continue
+            code = self.codes[name].get(value)
+            if code is None:
+                return []
+            matches = self.columns[name][start:end] == code
+            mask = matches if mask is None else mask & matches
+        indices = np.arange(start, end) if mask is None else start + np.flatnonzero(mask)
+        if limit is not None:
+            indices = indices[:limit]
+
+        values = [self._values(name, indices) for name in fields]
+        return [dict(zip(fields, row)) for row in zip(*values)]
+
+    def _date_offset(self, date: datetime.date, side: str) -> int:
+        return int(self.offsets[np.searchsorted(self.dates, np.datetime64(date, 'D'), side)])
+
+    def _position_after(self, date: datetime.date, id_: int) -> int:
+        day = np.searchsorted(self.dates, np.datetime64(date, 'D'), 'left')
+        start = int(self.offsets[day])
+        if day == len(self.dates) or self.dates[day] != np.datetime64(date, 'D'):
+            return start
+        ids = self.columns['id'][start:self.offsets[day + 1]]
+        return start + int(np.searchsorted(ids, id_, 'right'))
+
+    def _values(self, name: str, indices: np.ndarray) -> list:
+        values = self.columns[name][indices]
+        if name in self.dictionaries:
+            return self.dictionaries[name][values].tolist()
+        return values.tolist()  # datetime64[D] gives datetime.date, NaT gives None
+
+
+def current_snapshot() -> Optional[DynamicsSnapshot]:
+    """
+    Snapshot of the version in settings.SNAPSHOT_DIR/CURRENT, reopened
+    once a newer one has been built by this or any other process
+
+    :return: DynamicsSnapshot, None if no snapshot has been built yet
+    """
+    global _snapshot
+    try:
+        with open(os.path.join(settings.SNAPSHOT_DIR, CURRENT_FILE)) as current_file:
+            path = os.path.join(settings.SNAPSHOT_DIR, current_file.read())
+    except FileNotFoundError:
+        return None
+    if _snapshot is None or _snapshot.path != path:
+        _snapshot = DynamicsSnapshot(path)
+    return _snapshot
+
+
+async def refresh_snapshot() -> DynamicsSnapshot:
+    """
+    Builds a new snapshot version of spimex_trading_results in
+    settings.SNAPSHOT_DIR and makes it current. Called after ingestion
+    has changed rows, readers switch to it on their next query.
+    Call it under the ingest lock only (see src.ingest.build_snapshot):
+    concurrent builds prune each other's versions
+
+    :return: the new snapshot
+    """
+    started = time.perf_counter()
+    async with Session() as session:
+        result = await session.execute(select_results(list(RESULT_COLUMNS.values()))
+                                       .order_by(SpimexTradingResult.date, SpimexTradingResult.id))
+        df = pd.DataFrame(result.all(), columns=list(RESULT_COLUMNS))
+    snapshot = await asyncio.to_thread(write_snapshot, df, settings.SNAPSHOT_DIR)
+    print(f'Snapshot of {len(snapshot)} trading results has been built in {time.perf_counter() - started:.2f}s')
+    return snapshot
+
+
+def write_snapshot(df: pd.DataFrame, snapshot_dir: str) -> DynamicsSnapshot:
+    """
+    Writes trading results as a new snapshot version and points CURRENT at it.
+    CURRENT is replaced atomically, so readers see either version whole
+
+    :param df: every trading result, ordered by (date, id)
+    :param snapshot_dir: snapshot root directory
+
+    :return: the written snapshot
+    """
+    version = str(time.time_ns())
+    path = os.path.join(snapshot_dir, version)
+    os.makedirs(path)
+
+    dictionaries = {}
+    for name in RESULT_COLUMNS:
+        if name in DICTIONARY_COLUMNS:
+            codes, values = pd.factorize(df[name])
+            column = codes.astype(np.int32)
+            dictionaries[name] = values.tolist()
+        elif name in DATE_COLUMNS:
+            column = np.array(df[name].tolist(), dtype='datetime64[D]')
+        else:
+            column = df[name].to_numpy(dtype=np.int64)
+        np.save(os.path.join(path, f'{name}.npy'), column)
+    with open(os.path.join(path, 'dictionaries.json'), 'w', encoding='utf-8') as dictionaries_file:
+        json.dump(dictionaries, dictionaries_file, ensure_ascii=False)
+
+    dates, first_rows = np.unique(np.array(df['date'].tolist(), dtype='datetime64[D]'), return_index=True)
+    np.save(os.path.join(path, 'dates.npy'), dates)
+    np.save(os.path.join(path, 'offsets.npy'), np.append(first_rows, len(df)).astype(np.int64))
+
+    current = os.path.join(snapshot_dir, CURRENT_FILE)
+    with open(f'{current}.part', 'w') as current_file:
+        current_file.write(version)
+    os.replace(f'{current}.part', current)
+
+    versions = sorted(entry for entry in os.listdir(snapshot_dir) if entry.isdigit())
+    for old_version in versions[:-KEEP_VERSIONS]:
+        shutil.rmtree(os.path.join(snapshot_dir, old_version), ignore_errors=True)
+    return DynamicsSnapshot(path)
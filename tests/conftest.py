@@ -1,5 +1,10 @@
+import asyncio
+
 import pytest
 import pytest_asyncio
+import xlwt
+from aiohttp import web
+from aiohttp.test_utils import TestServer
 from fastapi import FastAPI
 from fastapi_cache import FastAPICache
 from fastapi_cache.backends.inmemory import InMemoryBackend
@@ -48,11 +53,112 @@ async def session():
         yield session
 
 
+@pytest.fixture
+def session_maker() -> async_sessionmaker:
+    return test_session
+
+
 @pytest.fixture(autouse=True, scope="session")
 def init_cache():
     FastAPICache.init(InMemoryBackend(), prefix="test-cache")
 
 
+@pytest.fixture(autouse=True)
+def archive_dir(tmp_path, mocker) -> str:
+    """Keeps the Parquet archive written by the pipeline in a temporary directory"""
+    directory = f'{tmp_path}/archive/'
+    mocker.patch('src.parser.spimex_trading_results.ARCHIVE_DIR', directory)
+    return directory
+
+
 @pytest.fixture
 def url_manager():
     return URLManager()
+
+
+BULLETIN_ROWS = [
+    ('A592ANK060F', 'Бензин (АИ-92-К5) по ГОСТ, Ангарск', 'Ангарск-группа станций', '600', '24775140', '10'),
+    ('A592AVM005A', 'Бензин (АИ-92-К5) по ГОСТ, СН КНПЗ', 'СН КНПЗ', '25', '59 438 602', '1'),
+    ('DTSCPRY060F', 'ДТ сорта C, Пермь', 'Пермь', '0', '0', '-'),
+    ('A100NVY060F', 'Бензин (АИ-100-К5), Новоярославская', 'ст. Новоярославская', 60, 4500000, 1),
+]
+
+
+@pytest.fixture
+def write_bulletin(tmp_path):
+    """
+    Writes a workbook laid out like a SPIMEX oil products bulletin:
+    title rows, the metric ton section with a two-row header,
+    instruments, section footer and a following section in kilograms
+    """
+    def write(file_name: str = 'oil_xls_20250430162000.xls', rows=None) -> str:
+        workbook = xlwt.Workbook()
+        sheet = workbook.add_sheet('TRADE_SUMMARY')
+        sheet.write(3, 1, 'Бюллетень по итогам торгов в Секции «Нефтепродукты»')
+        sheet.write(4, 1, 'Дата торгов: 30.04.2025')
+        sheet.write(6, 1, 'Единица измерения: Метрическая тонна')
+        for column, title in zip((1, 2, 3, 4, 5, 14),
+                                 ('Код\nИнструмента', 'Наименование\nИнструмента', 'Базис\nпоставки',
+                                  'Объем\nДоговоров\nв единицах\nизмерения', 'Обьем\nДоговоров,\nруб.',
+                                  'Количество\nДоговоров,\nшт.')):
+            sheet.write(7, column, title)
+        for column in range(6, 14):
+            sheet.write(8, column, 'Руб.')
+        row_number = 9
+        for row_number, row in enumerate(BULLETIN_ROWS if rows is None else rows, start=9):
+            for column, value in zip((1, 2, 3, 4, 5, 14), row):
+                sheet.write(row_number, column, value)
+        sheet.write(row_number + 1, 1, 'Итого:')
+        sheet.write(row_number + 2, 1, 'Итого по секции:')
+        sheet.write(row_number + 4, 1, 'Единица измерения: Килограмм')
+        sheet.write(row_number + 5, 1, 'Код\nИнструмента')
+        sheet.write(row_number + 7, 1, 'KGPROD001A')
+        file_path = tmp_path / file_name
+        workbook.save(file_path)
+        return str(file_path)
+
+    return write
+
+
+@pytest_asyncio.fixture
+async def spimex_server():
+    """
+    Local stand-in for spimex.com serving results pages and bulletins.
+    server.pages holds the html of the results pages (the last one is
+    repeated for pages past the end, like the site does), server.responses
+    maps a table name to the statuses it answers with, one per request
+    (200 once they run out), server.stats counts requests and the highest
+    number of requests served at the same time
+    """
+    pages = []
+    responses = {}
+    stats = {'requests': 0, 'page_requests': 0, 'in_flight': 0, 'max_in_flight': 0}
+    content = b'xls content' * 10_000
+
+    async def results(request: web.Request) -> web.Response:
+        stats['page_requests'] += 1
+        page_number = int(request.query.get('page', 'page-1').removeprefix('page-'))
+        return web.Response(text=pages[min(page_number, len(pages)) - 1] if pages else '')
+
+    async def table(request: web.Request) -> web.StreamResponse:
+        stats['requests'] += 1
+        stats['in_flight'] += 1
+        stats['max_in_flight'] = max(stats['max_in_flight'], stats['in_flight'])
+        try:
+            await asyncio.sleep(0.01)
+            statuses = responses.get(request.match_info['name'], [])
+            status = statuses.pop(0) if statuses else 200
+            if status != 200:
+                return web.Response(status=status, text='Error')
+            return web.Response(body=content)
+        finally:
+            stats['in_flight'] -= 1
+
+    app = web.Application()
+    app.router.add_get('/markets/oil_products/trades/results/', results)
+    app.router.add_get('/upload/reports/oil_xls/{name}', table)
+    server = TestServer(app)
+    server.pages, server.responses, server.stats, server.content = pages, responses, stats, content
+    await server.start_server()
+    yield server
+    await server.close()
@@ -1,6 +1,10 @@
-from unittest.mock import AsyncMock
+import datetime
+from unittest.mock import AsyncMock, Mock
 
 import pytest
+from fastapi_cache import FastAPICache
+
+from src.cache import invalidate_cache
 
 
 @pytest.mark.asyncio
@@ -109,6 +113,88 @@ async def test_get_dynamics_value_error(client, mocker):
     assert response.json() == {'detail': 'Invalid date range'}
 
 
+@pytest.mark.asyncio
+@pytest.mark.parametrize('returned, next_cursor', [(2, '2025-04-25.2'), (1, None)])
+async def test_get_dynamics_paginated(client, mocker, returned, next_cursor):
+    page = [{'id': 1, 'date': datetime.date(2025, 4, 24)},
+            {'id': 2, 'date': datetime.date(2025, 4, 25)}][:returned]
+    mock_func = AsyncMock(return_value=page)
+    mocker.patch('src.api.service.get_dynamics', mock_func)
+
+    response = await client.get('/dynamics', params={'start_date': '2025-04-24',
+                                                     'end_date': '2025-04-30',
+                                                     'limit': 2,
+                                                     'cursor': f'2025-04-23.{returned}'})
+
+    assert response.status_code == 200
+    assert response.json()['next_cursor'] == next_cursor
+    assert mock_func.call_args.kwargs == {'limit': 2, 'cursor': f'2025-04-23.{returned}', 'fields': None}
+
+
+@pytest.mark.asyncio
+async def test_get_trading_results_fields(client, mocker):
+    mock_func = AsyncMock(return_value=[{'id': 1, 'date': datetime.date(2025, 4, 30), 'volume': 60}])
+    mocker.patch('src.api.service.get_trading_results', mock_func)
+
+    response = await client.get('/last_results', params={'fields': 'volume, date'})
+
+    assert response.json() == {'success': True,
+                               'last_trading_results': [{'id': 1, 'date': '2025-04-30', 'volume': 60}]}
+    assert mock_func.call_args.kwargs == {'fields': ['volume', 'date']}
+
+
+@pytest.mark.asyncio
+async def test_get_trading_results_unknown_field(client, mocker):
+    mocker.patch('src.api.service.get_trading_results', AsyncMock(side_effect=ValueError('Unknown fields: price.')))
+
+    response = await client.get('/last_results', params={'fields': 'price'})
+
+    assert response.status_code == 400
+    assert response.json() == {'detail': 'Unknown fields: price.'}
+
+
+@pytest.mark.asyncio
+async def test_get_dynamics_limit_is_bounded(client):
+    response = await client.get('/dynamics', params={'start_date': '2025-04-24',
+                                                     'end_date': '2025-04-30',
+                                                     'limit': 0})
+    assert response.status_code == 422
+
+
+def chunks_of(*chunks):
+    async def iterate():
+        for chunk in chunks:
+            yield chunk
+    return iterate()
+
+
+@pytest.mark.asyncio
+async def test_export_dynamics_ndjson_and_csv(client, mocker):
+    rows = [{'id': 1, 'oil_id': 'A100', 'date': datetime.date(2025, 4, 24)},
+            {'id': 2, 'oil_id': 'A100', 'date': datetime.date(2025, 4, 25)}]
+    params = {'start_date': '2025-04-24', 'end_date': '2025-04-30'}
+
+    mocker.patch('src.api.service.stream_dynamics', Mock(return_value=chunks_of(rows[:1], rows[1:])))
+    response = await client.get('/dynamics/export', params=params)
+
+    assert response.headers['content-type'] == 'application/x-ndjson'
+    assert response.text.splitlines() == ['{"id": 1, "oil_id": "A100", "date": "2025-04-24"}',
+                                          '{"id": 2, "oil_id": "A100", "date": "2025-04-25"}']
+
+    mocker.patch('src.api.service.stream_dynamics', Mock(return_value=chunks_of(rows[:1], rows[1:])))
+    response = await client.get('/dynamics/export', params={**params, 'format': 'csv'})
+
+    assert response.headers['content-type'].startswith('text/csv')
+    assert response.text.splitlines() == ['id,oil_id,date', '1,A100,2025-04-24', '2,A100,2025-04-25']
+
+
+@pytest.mark.asyncio
+async def test_export_dynamics_value_error(client):
+    response = await client.get('/dynamics/export', params={'start_date': '2025-04-30',
+                                                            'end_date': '2025-04-24'})
+    assert response.status_code == 400
+
+
 @pytest.mark.asyncio
 async def test_get_dynamics_returns_422(client):
     response = await client.get('/dynamics')
@@ -150,3 +236,44 @@ async def test_get_trading_results_success_and_cached(client, mocker):
     assert response2.status_code == 200
     assert response2.json() == {'success': True, 'last_trading_results': mock_last_results}
     assert mock_func.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_get_aggregates_success_and_cached(client, mocker):
+    mock_aggregates = [{'date': '2025-04-30', 'oil_id': 'A100', 'delivery_basis_id': 'ABS',
+                        'rows': 3, 'volume': 180, 'total': 13500000}]
+    mock_func = AsyncMock(return_value=mock_aggregates)
+    mocker.patch('src.api.service.get_aggregates', mock_func)
+    params = {'start_date': '2025-04-24', 'end_date': '2025-04-30', 'oil_id': 'A100'}
+
+    response1 = await client.get('/aggregates', params=params)
+    response2 = await client.get('/aggregates', params=params)
+
+    assert response1.json() == response2.json() == {'success': True, 'aggregates': mock_aggregates}
+    assert mock_func.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_get_aggregates_value_error(client, mocker):
+    mocker.patch('src.api.service.get_aggregates', AsyncMock(side_effect=ValueError('Invalid date range')))
+
+    response = await client.get('/aggregates', params={'start_date': '2025-04-30', 'end_date': '2025-04-24'})
+
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_invalidate_cache_drops_only_trading_results(client, mocker):
+    mock_func = AsyncMock(return_value=['2025-04-30'])
+    mocker.patch('src.api.service.get_last_trading_dates', mock_func)
+    await FastAPICache.get_backend().set('test-cache:other:key', b'1')
+
+    await client.get('/last_dates?amount=1')
+    await client.get('/last_dates?amount=1')
+    assert mock_func.call_count == 1
+
+    await invalidate_cache()
+
+    await client.get('/last_dates?amount=1')
+    assert mock_func.call_count == 2
+    assert await FastAPICache.get_backend().get('test-cache:other:key') == b'1'
@@ -0,0 +1,331 @@
+import asyncio
+import datetime
+from unittest.mock import AsyncMock
+
+import fakeredis
+import pytest
+import pytest_asyncio
+from fastapi.responses import ORJSONResponse
+from fastapi_cache import FastAPICache
+from fastapi_cache.backends.inmemory import InMemoryBackend
+from fastapi_cache.backends.redis import RedisBackend
+from fastapi_cache.coder import JsonCoder
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src import cache
+from src.api.spimex_trading_results import cache_key_builder, get_dynamics, get_trading_results
+from src.cache import CompressedCoder, TwoTierBackend
+
+DYNAMICS_PARAMS = {'start_date': '2025-04-24', 'end_date': '2025-04-30'}
+
+
+def slow_service(result=None, error=None, delay=0.2):
+    async def query(*args, **kwargs):
+        await asyncio.sleep(delay)
+        if error:
+            raise error
+        return result
+    return AsyncMock(side_effect=query)
+
+
+@pytest_asyncio.fixture(autouse=True)
+async def clear_cache():
+    await FastAPICache.clear()
+    yield
+    await FastAPICache.clear()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_identical_requests_run_one_query_per_key(client, mocker, capfd):
+    mock_func = slow_service([{'id': 1, 'date': '2025-04-24'}])
+    mocker.patch('src.api.service.get_dynamics', mock_func)
+
+    responses = await asyncio.gather(*(client.get('/dynamics', params={**DYNAMICS_PARAMS, 'oil_id': f'A{i % 2}'})
+                                       for i in range(200)))
+
+    assert {response.status_code for response in responses} == {200}
+    assert {response.text for response in responses} == {'{"success":true,"dynamics":[{"id":1,"date":"2025-04-24"}]}'}
+    assert mock_func.call_count == 2  # one per oil_id
+    with capfd.disabled():
+        print(f'\n200 concurrent requests over 2 keys: {mock_func.call_count / 2:.0f} query per key')
+
+
+@pytest.mark.asyncio
+async def test_concurrent_requests_share_an_error(client, mocker):
+    mock_func = slow_service(error=ValueError('Invalid date range'))
+    mocker.patch('src.api.service.get_dynamics', mock_func)
+
+    responses = await asyncio.gather(*(client.get('/dynamics', params=DYNAMICS_PARAMS) for _ in range(20)))
+
+    assert {response.status_code for response in responses} == {400}
+    assert mock_func.call_count == 1
+    assert cache._in_flight == {}
+
+
+class FakeRedisLock:
+    def __init__(self, lock: asyncio.Lock):
+        self.lock = lock
+
+    async def acquire(self) -> bool:
+        await self.lock.acquire()
+        return True
+
+    async def release(self) -> None:
+        self.lock.release()
+
+
+class LockingBackend(InMemoryBackend):
+    """In-memory backend exposing a redis-like lock, standing for a Redis shared by workers"""
+    def __init__(self):
+        self.locks = {}
+        self.redis = self
+
+    def lock(self, name: str, **kwargs) -> FakeRedisLock:
+        return FakeRedisLock(self.locks.setdefault(name, asyncio.Lock()))
+
+
+@pytest.mark.asyncio
+async def test_waiting_worker_reads_result_of_the_lock_holder(client, mocker):
+    backend = LockingBackend()
+    mocker.patch.object(FastAPICache, '_backend', backend)
+    mock_func = AsyncMock(return_value=['2025-04-30'])
+    mocker.patch('src.api.service.get_last_trading_dates', mock_func)
+
+    await client.get('/last_dates?amount=1')
+    [key] = [key for key in backend._store if key.startswith('test-cache:trading_results')]
+    await backend.clear(key=key)
+
+    # another worker holds the lock and fills the cache meanwhile
+    other_worker = backend.lock(f'{key}:lock')
+    await other_worker.acquire()
+    request = asyncio.create_task(client.get('/last_dates?amount=1'))
+    await asyncio.sleep(0.1)
+    await backend.set(key, b'{"success":true,"last_trading_dates":["2025-05-01"]}')
+    await other_worker.release()
+
+    response = await request
+    assert response.json() == {'success': True, 'last_trading_dates': ['2025-05-01']}
+    assert mock_func.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_stale_response_is_served_while_revalidating(client, mocker):
+    mocker.patch('src.cache.settings.CACHE_EXPIRE', 60)
+    mocker.patch('src.cache.settings.CACHE_STALE', 30)
+    mock_func = AsyncMock(side_effect=[['2025-04-30'], ['2025-05-01']])
+    mocker.patch('src.api.service.get_last_trading_dates', mock_func)
+    backend = FastAPICache.get_backend()
+
+    await client.get('/last_dates?amount=1')
+    [key] = [key for key in backend._store if key.startswith('test-cache:trading_results')]
+    await backend.set(key, await backend.get(key), 10)  # expired, within the stale period
+
+    stale = await client.get('/last_dates?amount=1')
+    await asyncio.gather(*cache._revalidations)
+    fresh = await client.get('/last_dates?amount=1')
+
+    assert stale.json()['last_trading_dates'] == ['2025-04-30']
+    assert fresh.json()['last_trading_dates'] == ['2025-05-01']
+    assert mock_func.call_count == 2
+
+
+@pytest.fixture
+def redis_server():
+    return fakeredis.FakeServer()
+
+
+def two_tier(server, **kwargs) -> TwoTierBackend:
+    return TwoTierBackend(RedisBackend(fakeredis.FakeAsyncRedis(server=server)), **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_two_tier_backend_serves_hot_keys_from_memory(redis_server):
+    backend = two_tier(redis_server)
+    await backend.backend.set('api:cache:trading_results:key', b'value', 60)
+
+    assert await backend.get_with_ttl('api:cache:trading_results:key') == (60, b'value')
+    ttl, value = await backend.get_with_ttl('api:cache:trading_results:key')
+    assert value == b'value' and 59 <= ttl <= 60
+    assert await backend.get('api:cache:trading_results:missing') is None
+
+    assert backend.stats == {'l1': {'hits': 1, 'misses': 2}, 'l2': {'hits': 1, 'misses': 1}}
+    assert backend.redis is backend.backend.redis
+
+
+@pytest.mark.asyncio
+async def test_two_tier_backend_evicts_least_recently_used_by_size(redis_server):
+    backend = two_tier(redis_server, max_bytes=10)
+    await backend.set('a', b'123456')
+    await backend.set('b', b'1234')
+    await backend.get('a')
+    await backend.set('c', b'12')
+
+    assert list(backend.entries) == ['a', 'c']
+    assert backend.size == 8
+    assert await backend.get('b') == b'1234'  # still in Redis
+    assert backend.stats['l2']['hits'] == 1
+
+    await backend.set('d', b'12345678901')  # larger than the whole L1
+    assert 'd' not in backend.entries
+
+
+@pytest.mark.asyncio
+async def test_two_tier_backend_expires_memory_entries(redis_server):
+    backend = two_tier(redis_server, ttl=0.05)
+    await backend.set('key', b'value')
+    await asyncio.sleep(0.06)
+
+    assert await backend.get('key') == b'value'
+    assert backend.stats['l1'] == {'hits': 0, 'misses': 1}
+
+
+@pytest.mark.asyncio
+async def test_two_tier_invalidation_reaches_every_worker(redis_server):
+    workers = [two_tier(redis_server), two_tier(redis_server)]
+    for worker in workers:
+        await worker.start()
+    await asyncio.sleep(0.05)  # subscribed
+    await workers[0].set('api:cache:trading_results:key', b'value')
+    await workers[0].set('api:cache:other:key', b'other')
+    assert await workers[1].get('api:cache:trading_results:key') == b'value'
+    assert await workers[1].get('api:cache:other:key') == b'other'
+
+    await workers[0].clear(namespace='api:cache:trading_results')
+    for _ in range(50):
+        if 'api:cache:trading_results:key' not in workers[1].entries:
+            break
+        await asyncio.sleep(0.01)
+
+    assert list(workers[1].entries) == ['api:cache:other:key']
+    assert await workers[1].get('api:cache:trading_results:key') is None
+    for worker in workers:
+        await worker.stop()
+
+
+@pytest.mark.asyncio
+async def test_invalidation_bumps_data_version_of_every_worker(redis_server, mocker):
+    mocker.patch('src.cache._data_version', 0)
+    workers = [two_tier(redis_server), two_tier(redis_server)]
+    mocker.patch.object(FastAPICache, '_backend', workers[0])
+    mocker.patch.object(FastAPICache, '_prefix', 'api:cache')
+    for worker in workers:
+        await worker.start()
+    await asyncio.sleep(0.05)  # subscribed
+    key = key_for(oil_id='A100', **DYNAMICS_PARAMS)
+    await workers[0].set(key, b'value')
+    await workers[0].set(f'{key}:lock', b'token')
+    assert await workers[1].get(key) == b'value'
+
+    await cache.invalidate_cache()
+    for _ in range(50):
+        if key not in workers[1].entries:
+            break
+        await asyncio.sleep(0.01)
+
+    assert cache.data_version() == 1
+    assert key not in workers[1].entries
+    assert key_for(oil_id='A100', **DYNAMICS_PARAMS) != key
+    assert await workers[1].get(f'{key}:lock') == b'token'  # computations in flight keep their locks
+    for worker in workers:
+        await worker.stop()
+
+    mocker.patch('src.cache._data_version', 0)
+    await two_tier(redis_server).load_data_version()  # a worker started later
+    assert cache.data_version() == 1
+
+
+@pytest.mark.asyncio
+async def test_cache_stats(client, mocker):
+    backend = TwoTierBackend(InMemoryBackend())
+    mocker.patch.object(FastAPICache, '_backend', backend)
+    mocker.patch('src.api.service.get_last_trading_dates', AsyncMock(return_value=['2025-04-30']))
+
+    await client.get('/last_dates?amount=1')
+    await client.get('/last_dates?amount=1')
+    response = await client.get('/cache_stats')
+
+    assert response.json() == {'success': True,
+                               'stats': {'l1': {'hits': 1, 'misses': 1}, 'l2': {'hits': 0, 'misses': 1}}}
+
+
+def key_for(func=get_dynamics, **params) -> str:
+    return cache_key_builder(func, 'api:cache:trading_results', args=(), kwargs=params)
+
+
+def test_cache_key_is_canonical():
+    session = AsyncSession()
+    key = key_for(session=session, start_date=datetime.date(2025, 4, 24), end_date=datetime.date(2025, 4, 30),
+                  oil_id='A100', delivery_type_id=None)
+
+    assert key == key_for(oil_id='A100', end_date='2025-04-30', start_date='2025-04-24')
+    assert key == key_for(end_date=datetime.date(2025, 4, 30), delivery_basis_id=None,
+                          start_date=datetime.date(2025, 4, 24), oil_id='A100', session=AsyncSession())
+    assert key.startswith('api:cache:trading_results:get_dynamics:')
+    assert len(key) == len('api:cache:trading_results:get_dynamics:') + 32
+
+
+def test_cache_key_tells_different_requests_apart():
+    key = key_for(start_date='2025-04-24', end_date='2025-04-30')
+
+    assert key != key_for(start_date='2025-04-24', end_date='2025-04-29')
+    assert key != key_for(start_date='2025-04-24', end_date='2025-04-30', oil_id='A100')
+    assert key != key_for(get_trading_results, start_date='2025-04-24', end_date='2025-04-30')
+
+
+@pytest.mark.asyncio
+async def test_equivalent_requests_share_a_cache_entry(client, mocker):
+    mock_func = AsyncMock(return_value=[])
+    mocker.patch('src.api.service.get_dynamics', mock_func)
+
+    first = await client.get('/dynamics?start_date=2025-04-24&end_date=2025-04-30&oil_id=A100')
+    second = await client.get('/dynamics?oil_id=A100&end_date=2025-04-30T00:00:00&start_date=2025-04-24')
+    with_fields = [await client.get(f'/dynamics?start_date=2025-04-24&end_date=2025-04-30&fields={fields}')
+                   for fields in ('oil_id,volume', 'volume,oil_id', 'oil_id,%20volume')]
+    without_fields = [await client.get(f'/dynamics?start_date=2025-04-24&end_date=2025-04-30{fields}')
+                      for fields in ('&fields=', '')]
+
+    assert first.status_code == second.status_code == 200
+    assert {response.status_code for response in with_fields + without_fields} == {200}
+    assert mock_func.call_count == 3
+
+
+def test_cache_key_canonicalizes_fields():
+    key = key_for(start_date='2025-04-24', end_date='2025-04-30', fields='oil_id,volume')
+
+    assert key == key_for(start_date='2025-04-24', end_date='2025-04-30', fields='volume,oil_id')
+    assert key == key_for(start_date='2025-04-24', end_date='2025-04-30', fields='oil_id, volume')
+    assert key == key_for(start_date='2025-04-24', end_date='2025-04-30', fields='volume,oil_id,,volume')
+    assert key != key_for(start_date='2025-04-24', end_date='2025-04-30', fields='oil_id')
+    assert key_for(start_date='2025-04-24', end_date='2025-04-30', fields='') == \
+           key_for(start_date='2025-04-24', end_date='2025-04-30', fields=' , ') == \
+           key_for(start_date='2025-04-24', end_date='2025-04-30')
+
+
+def test_compressed_coder_round_trips_small_and_large_payloads():
+    small = {'success': True, 'last_trading_dates': ['2025-04-30']}
+    large = ORJSONResponse({'success': True,
+                            'dynamics': [{'id': i, 'oil_id': 'A592', 'date': datetime.date(2025, 4, 30)}
+                                         for i in range(1000)]})
+
+    small_value, large_value = CompressedCoder.encode(small), CompressedCoder.encode(large)
+
+    assert small_value[:1] == b'\x00'
+    assert large_value[:1] == b'\x01'
+    assert len(large_value) < len(large.body) / 5
+    assert CompressedCoder.decode(small_value) == small
+    assert CompressedCoder.decode(large_value)['dynamics'][-1] == {'id': 999, 'oil_id': 'A592', 'date': '2025-04-30'}
+    assert CompressedCoder.decode(JsonCoder.encode(small)) == small
+
+
+@pytest.mark.asyncio
+async def test_compressed_coder_serves_cache_hits(client, mocker):
+    mocker.patch.object(FastAPICache, '_coder', CompressedCoder)
+    dynamics = [{'id': i, 'oil_id': 'A592', 'date': '2025-04-30'} for i in range(500)]
+    mock_func = AsyncMock(return_value=dynamics)
+    mocker.patch('src.api.service.get_dynamics', mock_func)
+
+    first = await client.get('/dynamics', params=DYNAMICS_PARAMS)
+    second = await client.get('/dynamics', params=DYNAMICS_PARAMS)
+
+    assert first.json() == second.json() == {'success': True, 'dynamics': dynamics}
+    assert mock_func.call_count == 1
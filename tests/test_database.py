@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+from sqlalchemy import exc, text
+
+from src.config import settings
+from src.database import MeteredPool, build_engine
+from tests.conftest import test_engine
+
+
+def engine_with(**values):
+    return build_engine(settings.model_copy(update=values))
+
+
+@pytest.mark.asyncio
+async def test_build_engine_applies_pool_settings():
+    engine = engine_with(DB_POOL_SIZE=3, DB_MAX_OVERFLOW=1, DB_POOL_TIMEOUT=5, DB_POOL_RECYCLE=60,
+                         DB_POOL_PRE_PING='always')
+
+    assert isinstance(engine.pool, MeteredPool)
+    assert (engine.pool.size(), engine.pool.timeout()) == (3, 5)
+    assert (engine.pool._max_overflow, engine.pool._recycle, engine.pool._pre_ping) == (1, 60, True)
+    assert engine_with(DB_POOL_PRE_PING='idle').pool._pre_ping is False
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_metered_pool_counts_checkouts_and_timeouts():
+    engine = engine_with(DB_POOL_SIZE=1, DB_MAX_OVERFLOW=0, DB_POOL_TIMEOUT=0.5)
+
+    async def query():
+        async with engine.connect() as connection:
+            await connection.execute(text('SELECT pg_sleep(0.01)'))
+
+    async with engine.connect() as held:
+        await held.execute(text('SELECT 1'))
+        with pytest.raises(exc.TimeoutError):
+            await query()
+        assert engine.pool.stats['checked_out'] == 1
+    await asyncio.gather(*(query() for _ in range(5)))  # queued for the only connection
+    stats = engine.pool.stats
+    await engine.dispose()
+
+    assert {key: stats[key] for key in ('size', 'checked_out', 'overflow', 'checkouts', 'timeouts')} == \
+           {'size': 1, 'checked_out': 0, 'overflow': 0, 'checkouts': 6, 'timeouts': 1}
+    assert 0 < stats['wait_ms']['p50'] <= stats['wait_ms']['p99'] <= stats['wait_ms']['max']
+    assert stats['wait_ms']['max'] >= 40  # the last query waited for four others
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('pre_ping', ['idle', 'never'])
+async def test_idle_pre_ping_replaces_dropped_connections(pre_ping):
+    engine = engine_with(DB_POOL_SIZE=1, DB_POOL_PRE_PING=pre_ping, DB_POOL_PRE_PING_IDLE=0)
+    async with engine.connect() as connection:
+        pid = await connection.scalar(text('SELECT pg_backend_pid()'))
+    async with test_engine.connect() as other:
+        await other.execute(text('SELECT pg_terminate_backend(:pid, 5000)'), {'pid': pid})
+
+    try:
+        if pre_ping == 'never':
+            with pytest.raises(exc.DBAPIError):
+                async with engine.connect() as connection:
+                    await connection.execute(text('SELECT 1'))
+        else:
+            async with engine.connect() as connection:
+                assert await connection.scalar(text('SELECT pg_backend_pid()')) != pid
+    finally:
+        await engine.dispose()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('prepared, names', [(True, 1), (False, 3)])
+async def test_prepared_statements_can_be_disabled(prepared, names):
+    engine = engine_with(DB_PREPARED_STATEMENTS=prepared)
+    statement = text('SELECT name FROM pg_prepared_statements WHERE statement = :statement')
+    async with engine.connect() as connection:
+        # a statement sees itself prepared, under the same name again when it is reused
+        seen = {await connection.scalar(statement, {'statement': str(statement).replace(':statement', '$1')})
+                for _ in range(3)}
+    await engine.dispose()
+
+    assert len(seen) == names
+
+
+@pytest.mark.asyncio
+async def test_pool_stats(client):
+    response = await client.get('/pool_stats')
+
+    assert response.json()['success'] is True
+    assert set(response.json()['stats']) == {'size', 'checked_out', 'overflow', 'checkouts', 'timeouts', 'wait_ms'}
+    assert response.json()['stats']['size'] == settings.DB_POOL_SIZE
@@ -0,0 +1,150 @@
+import asyncio
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import text
+
+from src.ingest import INGEST_LOCK_KEY, build_snapshot, ingest_lock, run_ingest
+from tests import conftest
+from tests.conftest import test_engine
+
+
+@pytest_asyncio.fixture
+async def ingest_db(setup_db, mocker):
+    mocker.patch('src.ingest.engine', test_engine)
+    mocker.patch('src.ingest.Session', conftest.test_session)
+
+
+async def last_run() -> dict:
+    async with conftest.test_session() as session:
+        result = await session.execute(text('SELECT * FROM spimex_ingest_runs ORDER BY id DESC LIMIT 1'))
+        return dict(result.mappings().one())
+
+
+@pytest.mark.asyncio
+async def test_run_ingest_records_the_run(ingest_db, mocker):
+    mocker.patch('src.ingest.settings.INGEST_PROGRESS_INTERVAL', 0.01)
+    progress = []
+
+    async def parse(parser, incremental):
+        parser.download_stats['files'] = 3
+        parser.pipeline_stats.update(tables=2, rows_affected=40)
+        await asyncio.sleep(0.05)
+        progress.append(await last_run())  # written while running
+        parser.pipeline_stats.update(tables=3, rows_affected=60)
+    parse_spimex = mocker.patch('src.ingest.parse_spimex', side_effect=parse)
+
+    assert await run_ingest('cli', incremental=False) is True
+
+    assert parse_spimex.call_args.args[1] is False
+    assert progress[0]['status'] == 'running'
+    assert (progress[0]['tables'], progress[0]['rows_affected']) == (2, 40)
+    run = await last_run()
+    assert run['trigger'] == 'cli' and run['status'] == 'succeeded' and run['error'] is None
+    assert (run['files_downloaded'], run['tables'], run['rows_affected']) == (3, 3, 60)
+    assert run['finished_on'] >= run['started_on']
+
+
+@pytest.mark.asyncio
+async def test_run_ingest_records_a_failure(ingest_db, mocker):
+    mocker.patch('src.ingest.parse_spimex', side_effect=ConnectionError('spimex.com is down'))
+
+    with pytest.raises(ConnectionError):
+        await run_ingest()
+
+    run = await last_run()
+    assert run['status'] == 'failed'
+    assert 'spimex.com is down' in run['error']
+    async with test_engine.connect() as connection:  # the lock has been released
+        assert await connection.scalar(text('SELECT pg_try_advisory_lock(:key)'), {'key': INGEST_LOCK_KEY})
+
+
+@pytest.mark.asyncio
+async def test_run_ingest_with_failed_downloads_is_partial(ingest_db, mocker):
+    async def parse(parser, incremental):
+        parser.download_errors['https://spimex.com/upload/reports/oil_xls/oil_xls_20250429162000'] = \
+            'https://spimex.com/upload/reports/oil_xls/oil_xls_20250429162000: 404 Not Found'
+    mocker.patch('src.ingest.parse_spimex', side_effect=parse)
+
+    assert await run_ingest() is True
+
+    run = await last_run()
+    assert run['status'] == 'partial'
+    assert run['error'].startswith('1 tables have not been downloaded: ')
+    assert 'oil_xls_20250429162000: 404 Not Found' in run['error']
+
+
+@pytest.mark.asyncio
+async def test_run_ingest_is_skipped_while_another_one_runs(ingest_db, mocker, capfd):
+    parse_spimex = mocker.patch('src.ingest.parse_spimex')
+
+    async with test_engine.connect() as other_worker:
+        assert await other_worker.scalar(text('SELECT pg_try_advisory_lock(:key)'), {'key': INGEST_LOCK_KEY})
+        assert await run_ingest() is False
+        await other_worker.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': INGEST_LOCK_KEY})
+
+    parse_spimex.assert_not_called()
+    assert 'Ingestion is already running' in capfd.readouterr().out
+    async with conftest.test_session() as session:
+        assert await session.scalar(text('SELECT count(*) FROM spimex_ingest_runs')) == 0
+
+
+@pytest.mark.asyncio
+async def test_ingest_status_endpoint(ingest_db, client, mocker):
+    mocker.patch('src.ingest.parse_spimex')
+    await run_ingest()
+    await run_ingest('cli')
+
+    response = await client.get('/ingest_status?amount=5')
+    runs = response.json()['runs']
+    assert [run['trigger'] for run in runs] == ['cli', 'scheduler']
+    assert {run['status'] for run in runs} == {'succeeded'}
+    assert (await client.get('/ingest_status?amount=0')).status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_run_ingest_from_archive(ingest_db, mocker):
+    parse_spimex = mocker.patch('src.ingest.parse_spimex')
+    rebuild_spimex = mocker.patch('src.ingest.rebuild_spimex')
+
+    assert await run_ingest('cli', from_archive=True) is True
+
+    rebuild_spimex.assert_awaited_once()
+    parse_spimex.assert_not_called()
+    assert (await last_run())['status'] == 'succeeded'
+
+
+@pytest.mark.asyncio
+async def test_missing_snapshot_is_built_by_the_lock_holder_only(ingest_db, mocker, capfd):
+    mocker.patch('src.ingest.settings.DYNAMICS_ENGINE', 'snapshot')
+    mocker.patch('src.ingest.current_snapshot', return_value=None)
+    refresh_snapshot = mocker.patch('src.ingest.refresh_snapshot')
+    mocker.patch('src.ingest.parse_spimex')
+
+    async with test_engine.connect() as other_worker:
+        assert await other_worker.scalar(text('SELECT pg_try_advisory_lock(:key)'), {'key': INGEST_LOCK_KEY})
+        assert await build_snapshot() is False
+        assert await run_ingest() is False
+        await other_worker.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': INGEST_LOCK_KEY})
+    refresh_snapshot.assert_not_called()
+    assert 'Ingestion is running, it builds the snapshot' in capfd.readouterr().out
+
+    assert await build_snapshot() is True
+    assert await run_ingest() is True
+    assert refresh_snapshot.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_ingest_lock_lives_in_one_transaction(ingest_db):
+    async with ingest_lock() as locked:
+        assert locked is True
+        async with test_engine.connect() as other_worker:
+            # held by an open transaction, which a pooler in transaction mode keeps on one server connection
+            assert await other_worker.scalar(text("SELECT count(*) FROM pg_locks JOIN pg_stat_activity "
+                                                  "USING (pid) WHERE locktype = 'advisory' "
+                                                  "AND state = 'idle in transaction'")) == 1
+        async with ingest_lock() as other_locked:
+            assert other_locked is False
+
+    async with test_engine.connect() as other_worker:  # released with the transaction
+        assert await other_worker.scalar(text('SELECT pg_try_advisory_lock(:key)'), {'key': INGEST_LOCK_KEY})
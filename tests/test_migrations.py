@@ -0,0 +1,161 @@
+import pytest
+from alembic import command
+from alembic.autogenerate import compare_metadata
+from alembic.config import Config
+from alembic.migration import MigrationContext
+from sqlalchemy import text
+
+from src.config import settings
+from src.database import BaseModel, include_name, run_migrations
+from tests.conftest import test_engine
+
+
+async def reset_schema(conn) -> None:
+    assert settings.MODE == 'TEST'
+    await conn.run_sync(BaseModel.metadata.drop_all)
+    await conn.execute(text('DROP TABLE IF EXISTS alembic_version'))
+
+
+@pytest.mark.asyncio
+async def test_migrations_match_models():
+    async with test_engine.begin() as conn:
+        await reset_schema(conn)
+        await conn.run_sync(run_migrations)
+        diff = await conn.run_sync(lambda sync_conn: compare_metadata(
+            MigrationContext.configure(sync_conn, opts={'include_name': include_name}), BaseModel.metadata))
+        await reset_schema(conn)
+    assert diff == []
+
+
+@pytest.mark.asyncio
+async def test_natural_key_migration_removes_duplicates():
+    async with test_engine.begin() as conn:
+        await reset_schema(conn)
+        await conn.run_sync(run_migrations, '0001')
+        await conn.execute(text(
+            "INSERT INTO spimex_trading_results VALUES "
+            "(1, 'A592ANK060F', 'name', 'A592', 'ANK', 'basis', 'F', '1', '1', '1', '2025-04-30', '2025-04-30', NULL),"
+            "(7, 'A592ANK060F', 'name', 'A592', 'ANK', 'basis', 'F', '1', '1', '1', '2025-04-30', '2025-04-30', NULL),"
+            "(8, 'A592ANK060F', 'name', 'A592', 'ANK', 'basis', 'F', '1', '1', '1', '2025-04-29', '2025-04-30', NULL)"
+        ))
+        await conn.run_sync(run_migrations, '0002')
+        ids = (await conn.execute(text('SELECT id FROM spimex_trading_results ORDER BY id'))).scalars().all()
+        next_id = (await conn.execute(text(
+            "INSERT INTO spimex_trading_results (exchange_product_id, exchange_product_name, oil_id, "
+            "delivery_basis_id, delivery_basis_name, delivery_type_id, volume, total, count, date, created_on) "
+            "VALUES ('A592ANK060F', 'name', 'A592', 'ANK', 'basis', 'F', '1', '1', '1', '2025-05-01', '2025-05-01') "
+            "RETURNING id"
+        ))).scalar()
+        await reset_schema(conn)
+    assert ids == [1, 8]
+    assert next_id == 9
+
+
+@pytest.mark.asyncio
+async def test_numeric_amounts_migration_converts_text():
+    async with test_engine.begin() as conn:
+        await reset_schema(conn)
+        await conn.run_sync(run_migrations, '0002')
+        await conn.execute(text(
+            "INSERT INTO spimex_trading_results VALUES "
+            "(1, 'A592ANK060F', 'name', 'A592', 'ANK', 'basis', 'F', '600', '24 775 140', '10', "
+            "'2025-04-30', '2025-04-30', NULL),"
+            "(2, 'A592AVM005A', 'name', 'A592', 'AVM', 'basis', 'A', '25.0', '59438602', '1', "
+            "'2025-04-30', '2025-04-30', NULL)"
+        ))
+        await conn.run_sync(run_migrations, '0003')
+        rows = (await conn.execute(text('SELECT volume, total, count, volume * count '
+                                        'FROM spimex_trading_results ORDER BY id'))).all()
+        await reset_schema(conn)
+    assert rows == [(600, 24775140, 10, 6000), (25, 59438602, 1, 25)]
+
+
+@pytest.mark.asyncio
+async def test_daily_aggregates_migration_backfills_results():
+    async with test_engine.begin() as conn:
+        await reset_schema(conn)
+        await conn.run_sync(run_migrations, '0005')
+        await conn.execute(text(
+            "INSERT INTO spimex_trading_results VALUES "
+            "(1, 'A592ANK060F', 'name', 'A592', 'ANK', 'basis', 'F', 600, 24775140, 10, '2025-04-30', '2025-04-30', NULL),"
+            "(2, 'A592ANK005A', 'name', 'A592', 'ANK', 'basis', 'A', 25, 1000, 1, '2025-04-30', '2025-04-30', NULL),"
+            "(3, 'A592ANK060F', 'name', 'A592', 'ANK', 'basis', 'F', 60, 4500000, 1, '2025-04-29', '2025-04-30', NULL)"
+        ))
+        await conn.run_sync(run_migrations, '0006')
+        rows = (await conn.execute(text('SELECT date::text, oil_id, delivery_basis_id, rows, volume, total '
+                                        'FROM spimex_daily_aggregates ORDER BY date'))).all()
+        await reset_schema(conn)
+    assert rows == [('2025-04-29', 'A592', 'ANK', 1, 60, 4500000),
+                    ('2025-04-30', 'A592', 'ANK', 2, 625, 24776140)]
+
+
+@pytest.mark.asyncio
+async def test_dimension_tables_migration_moves_names():
+    async with test_engine.begin() as conn:
+        await reset_schema(conn)
+        await conn.run_sync(run_migrations, '0007')
+        await conn.execute(text(
+            "INSERT INTO spimex_trading_results VALUES "
+            "(1, 'A592ANK060F', 'Бензин, Ангарск', 'A592', 'ANK', 'Ангарск', 'F', 600, 24775140, 10, "
+            "'2025-04-30', '2025-04-30', NULL),"
+            "(2, 'A592ANK005A', 'Бензин, Ангарск', 'A592', 'ANK', 'Ангарск', 'A', 25, 1000, 1, "
+            "'2025-04-30', '2025-04-30', NULL),"
+            "(3, 'A592ANK060F', 'Бензин, Ангарск', 'A592', 'ANK', 'Ангарск', 'F', 60, 4500000, 1, "
+            "'2025-04-29', '2025-04-30', NULL)"
+        ))
+        await conn.run_sync(run_migrations, '0008')
+        instruments = (await conn.execute(text('SELECT count(*) FROM spimex_instruments'))).scalar()
+        rows = (await conn.execute(text(
+            'SELECT results.id, instruments.exchange_product_name, bases.delivery_basis_name '
+            'FROM spimex_trading_results AS results '
+            'JOIN spimex_instruments AS instruments ON instruments.id = results.instrument_key '
+            'JOIN spimex_delivery_bases AS bases ON bases.id = results.delivery_basis_key ORDER BY results.id'
+        ))).all()
+        await conn.run_sync(lambda sync_conn: command.downgrade(migrations_config(sync_conn), '0007'))
+        downgraded = (await conn.execute(text('SELECT id, exchange_product_name, delivery_basis_name '
+                                              'FROM spimex_trading_results ORDER BY id'))).all()
+        await reset_schema(conn)
+    assert instruments == 2
+    assert rows == downgraded == [(1, 'Бензин, Ангарск', 'Ангарск'),
+                                  (2, 'Бензин, Ангарск', 'Ангарск'),
+                                  (3, 'Бензин, Ангарск', 'Ангарск')]
+
+
+@pytest.mark.asyncio
+async def test_monthly_partitions_migration_moves_rows():
+    async with test_engine.begin() as conn:
+        await reset_schema(conn)
+        await conn.run_sync(run_migrations, '0008')
+        await conn.execute(text("INSERT INTO spimex_instruments VALUES (1, 'A592ANK060F', 'Бензин, Ангарск')"))
+        await conn.execute(text("INSERT INTO spimex_delivery_bases VALUES (1, 'Ангарск')"))
+        await conn.execute(text(
+            "INSERT INTO spimex_trading_results (id, exchange_product_id, oil_id, delivery_basis_id, "
+            "delivery_type_id, volume, total, count, date, created_on, updated_on, instrument_key, "
+            "delivery_basis_key) VALUES "
+            "(1, 'A592ANK060F', 'A592', 'ANK', 'F', 600, 24775140, 10, '2025-03-31', '2025-04-30', NULL, 1, 1),"
+            "(2, 'A592ANK060F', 'A592', 'ANK', 'F', 60, 4500000, 1, '2025-04-30', '2025-04-30', NULL, 1, 1)"
+        ))
+        await conn.execute(text("SELECT setval('spimex_trading_results_id_seq', 2)"))
+        await conn.run_sync(run_migrations, '0009')
+        partitions = (await conn.execute(text('SELECT id, tableoid::regclass::text FROM spimex_trading_results '
+                                              'ORDER BY id'))).all()
+        next_id = (await conn.execute(text(
+            "INSERT INTO spimex_trading_results (exchange_product_id, instrument_key, oil_id, delivery_basis_id, "
+            "delivery_basis_key, delivery_type_id, volume, total, count, date, created_on) "
+            "VALUES ('A592ANK060F', 1, 'A592', 'ANK', 1, 'F', 1, 1, 1, '2025-05-02', '2025-05-02') RETURNING id"
+        ))).scalar()
+        await conn.run_sync(lambda sync_conn: command.downgrade(migrations_config(sync_conn), '0008'))
+        downgraded = (await conn.execute(text('SELECT id, date::text FROM spimex_trading_results '
+                                              'ORDER BY id'))).all()
+        partitioned = (await conn.execute(text("SELECT count(*) FROM pg_class WHERE relkind = 'p'"))).scalar()
+        await reset_schema(conn)
+    assert partitions == [(1, 'spimex_trading_results_y2025m03'), (2, 'spimex_trading_results_y2025m04')]
+    assert next_id == 3
+    assert downgraded == [(1, '2025-03-31'), (2, '2025-04-30'), (3, '2025-05-02')]
+    assert partitioned == 0
+
+
+def migrations_config(connection) -> Config:
+    config = Config('alembic.ini')
+    config.attributes['connection'] = connection
+    return config
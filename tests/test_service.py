@@ -1,53 +1,68 @@
 import datetime
+import re
 
 import pytest
+import pytest_asyncio
+from sqlalchemy import event, text
 
-from src.api.service import parse_spimex, get_last_trading_dates, get_dynamics, get_trading_results
+from src.api.service import (parse_spimex, get_last_trading_dates, get_dynamics, get_trading_results,
+                             stream_dynamics, encode_cursor, get_aggregates, RESULT_FIELDS)
+from src.models.spimex_daily_aggregates import SpimexDailyAggregate
+from src.models.spimex_delivery_bases import SpimexDeliveryBasis
+from src.models.spimex_instruments import SpimexInstrument
 from src.models.spimex_trading_results import SpimexTradingResult
+from src.parser.spimex_trading_results import URLManager
+from tests.conftest import test_engine
 
 
 @pytest.fixture
 def instances(session):
+    angarsk = SpimexDeliveryBasis(id=1, delivery_basis_name='Ангарск-группа станций')
+    knpz = SpimexDeliveryBasis(id=2, delivery_basis_name='СН КНПЗ')
+    ank = SpimexInstrument(id=1, exchange_product_id='A592ANK060F',
+                           exchange_product_name='Бензин (АИ-92-К5) по ГОСТ,'
+                                                 ' Ангарск-группа станций (ст. отправления)')
+    avm = SpimexInstrument(id=2, exchange_product_id='A592AVM005A',
+                           exchange_product_name='Бензин (АИ-92-К5) по ГОСТ,'
+                                                 ' СН КНПЗ (самовывоз автотранспортом)')
     instances = [
+        angarsk, knpz, ank, avm,
         SpimexTradingResult(id=1,
                             exchange_product_id='A592ANK060F',
-                            exchange_product_name='Бензин (АИ-92-К5) по ГОСТ,'
-                                                  ' Ангарск-группа станций (ст. отправления)',
+                            instrument_key=ank.id,
                             oil_id='A600',
                             delivery_basis_id='ALI',
-                            delivery_basis_name='Ангарск-группа станций',
+                            delivery_basis_key=angarsk.id,
                             delivery_type_id='F',
-                            volume='600',
-                            total='24775140',
-                            count='10',
+                            volume=600,
+                            total=24775140,
+                            count=10,
                             date=datetime.date(2023, 1, 10),
                             created_on=datetime.date(2025, 4, 30),
                             updated_on=datetime.date(2025, 4, 30)),
         SpimexTradingResult(id=2,
                             exchange_product_id='A592AVM005A',
-                            exchange_product_name='Бензин (АИ-92-К5) по ГОСТ,'
-                                                  ' СН КНПЗ (самовывоз автотранспортом)',
+                            instrument_key=avm.id,
                             oil_id='A931',
                             delivery_basis_id='AVM',
-                            delivery_basis_name='СН КНПЗ',
+                            delivery_basis_key=knpz.id,
                             delivery_type_id='A',
-                            volume='25',
-                            total='59438602',
-                            count='1',
+                            volume=25,
+                            total=59438602,
+                            count=1,
                             date=datetime.date(2023, 1, 10),
                             created_on=datetime.date(2025, 4, 30),
                             updated_on=datetime.date(2025, 4, 30)),
         SpimexTradingResult(id=3,
                             exchange_product_id='A592ANK060F',
-                            exchange_product_name='Бензин (АИ-92-К5) по ГОСТ,'
-                                                  ' Ангарск-группа станций (ст. отправления)',
+                            instrument_key=ank.id,
                             oil_id='A458',
                             delivery_basis_id='KLI',
-                            delivery_basis_name='Ангарск-группа станций',
+                            delivery_basis_key=angarsk.id,
                             delivery_type_id='K',
-                            volume='600',
-                            total='24775140',
-                            count='10',
+                            volume=600,
+                            total=24775140,
+                            count=10,
                             date=datetime.date(2023, 1, 1),
                             created_on=datetime.date(2025, 4, 30),
                             updated_on=datetime.date(2025, 4, 30))
@@ -61,11 +76,8 @@ async def test_parse_spimex_behavior(mocker, relevance, capfd):
     fake_parser = mocker.Mock()
 
     fake_parser.get_data_from_query = mocker.AsyncMock(return_value=relevance)
-    fake_parser.download_tables = mocker.AsyncMock()
-    fake_parser.convert_to_df = mocker.Mock()
-    fake_parser.validate_tables = mocker.Mock()
-    fake_parser.add_columns = mocker.Mock()
-    fake_parser.load_to_db = mocker.AsyncMock()
+    fake_parser.run_pipeline = mocker.AsyncMock(return_value=3)
+    invalidate_cache = mocker.patch('src.api.service.invalidate_cache', mocker.AsyncMock())
 
     await parse_spimex(fake_parser)
 
@@ -75,17 +87,23 @@ async def test_parse_spimex_behavior(mocker, relevance, capfd):
 
     if relevance:
         assert 'Database has relevant data' in out
-        fake_parser.download_tables.assert_not_called()
-        fake_parser.convert_to_df.assert_not_called()
-        fake_parser.validate_tables.assert_not_called()
-        fake_parser.add_columns.assert_not_called()
-        fake_parser.load_to_db.assert_not_called()
+        fake_parser.run_pipeline.assert_not_called()
+        invalidate_cache.assert_not_called()
     else:
-        fake_parser.download_tables.assert_awaited_once()
-        fake_parser.convert_to_df.assert_called_once()
-        fake_parser.validate_tables.assert_called_once()
-        fake_parser.add_columns.assert_called_once()
-        fake_parser.load_to_db.assert_awaited_once()
+        fake_parser.run_pipeline.assert_awaited_once()
+        invalidate_cache.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_parse_spimex_keeps_cache_when_nothing_changed(mocker):
+    fake_parser = mocker.Mock()
+    fake_parser.get_data_from_query = mocker.AsyncMock(return_value=False)
+    fake_parser.run_pipeline = mocker.AsyncMock(return_value=0)
+    invalidate_cache = mocker.patch('src.api.service.invalidate_cache', mocker.AsyncMock())
+
+    await parse_spimex(fake_parser)
+
+    invalidate_cache.assert_not_called()
 
 
 @pytest.mark.asyncio
@@ -151,3 +169,211 @@ async def test_get_trading_results_with_filters(session, instances, setup_db):
 
     results_with_basis_id_filter = await get_trading_results(session, delivery_basis_id='KLI')
     assert len(results_with_basis_id_filter) == 0
+
+
+@pytest_asyncio.fixture
+async def year_of_results(session, setup_db):
+    # 250 trading days x 120 instruments, 40 oil ids and 30 delivery bases
+    await session.execute(text("""
+        INSERT INTO spimex_instruments (id, exchange_product_id, exchange_product_name)
+        SELECT p + 1, 'P' || p, 'product ' || p FROM generate_series(0, 119) AS p
+    """))
+    await session.execute(text("""
+        INSERT INTO spimex_delivery_bases (id, delivery_basis_name)
+        SELECT b + 1, 'basis ' || b FROM generate_series(0, 29) AS b
+    """))
+    await session.execute(text("""
+        INSERT INTO spimex_trading_results
+            (exchange_product_id, instrument_key, oil_id, delivery_basis_id,
+             delivery_basis_key, delivery_type_id, volume, total, count, date, created_on)
+        SELECT 'P' || p, p + 1, 'A' || (p % 40), 'B' || (p % 30),
+               p % 30 + 1, chr(65 + p % 5), 60, 4500000, 1,
+               DATE '2024-01-01' + d, DATE '2025-01-01'
+        FROM generate_series(0, 249) AS d, generate_series(0, 119) AS p
+    """))
+    await session.execute(text('ANALYZE spimex_trading_results'))
+    await session.commit()
+
+
+@pytest.fixture
+def captured_statements():
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(test_engine.sync_engine, 'before_cursor_execute', capture)
+    yield statements
+    event.remove(test_engine.sync_engine, 'before_cursor_execute', capture)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('call', [
+    lambda s: get_last_trading_dates(s, amount_of_days=10),
+    lambda s: get_dynamics(s, datetime.date(2024, 3, 1), datetime.date(2024, 3, 7)),
+    lambda s: get_dynamics(s, datetime.date(2024, 3, 1), datetime.date(2024, 3, 7), delivery_type_id='A'),
+    lambda s: get_dynamics(s, datetime.date(2024, 1, 1), datetime.date(2024, 12, 31), oil_id='A7'),
+    lambda s: get_dynamics(s, datetime.date(2024, 1, 1), datetime.date(2024, 12, 31), delivery_basis_id='B7'),
+    lambda s: get_dynamics(s, datetime.date(2024, 1, 1), datetime.date(2024, 12, 31),
+                           limit=100, cursor='2024-06-03.15000'),
+    lambda s: get_trading_results(s),
+    lambda s: get_trading_results(s, oil_id='A7', delivery_type_id='C'),
+])
+async def test_read_queries_use_indexes(session, year_of_results, captured_statements, call):
+    assert await call(session)
+
+    statement, parameters = captured_statements[-1]
+    connection = await session.connection()
+    plan = (await connection.exec_driver_sql(f'EXPLAIN {statement}', parameters)).scalars().all()
+
+    assert not any('Seq Scan on spimex_trading_results' in line for line in plan), '\n'.join(plan)
+
+
+# table scans of partitions, bitmap index scans name an index instead
+PARTITION_SCAN = re.compile(r'(?<!Bitmap )(?:Seq|Bitmap Heap|Index|Index Only) Scan (?:Backward )?'
+                            r'(?:using \S+ )?on spimex_trading_results_(\w+)')
+
+
+def scanned_partitions(plan: list[str]) -> set[str]:
+    # the newest date of get_trading_results is an InitPlan probing every partition once, and is known
+    # at execution only: partitions of other dates are then never executed
+    scanned, init_plan = set(), None
+    for line in plan:
+        indent = len(line) - len(line.lstrip())
+        if init_plan is not None and indent > init_plan:
+            continue
+        init_plan = indent if 'InitPlan' in line else None
+        scan = PARTITION_SCAN.search(line)
+        if scan and 'never executed' not in line:
+            scanned.add(scan.group(1))
+    return scanned
+
+
+@pytest_asyncio.fixture
+async def partitioned_years(session, setup_db):
+    # 2022-2024 every day x 20 instruments, moved out of the default partition into monthly ones
+    await session.execute(text("""
+        INSERT INTO spimex_instruments (id, exchange_product_id, exchange_product_name)
+        SELECT p + 1, 'P' || p, 'product ' || p FROM generate_series(0, 19) AS p
+    """))
+    await session.execute(text("INSERT INTO spimex_delivery_bases (id, delivery_basis_name) VALUES (1, 'basis')"))
+    await session.execute(text("""
+        INSERT INTO spimex_trading_results
+            (exchange_product_id, instrument_key, oil_id, delivery_basis_id,
+             delivery_basis_key, delivery_type_id, volume, total, count, date, created_on)
+        SELECT 'P' || p, p + 1, 'A' || (p % 4), 'B1', 1, 'A', 60, 4500000, 1, d::date, DATE '2025-01-01'
+        FROM generate_series(DATE '2022-01-01', DATE '2024-12-31', INTERVAL '1 day') AS d,
+             generate_series(0, 19) AS p
+    """))
+    await URLManager._create_partitions(session, 'spimex_trading_results')
+    await session.execute(text('ANALYZE spimex_trading_results'))
+    await session.commit()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('call, partitions', [
+    (lambda s: get_dynamics(s, datetime.date(2023, 3, 1), datetime.date(2023, 3, 7)), {'y2023m03'}),
+    (lambda s: get_dynamics(s, datetime.date(2023, 3, 25), datetime.date(2023, 4, 5), oil_id='A1'),
+     {'y2023m03', 'y2023m04'}),
+    (lambda s: get_trading_results(s), {'y2024m12'}),
+    (lambda s: get_trading_results(s, oil_id='A1'), {'y2024m12'}),
+])
+async def test_read_queries_scan_only_partitions_of_their_dates(session, partitioned_years, captured_statements,
+                                                                call, partitions):
+    assert await call(session)
+
+    statement, parameters = captured_statements[-1]
+    connection = await session.connection()
+    plan = (await connection.exec_driver_sql(f'EXPLAIN (ANALYZE, COSTS OFF, TIMING OFF, SUMMARY OFF) {statement}',
+                                             parameters)).scalars().all()
+
+    assert scanned_partitions(plan) == partitions, '\n'.join(plan)
+
+
+@pytest.mark.asyncio
+async def test_get_dynamics_pages_follow_the_cursor(session, year_of_results):
+    start_date, end_date = datetime.date(2024, 3, 1), datetime.date(2024, 3, 10)
+    expected = [result['id'] for result in await get_dynamics(session, start_date, end_date)]
+
+    ids, cursor = [], None
+    while True:
+        page = await get_dynamics(session, start_date, end_date, limit=250, cursor=cursor)
+        ids += [result['id'] for result in page]
+        if len(page) < 250:
+            break
+        cursor = encode_cursor(page[-1])
+
+    assert len(expected) == 1200
+    assert ids == expected
+
+
+@pytest.mark.asyncio
+async def test_read_functions_project_fields(session, instances, setup_db):
+    session.add_all(instances)
+    await session.commit()
+
+    dynamics = await get_dynamics(session, datetime.date(2023, 1, 1), datetime.date(2023, 1, 10),
+                                  fields=['volume', 'oil_id'])
+    assert [dict(row) for row in dynamics] == [
+        {'id': 3, 'oil_id': 'A458', 'volume': 600, 'date': datetime.date(2023, 1, 1)},
+        {'id': 1, 'oil_id': 'A600', 'volume': 600, 'date': datetime.date(2023, 1, 10)},
+        {'id': 2, 'oil_id': 'A931', 'volume': 25, 'date': datetime.date(2023, 1, 10)},
+    ]
+
+    results = await get_trading_results(session)
+    assert tuple(results[0].keys()) == RESULT_FIELDS
+    assert results[0]['delivery_basis_name'] == 'Ангарск-группа станций'
+    assert results[0]['exchange_product_name'].startswith('Бензин (АИ-92-К5) по ГОСТ, Ангарск')
+
+    with pytest.raises(ValueError, match='Unknown fields: price'):
+        await get_trading_results(session, fields=['price'])
+
+
+@pytest.mark.asyncio
+async def test_get_dynamics_rejects_invalid_cursor(session):
+    with pytest.raises(ValueError, match='Invalid cursor'):
+        await get_dynamics(session, datetime.date(2024, 3, 1), datetime.date(2024, 3, 10), cursor='page-2')
+
+
+@pytest.mark.asyncio
+async def test_stream_dynamics_reads_in_chunks(session, year_of_results, session_maker, mocker):
+    mocker.patch('src.api.service.Session', session_maker)
+
+    chunks = [chunk async for chunk in stream_dynamics(datetime.date(2024, 3, 1), datetime.date(2024, 3, 10),
+                                                       chunk_size=500)]
+
+    assert [len(chunk) for chunk in chunks] == [500, 500, 200]
+    assert chunks[0][0]['date'] == datetime.date(2024, 3, 1)
+    assert 'exchange_product_id' in chunks[0][0]
+
+
+def test_stream_dynamics_validates_period_on_call():
+    with pytest.raises(ValueError):
+        stream_dynamics(datetime.date(2024, 3, 10), datetime.date(2024, 3, 1))
+
+
+@pytest.mark.asyncio
+async def test_get_aggregates_filters_by_period_and_fields(session, setup_db):
+    session.add_all([
+        SpimexDailyAggregate(date=datetime.date(2023, 1, 10), oil_id='A600', delivery_basis_id='ALI',
+                             rows=2, volume=620, total=25000000),
+        SpimexDailyAggregate(date=datetime.date(2023, 1, 10), oil_id='A931', delivery_basis_id='AVM',
+                             rows=1, volume=25, total=59438602),
+        SpimexDailyAggregate(date=datetime.date(2023, 1, 1), oil_id='A600', delivery_basis_id='ALI',
+                             rows=1, volume=600, total=24775140),
+    ])
+    await session.commit()
+
+    results = await get_aggregates(session, datetime.date(2023, 1, 1), datetime.date(2023, 1, 10))
+    assert [(row['date'], row['oil_id']) for row in results] == [
+        (datetime.date(2023, 1, 1), 'A600'),
+        (datetime.date(2023, 1, 10), 'A600'),
+        (datetime.date(2023, 1, 10), 'A931'),
+    ]
+
+    results = await get_aggregates(session, datetime.date(2023, 1, 1), datetime.date(2023, 1, 10),
+                                   oil_id='A600', delivery_basis_id='ALI')
+    assert [row['volume'] for row in results] == [600, 620]
+
+    with pytest.raises(ValueError):
+        await get_aggregates(session, datetime.date(2023, 1, 10), datetime.date(2023, 1, 1))
@@ -0,0 +1,126 @@
+import datetime
+import os
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import text
+
+from src import snapshot
+from src.api.service import get_dynamics, publish_changes
+from src.config import settings
+from src.snapshot import current_snapshot, refresh_snapshot
+
+DIMENSIONS = ("""
+    INSERT INTO spimex_instruments (id, exchange_product_id, exchange_product_name)
+    SELECT p + 1, 'P' || p, 'product ' || p FROM generate_series(0, 49) AS p
+""", """
+    INSERT INTO spimex_delivery_bases (id, delivery_basis_name)
+    SELECT b + 1, 'basis ' || b FROM generate_series(0, 8) AS b
+""")
+SEED = """
+    INSERT INTO spimex_trading_results
+        (exchange_product_id, instrument_key, oil_id, delivery_basis_id,
+         delivery_basis_key, delivery_type_id, volume, total, count, date, created_on, updated_on)
+    SELECT 'P' || p, p + 1, 'A' || (p % 12), 'B' || (p % 9),
+           p % 9 + 1, chr(65 + p % 5), p * 10, p * 75000, 1 + p % 3,
+           DATE '{start}' + d, DATE '2025-01-01', CASE WHEN p % 7 = 0 THEN DATE '2025-02-01' END
+    FROM generate_series(0, {days} - 1) AS d, generate_series(0, 49) AS p
+    WHERE extract(isodow FROM DATE '{start}' + d) < 6
+"""
+
+
+@pytest_asyncio.fixture
+async def weekdays_of_results(session, setup_db):
+    # 44 trading days of January and February 2024 (no weekends) x 50 instruments
+    for statement in DIMENSIONS:
+        await session.execute(text(statement))
+    await session.execute(text(SEED.format(start='2024-01-01', days=60)))
+    await session.commit()
+
+
+@pytest.fixture(autouse=True)
+def snapshot_engine(mocker, tmp_path, session_maker):
+    mocker.patch.object(settings, 'DYNAMICS_ENGINE', 'snapshot')
+    mocker.patch.object(settings, 'SNAPSHOT_DIR', f'{tmp_path}/snapshot/')
+    mocker.patch('src.snapshot.Session', session_maker)
+    mocker.patch('src.snapshot._snapshot', None)
+
+
+async def from_postgres(session, *args, **kwargs) -> list[dict]:
+    engine = settings.DYNAMICS_ENGINE
+    settings.DYNAMICS_ENGINE = 'postgres'
+    try:
+        return [dict(row) for row in await get_dynamics(session, *args, **kwargs)]
+    finally:
+        settings.DYNAMICS_ENGINE = engine
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('args, kwargs', [
+    ((datetime.date(2024, 1, 1), datetime.date(2024, 2, 29)), {}),
+    ((datetime.date(2024, 1, 6), datetime.date(2024, 1, 9)), {}),  # starts on a weekend
+    ((datetime.date(2023, 12, 1), datetime.date(2024, 1, 3)), {'oil_id': 'A7'}),
+    ((datetime.date(2024, 1, 1), datetime.date(2024, 2, 29)), {'oil_id': 'A7', 'delivery_basis_id': 'B7'}),
+    ((datetime.date(2024, 1, 1), datetime.date(2024, 1, 31)), {'delivery_type_id': 'C', 'fields': ['volume']}),
+    ((datetime.date(2024, 1, 1), datetime.date(2024, 2, 29)), {'oil_id': 'A99'}),
+    ((datetime.date(2024, 3, 1), datetime.date(2024, 3, 31)), {}),
+    ((datetime.date(2024, 1, 1), datetime.date(2024, 2, 29)), {'limit': 70, 'cursor': '2024-01-05.0'}),
+    ((datetime.date(2024, 1, 1), datetime.date(2024, 2, 29)), {'limit': 70, 'cursor': '2024-01-06.120'}),
+    ((datetime.date(2024, 1, 1), datetime.date(2024, 2, 29)), {'limit': 30, 'cursor': '2024-01-03.120',
+                                                               'oil_id': 'A3'}),
+])
+async def test_snapshot_answers_like_postgres(session, weekdays_of_results, args, kwargs):
+    await refresh_snapshot()
+
+    results = await get_dynamics(None, *args, **kwargs)
+
+    assert results == await from_postgres(session, *args, **kwargs)
+    assert results or kwargs.get('oil_id') == 'A99' or args[0].month == 3
+
+
+@pytest.mark.asyncio
+async def test_snapshot_validates_like_postgres(session, weekdays_of_results):
+    await refresh_snapshot()
+
+    with pytest.raises(ValueError, match='Start date must be less or equal'):
+        await get_dynamics(None, datetime.date(2024, 2, 1), datetime.date(2024, 1, 1))
+    with pytest.raises(ValueError, match='Unknown fields: price'):
+        await get_dynamics(None, datetime.date(2024, 1, 1), datetime.date(2024, 2, 1), fields=['price'])
+    with pytest.raises(ValueError, match='Invalid cursor'):
+        await get_dynamics(None, datetime.date(2024, 1, 1), datetime.date(2024, 2, 1), cursor='last')
+
+
+@pytest.mark.asyncio
+async def test_postgres_answers_until_snapshot_is_built(session, weekdays_of_results):
+    assert current_snapshot() is None
+    assert len(await get_dynamics(session, datetime.date(2024, 1, 1), datetime.date(2024, 1, 1))) == 50
+
+
+@pytest.mark.asyncio
+async def test_refreshed_snapshot_replaces_the_current_one(session, weekdays_of_results):
+    period = (datetime.date(2024, 1, 1), datetime.date(2024, 12, 31))
+    await refresh_snapshot()
+    first = current_snapshot()
+    assert len(await get_dynamics(None, *period)) == 44 * 50
+
+    await session.execute(text(SEED.format(start='2024-03-01', days=5)))
+    await session.commit()
+    await refresh_snapshot()
+    await refresh_snapshot()
+
+    assert current_snapshot() is not first
+    assert len(await get_dynamics(None, *period)) == 47 * 50
+    assert len([entry for entry in os.listdir(settings.SNAPSHOT_DIR) if entry.isdigit()]) == snapshot.KEEP_VERSIONS
+
+
+@pytest.mark.asyncio
+async def test_ingestion_changes_refresh_the_snapshot(mocker):
+    refresh = mocker.patch('src.api.service.refresh_snapshot')
+    invalidate = mocker.patch('src.api.service.invalidate_cache')
+
+    await publish_changes()
+    settings.DYNAMICS_ENGINE = 'postgres'
+    await publish_changes()
+
+    assert refresh.await_count == 1
+    assert invalidate.await_count == 2